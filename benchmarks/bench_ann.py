@@ -0,0 +1,70 @@
+"""Recall@k vs latency of the IVF index against exact search.
+
+Usage: python -m benchmarks.bench_ann [--rows 200000] [--dim 768] [--nlist 256]
+
+Vectors are drawn from a Gaussian mixture so they cluster the way real
+embedding corpora do; queries are perturbed copies of corpus rows.
+"""
+import argparse
+import statistics
+import time
+
+import numpy as np
+
+from src.services.ann_index import IVFIndex
+from src.services.vector_index import normalize_rows, top_k
+
+
+def make_corpus(rows, dim, clusters, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim), dtype=np.float32)
+    labels = rng.integers(0, clusters, rows)
+    noise = rng.standard_normal((rows, dim), dtype=np.float32) * 2.0
+    return normalize_rows(centers[labels] + noise)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--nlist", type=int, default=256)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    matrix = make_corpus(args.rows, args.dim, clusters=args.nlist * 2)
+    rng = np.random.default_rng(1)
+    picks = rng.choice(args.rows, args.queries, replace=False)
+    queries = normalize_rows(matrix[picks] + rng.standard_normal((args.queries, args.dim), dtype=np.float32) * 0.02)
+
+    exact, exact_ms = [], []
+    for q in queries:
+        started = time.perf_counter()
+        exact.append({i for i, _ in top_k(matrix @ q, args.k)})
+        exact_ms.append((time.perf_counter() - started) * 1000)
+
+    ivf = IVFIndex(nlist=args.nlist)
+    started = time.perf_counter()
+    ivf.train(matrix)
+    train_s = time.perf_counter() - started
+    started = time.perf_counter()
+    ivf.add(matrix)
+    add_s = time.perf_counter() - started
+
+    print(f"rows={args.rows} dim={args.dim} nlist={args.nlist} train={train_s:.2f}s add={add_s:.2f}s")
+    print(f"{'search':>10} {'recall@' + str(args.k):>10} {'p50 ms':>8}")
+    print(f"{'exact':>10} {1.0:>10.3f} {statistics.median(exact_ms):>8.2f}")
+    for nprobe in args.nprobe:
+        hits, samples = 0, []
+        for q, truth in zip(queries, exact):
+            started = time.perf_counter()
+            found = ivf.search_batch(matrix, [q], args.k, nprobe=nprobe)[0]
+            samples.append((time.perf_counter() - started) * 1000)
+            hits += len(truth & {i for i, _ in found})
+        recall = hits / (args.k * len(queries))
+        print(f"{'nprobe=' + str(nprobe):>10} {recall:>10.3f} {statistics.median(samples):>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
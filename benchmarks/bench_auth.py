@@ -0,0 +1,86 @@
+"""Per-request cost of get_current_user with and without the auth cache.
+
+Usage: python -m benchmarks.bench_auth [--requests 5000] [--db-latency 0.002]
+
+MongoDB is replaced by an in-memory users collection that sleeps
+--db-latency seconds per round trip. --write-every invalidates the user
+after every N requests, like the usage $inc after each chat turn.
+"""
+import argparse
+import asyncio
+import time
+
+from bson import ObjectId
+
+import src.auth as auth
+import src.database as database
+from src.services.auth_cache import AuthCache
+
+
+class FakeUsers:
+    def __init__(self, latency):
+        self.latency = latency
+        self.docs = {}
+        self.round_trips = 0
+
+    async def find_one(self, query):
+        self.round_trips += 1
+        await asyncio.sleep(self.latency)
+        doc = self.docs.get(query["_id"])
+        return dict(doc) if doc else None
+
+
+class FakeDB:
+    def __init__(self, latency):
+        self.users = FakeUsers(latency)
+
+
+async def run(enabled, args):
+    db = FakeDB(args.db_latency)
+    database.db_config.db = db
+    auth.auth_cache = AuthCache(enabled=enabled)
+
+    tokens = []
+    for i in range(args.users):
+        user_id = ObjectId()
+        db.users.docs[user_id] = {"_id": user_id, "username": f"user{i}", "chatCount": 0, "totalTokens": 0}
+        tokens.append(auth.create_access_token({"_id": str(user_id)}))
+
+    latencies = []
+    started = time.perf_counter()
+    for i in range(args.requests):
+        token = tokens[i % len(tokens)]
+        t0 = time.perf_counter()
+        user = await auth.get_current_user(token)
+        latencies.append(time.perf_counter() - t0)
+        if args.write_every and i % args.write_every == 0:
+            auth.auth_cache.invalidate_user(str(user["_id"]))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "mean": sum(latencies) / len(latencies),
+        "p50": latencies[len(latencies) // 2],
+        "p99": latencies[int(len(latencies) * 0.99)],
+        "roundTrips": db.users.round_trips,
+        "throughput": args.requests / elapsed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--db-latency", type=float, default=0.002)
+    parser.add_argument("--write-every", type=int, default=10)
+    args = parser.parse_args()
+
+    print(f"{'cache':>5} {'mean us':>9} {'p50 us':>9} {'p99 us':>9} {'db trips':>9} {'req/s':>9}")
+    for enabled in (False, True):
+        r = asyncio.run(run(enabled, args))
+        print(f"{'on' if enabled else 'off':>5} {r['mean'] * 1e6:>9.1f} {r['p50'] * 1e6:>9.1f} "
+              f"{r['p99'] * 1e6:>9.1f} {r['roundTrips']:>9} {r['throughput']:>9.0f}")
+
+
+if __name__ == "__main__":
+    main()
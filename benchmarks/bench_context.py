@@ -0,0 +1,115 @@
+"""Context assembly: raw top-k chunks vs merged, multi-query and parent-window passages.
+
+Usage: python -m benchmarks.bench_context [--pages 60] [--queries 100] [--k 4] [--window 2000] [--mode hybrid]
+
+Splits synthetic contract pages with the app's splitter (1000-char chunks,
+200-char overlap, start offsets recorded) and indexes them with the local
+character-trigram embeddings from bench_hybrid. Each fact is asked about
+twice: "direct" names its product code; "follow-up" asks for its shipment
+region after a previous question that named the code. "hit" means the
+sentence stating the fact reached the budgeted prompt.
+  baseline   top-k chunk texts as search_similar_documents returns them
+  merged     the same hits, overlapping ones joined by offset
+  multi      question + follow-up variant (one batched embedding call), fused, merged
+  window     multi, each passage grown to --window characters
+Context tokens use the prompt service estimator; "llm ms" is the local fake
+LLM answering the budgeted prompt, whose time to first token grows with
+prompt length (--prefill-tps prompt tokens per second).
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import tempfile
+import time
+
+from benchmarks.bench_hybrid import TOPICS, TrigramEmbeddings
+from src.services.document_service import DocumentService, _make_splitter
+from src.services.fake_backends import FakeChatModel
+from src.services.passages import MULTI_QUERY_VARIANTS, query_variants
+from src.services.prompt_service import PromptService, estimate_tokens
+from src.services.vector_index import VectorIndex
+
+
+def make_pages(pages, sentences_per_page, seed=0):
+    from langchain_core.documents import Document
+    rng = random.Random(seed)
+    docs, facts = [], []
+    for p in range(pages):
+        sentences = []
+        for s in range(sentences_per_page):
+            topic, _ = rng.choice(TOPICS)
+            code = f"PX-{rng.randrange(100000):05d}"
+            sentences.append(f"Clause {p + 1}.{s + 1} on {topic} applies to product code {code} "
+                             f"for shipments in region {rng.randrange(40)}.")
+            facts.append((code, sentences[-1]))
+        docs.append(Document(page_content=" ".join(sentences), metadata={"source": "bench.pdf", "page": p}))
+    return docs, facts
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=60)
+    parser.add_argument("--sentences", type=int, default=30)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--window", type=int, default=2000)
+    parser.add_argument("--mode", choices=["hybrid", "vector", "keyword"], default="hybrid")
+    parser.add_argument("--prefill-tps", type=float, default=4000.0)
+    args = parser.parse_args()
+
+    docs, facts = make_pages(args.pages, args.sentences)
+    splits = _make_splitter().split_documents(docs)
+    texts = [s.page_content for s in splits]
+    embeddings = TrigramEmbeddings()
+    service = DocumentService(tempfile.mkdtemp())
+    VectorIndex.write(service.collections.path("bench", "doc"), embeddings.embed_documents(texts), texts,
+                      [s.metadata for s in splits])
+    questions = random.Random(1).sample(facts, min(args.queries, len(facts)))
+    print(f"pages={args.pages} chunks={len(texts)} questions={len(questions)} k={args.k} mode={args.mode}")
+
+    prompts = PromptService()
+    model = FakeChatModel(first_token_latency=0.05, tokens_per_second=1000, answer_tokens=20,
+                          prefill_tokens_per_second=args.prefill_tps)
+    configs = [
+        ("baseline", 1, False, 0),
+        ("merged", 1, True, 0),
+        ("multi", MULTI_QUERY_VARIANTS, True, 0),
+        ("window", MULTI_QUERY_VARIANTS, True, args.window),
+    ]
+    print(f"{'config':>9} {'kind':>10} {'hit':>6} {'passages':>9} {'ctx tokens':>11} {'retrieve ms':>12} "
+          f"{'llm ms':>7}")
+    for name, count, merge, window in configs:
+        for kind in ("direct", "follow-up"):
+            hits, passages, tokens, retrieval, llm = 0, [], [], [], []
+            for code, sentence in questions:
+                previous = f"Which clause covers product code {code}?"
+                if kind == "direct":
+                    question, history = previous, []
+                else:
+                    question = "Which shipment region does that clause apply to?"
+                    history = [{"role": "user", "content": previous}, {"role": "assistant", "content": "See above."}]
+                variants = query_variants(question, history, count)
+                # One batched call per question regardless of the variant count
+                query_vectors = embeddings.embed_documents(variants)
+                started = time.perf_counter()
+                if name == "baseline":
+                    context = [text for text, _ in service._search("bench", ["doc"], variants, query_vectors,
+                                                                   args.k, args.mode)[0]]
+                else:
+                    context = [p["text"] for p in service._retrieve_context(
+                        "bench", ["doc"], variants, query_vectors, args.k, args.mode, merge, window)]
+                retrieval.append((time.perf_counter() - started) * 1000)
+                prompt, _ = prompts.build_budgeted_prompt(context, question, history)
+                hits += sentence in prompt
+                passages.append(len(context))
+                tokens.append(sum(estimate_tokens(text) for text in context))
+                started = time.perf_counter()
+                asyncio.run(model.ainvoke(prompt))
+                llm.append((time.perf_counter() - started) * 1000)
+            print(f"{name:>9} {kind:>10} {hits / len(questions):>6.3f} {statistics.mean(passages):>9.2f} "
+                  f"{statistics.mean(tokens):>11.1f} {statistics.median(retrieval):>12.2f} "
+                  f"{statistics.mean(llm):>7.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""Embedding throughput of the batched, concurrent scheduler.
+
+Usage: python -m benchmarks.bench_embedding [--chunks 2000] [--latency 0.3]
+
+Runs against FakeEmbeddings with a fixed per-request latency, so the numbers
+show scheduling overhead and concurrency gains rather than provider speed.
+"""
+import argparse
+import asyncio
+import time
+
+from src.services.embedding_scheduler import EmbeddingScheduler, TokenBucket
+from src.services.fake_backends import FakeEmbeddings
+
+
+async def run(args, concurrency):
+    embeddings = FakeEmbeddings(dim=args.dim, latency=args.latency, failure_rate=args.failure_rate)
+    scheduler = EmbeddingScheduler(
+        embeddings,
+        batch_size=args.batch_size,
+        max_concurrency=concurrency,
+        rate_limiter=TokenBucket(args.rpm / 60.0),
+        base_delay=0.05,
+    )
+    texts = [f"chunk {i}" for i in range(args.chunks)]
+
+    # Measure event-loop responsiveness while embedding runs
+    lags = []
+    done = asyncio.Event()
+
+    async def probe():
+        while not done.is_set():
+            started = time.perf_counter()
+            await asyncio.sleep(0.01)
+            lags.append(time.perf_counter() - started - 0.01)
+
+    prober = asyncio.create_task(probe())
+    started = time.perf_counter()
+    first = None
+    async for _ in scheduler.stream(texts):
+        if first is None:
+            first = time.perf_counter() - started
+    elapsed = time.perf_counter() - started
+    done.set()
+    await prober
+    return elapsed, first, max(lags) * 1000, scheduler.stats["retries"]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=2000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0.3)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--rpm", type=float, default=1500)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    print(f"{'concurrency':>11} {'total s':>8} {'first batch s':>14} {'max loop lag ms':>16} {'retries':>8}")
+    for concurrency in args.concurrency:
+        elapsed, first, lag, retries = asyncio.run(run(args, concurrency))
+        print(f"{concurrency:>11} {elapsed:>8.2f} {first:>14.3f} {lag:>16.1f} {retries:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""Chat history reads on a large messages collection, before and after indexing.
+
+Usage: python -m benchmarks.bench_history [--uri mongodb://localhost:27017] [--messages 2000000]
+
+Needs a running mongod; everything goes to a scratch database (--db, dropped
+first). Seeds --messages synthetic messages spread over --users users plus
+one heavy user, then measures for the heavy user:
+  recent     the 6-message prompt history: full documents without an index
+             vs projected role/content with the (userId, timestamp, _id) index
+  pages      history page at increasing depth: skip/limit vs keyset cursor
+Documents examined come from explain("executionStats").
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient
+
+import src.database as database
+from src.services.chat_service import ChatService, HISTORY_PROJECTION, HISTORY_SORT, decode_history_cursor
+
+
+async def seed(db, args, heavy_user):
+    rng = random.Random(0)
+    users = [ObjectId() for _ in range(args.users)]
+    start = datetime.utcnow() - timedelta(days=365)
+    filler = "lorem ipsum dolor sit amet consectetur adipiscing elit " * 4
+    batch = []
+    started = time.perf_counter()
+    for i in range(args.messages):
+        user_id = heavy_user if i % args.heavy_every == 0 else users[rng.randrange(len(users))]
+        batch.append({
+            "userId": user_id,
+            "role": "user" if i % 2 == 0 else "assistant",
+            "content": f"message {i} " + filler,
+            "timestamp": start + timedelta(seconds=i * 10),
+            # Fields a full-document read drags along for nothing
+            "model": "gemini-2.0-flash",
+            "sources": [rng.randrange(1000) for _ in range(4)],
+        })
+        if len(batch) == 10000:
+            await db.messages.insert_many(batch, ordered=False)
+            batch = []
+    if batch:
+        await db.messages.insert_many(batch, ordered=False)
+    print(f"seeded {args.messages} messages in {time.perf_counter() - started:.1f}s")
+
+
+async def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        await fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+async def examined(cursor):
+    plan = await cursor.explain()
+    return plan["executionStats"]["totalDocsExamined"]
+
+
+async def main_async(args):
+    client = AsyncIOMotorClient(args.uri)
+    await client.drop_database(args.db)
+    db = client[args.db]
+    database.db_config.db = db
+    service = ChatService()
+    heavy_user = ObjectId()
+    await seed(db, args, heavy_user)
+
+    def recent_full():
+        return db.messages.find({"userId": heavy_user}).sort("timestamp", -1).limit(6)
+
+    def recent_projected():
+        return db.messages.find({"userId": heavy_user}, HISTORY_PROJECTION).sort(HISTORY_SORT).limit(6)
+
+    print(f"{'recent history':>28} {'median ms':>10} {'docs examined':>14}")
+    ms = await timed(lambda: recent_full().to_list(length=6), args.repeat)
+    print(f"{'no index, full documents':>28} {ms:>10.2f} {await examined(recent_full()):>14}")
+
+    started = time.perf_counter()
+    await database.ensure_indexes(db)
+    print(f"index build {time.perf_counter() - started:.1f}s")
+    ms = await timed(lambda: service.get_recent_history(str(heavy_user), 6), args.repeat)
+    print(f"{'index, projected':>28} {ms:>10.2f} {await examined(recent_projected()):>14}")
+
+    print(f"{'page depth':>10} {'skip ms':>9} {'skip examined':>14} {'keyset ms':>10} {'keyset examined':>16}")
+    cursor, depth = None, 0
+    for target in args.depths:
+        while depth < target:
+            _, cursor = await service.get_history_page(str(heavy_user), args.page_size, cursor)
+            depth += 1
+        if cursor is None:
+            break
+
+        def skip_page():
+            return (db.messages.find({"userId": heavy_user}, HISTORY_PROJECTION)
+                    .sort(HISTORY_SORT).skip(depth * args.page_size).limit(args.page_size))
+
+        def keyset_page():
+            timestamp, message_id = decode_history_cursor(cursor)
+            query = {"userId": heavy_user, "$or": [
+                {"timestamp": {"$lt": timestamp}},
+                {"timestamp": timestamp, "_id": {"$lt": message_id}},
+            ]}
+            return db.messages.find(query, HISTORY_PROJECTION).sort(HISTORY_SORT).limit(args.page_size + 1)
+
+        skip_ms = await timed(lambda: skip_page().to_list(length=args.page_size), args.repeat)
+        keyset_ms = await timed(lambda: service.get_history_page(str(heavy_user), args.page_size, cursor),
+                                args.repeat)
+        print(f"{depth:>10} {skip_ms:>9.2f} {await examined(skip_page()):>14} {keyset_ms:>10.2f} "
+              f"{await examined(keyset_page()):>16}")
+
+    if not args.keep:
+        await client.drop_database(args.db)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--uri", default="mongodb://localhost:27017")
+    parser.add_argument("--db", default="rag_history_bench")
+    parser.add_argument("--messages", type=int, default=2_000_000)
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--heavy-every", type=int, default=20)
+    parser.add_argument("--page-size", type=int, default=50)
+    parser.add_argument("--depths", type=int, nargs="+", default=[1, 10, 100, 1000])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--keep", action="store_true")
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""Retrieval quality and latency: vector vs BM25 keyword vs hybrid (RRF).
+
+Usage: python -m benchmarks.bench_hybrid [--chunks 2000] [--k 4]
+
+Builds one document collection from synthetic contract clauses and runs a
+small labelled query set against it:
+  identifier  "Which clause covers product code PX-04729?"
+  clause      "What does clause 12.7 say?"
+  topical     a paraphrase of the clause's subject
+Dense vectors come from a local character-trigram hashing model, which,
+like real embedding models, is good at topical similarity but blurs
+near-identical codes and numbers. Latency excludes the embedding call;
+"embed calls" shows which modes need one per query.
+"""
+import argparse
+import hashlib
+import random
+import statistics
+import tempfile
+import time
+
+import numpy as np
+
+from src.services.document_service import DocumentService
+from src.services.vector_index import VectorIndex
+
+TOPICS = [
+    ("termination for convenience with thirty days written notice", "how much notice is needed to terminate"),
+    ("late payment interest accrues monthly on overdue invoices", "interest charged on overdue payments"),
+    ("limitation of liability capped at fees paid in twelve months", "cap on total liability"),
+    ("confidential information must not be disclosed to third parties", "disclosing confidential material"),
+    ("warranty against defects in materials and workmanship", "warranty for defective materials"),
+    ("force majeure excuses delays caused by events beyond control", "delays from events outside our control"),
+    ("governing law and exclusive jurisdiction of state courts", "which law governs and where to sue"),
+    ("assignment requires prior written consent of the other party", "consent needed to assign the contract"),
+    ("indemnification against third party intellectual property claims", "indemnity for patent infringement claims"),
+    ("data protection obligations for personal information processing", "rules for processing personal data"),
+    ("service level availability of ninety nine point nine percent", "guaranteed service availability"),
+    ("audit rights to inspect records once per calendar year", "yearly inspection of records"),
+]
+
+
+class TrigramEmbeddings:
+    def __init__(self, dim=512):
+        self.dim = dim
+
+    def _embed(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        padded = f"  {text.lower()}  "
+        for i in range(len(padded) - 2):
+            digest = hashlib.blake2b(padded[i:i + 3].encode(), digest_size=4).digest()
+            vector[int.from_bytes(digest, "little") % self.dim] += 1.0
+        return (vector / (np.linalg.norm(vector) or 1.0)).tolist()
+
+    def embed_documents(self, texts):
+        return [self._embed(t) for t in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+    async def aembed_documents(self, texts):
+        return self.embed_documents(texts)
+
+    async def aembed_query(self, text):
+        return self.embed_query(text)
+
+
+def make_eval(chunks, seed=0):
+    rng = random.Random(seed)
+    texts, queries = [], []
+    for i in range(chunks):
+        topic, paraphrase = TOPICS[i % len(TOPICS)]
+        clause = f"{i // 20 + 1}.{i % 20 + 1}"
+        code = f"PX-{rng.randrange(100000):05d}"
+        texts.append(f"Clause {clause}: {topic}. Product code {code} is covered under this clause "
+                     f"and the schedule applies to shipments in region {rng.randrange(40)}.")
+        queries.append(("identifier", f"Which clause covers product code {code}?", {i}))
+        queries.append(("clause", f"What does clause {clause} say?", {i}))
+    for topic_id, (_, paraphrase) in enumerate(TOPICS):
+        relevant = {i for i in range(chunks) if i % len(TOPICS) == topic_id}
+        queries.append(("topical", paraphrase, relevant))
+    return texts, queries
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=2000)
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--k", type=int, default=4)
+    args = parser.parse_args()
+
+    texts, queries = make_eval(args.chunks)
+    rng = random.Random(1)
+    rng.shuffle(queries)
+    # Keep every topical query; sample the rest
+    topical = [q for q in queries if q[0] == "topical"]
+    queries = topical + [q for q in queries if q[0] != "topical"][:max(0, args.queries - len(topical))]
+    embeddings = TrigramEmbeddings()
+    service = DocumentService(tempfile.mkdtemp())
+    service.embeddings = embeddings
+    started = time.perf_counter()
+    VectorIndex.write(service.collections.path("bench", "doc"), embeddings.embed_documents(texts), texts)
+    print(f"chunks={args.chunks} queries={len(queries)} build={time.perf_counter() - started:.2f}s")
+    keywords = service.collections.get("bench", "doc").index.keyword_index()
+    print(f"postings={len(keywords.postings)} keyword index={keywords.nbytes() / 1024:.0f} KiB")
+
+    row_of = {text: i for i, text in enumerate(texts)}
+    print(f"{'mode':>8} {'kind':>10} {'hit@' + str(args.k):>7} {'MRR':>6} {'p50 ms':>7} {'p95 ms':>7} {'embed calls':>12}")
+    for mode in ("vector", "keyword", "hybrid"):
+        by_kind, samples = {}, []
+        for kind, query, relevant in queries:
+            query_vectors = [embeddings.embed_query(query)] if mode != "keyword" else None
+            t0 = time.perf_counter()
+            hits = service._search("bench", ["doc"], [query], query_vectors, args.k, mode)[0]
+            samples.append((time.perf_counter() - t0) * 1000)
+            ranks = [rank for rank, (text, _) in enumerate(hits) if row_of[text] in relevant]
+            by_kind.setdefault(kind, []).append(1.0 / (ranks[0] + 1) if ranks else 0.0)
+        samples.sort()
+        calls = len(queries) if mode != "keyword" else 0
+        for kind in ("identifier", "clause", "topical"):
+            scores = by_kind.get(kind, [])
+            if not scores:
+                continue
+            hit = sum(1 for s in scores if s > 0) / len(scores)
+            print(f"{mode:>8} {kind:>10} {hit:>7.3f} {statistics.mean(scores):>6.3f} "
+                  f"{statistics.median(samples):>7.2f} {samples[int(len(samples) * 0.95)]:>7.2f} {calls:>12}")
+
+
+if __name__ == "__main__":
+    main()
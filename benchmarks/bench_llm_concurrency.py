@@ -0,0 +1,55 @@
+"""Chat throughput vs concurrency with a local fake LLM.
+
+Usage: python -m benchmarks.bench_llm_concurrency [--requests 64] [--latency 0.5]
+
+"blocking" reproduces the old handler, which called the synchronous
+chat_model.invoke() on the event loop; "pooled" is ChatService's bounded
+async path. Only the pooled numbers should grow with concurrency.
+"""
+import argparse
+import asyncio
+import time
+
+from src.services.chat_service import ChatService
+from src.services.concurrency import BoundedExecutor
+from src.services.fake_backends import FakeChatModel
+
+
+async def run(mode, args, concurrency):
+    service = ChatService()
+    service.chat_model = FakeChatModel(first_token_latency=args.latency, tokens_per_second=args.tps,
+                                       answer_tokens=args.tokens)
+    service.pool = BoundedExecutor("llm", args.pool_size, timeout=120)
+    gate = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with gate:
+            if mode == "blocking":
+                return service.chat_model.invoke(f"question {i}").content
+            return await service.generate_response(f"question {i}")
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(args.requests)))
+    elapsed = time.perf_counter() - started
+    return args.requests / elapsed, service.pool.metrics()["maxWaiting"]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--tps", type=float, default=200.0)
+    parser.add_argument("--tokens", type=int, default=40)
+    parser.add_argument("--pool-size", type=int, default=16)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 32])
+    args = parser.parse_args()
+
+    print(f"{'mode':>9} {'concurrency':>11} {'req/s':>8} {'max queued':>11}")
+    for mode in ("blocking", "pooled"):
+        for concurrency in args.concurrency:
+            throughput, queued = asyncio.run(run(mode, args, concurrency))
+            print(f"{mode:>9} {concurrency:>11} {throughput:>8.2f} {queued:>11}")
+
+
+if __name__ == "__main__":
+    main()
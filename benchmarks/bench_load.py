@@ -0,0 +1,421 @@
+"""End-to-end load test of the full app on local stand-ins, with JSON results.
+
+Usage: python -m benchmarks.bench_load [--scenarios login upload chat] [--concurrency 16]
+                                       [--requests 200] [--output run.json] [--compare base.json]
+
+Starts `uvicorn main:app` in a subprocess with CHAT_BACKEND=fake,
+EMBEDDING_BACKEND=fake and MONGODB_URI=memory:// (or --mongodb-uri for a
+real mongod), scratch data directories, and the fake latencies given on the
+command line. It registers --users users, then runs each scenario as a
+closed loop of --concurrency clients until --requests requests are done:
+  login    POST /api/auth/login (bcrypt on the password pool)
+  upload   POST /api/upload/ of a --pdf-pages page PDF, then polls the job;
+           "upload" times the 202, "ingest" the time until the job is done
+  chat     POST /api/chat/ against one uploaded document per user (answer
+           cache bypassed unless --answer-cache; --stream adds time to first token)
+Prints one JSON document: per scenario p50/p95/p99/mean latency (ms),
+throughput (req/s) and errors; mean server-side stage times from /metrics;
+the server's RSS after each scenario (supervisor and workers summed) and
+the peak RSS of its largest process. --compare prints p50/p95/throughput changes
+against an earlier run. Needs httpx.
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import httpx
+
+from benchmarks.pdf_fixture import make_pdf
+
+QUESTIONS = [
+    "What does clause {n} cover?",
+    "Which product code is mentioned in section {n}?",
+    "Summarise the warranty terms for clause {n}.",
+    "Is product code PX-{n:05d} covered?",
+]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * q))]
+
+
+def summarize(latencies, errors, elapsed, extra=None):
+    values = sorted(latencies)
+    ms = lambda v: round(v * 1000, 2) if v is not None else None
+    result = {
+        "requests": len(values) + errors,
+        "errors": errors,
+        "p50Ms": ms(percentile(values, 0.50)),
+        "p95Ms": ms(percentile(values, 0.95)),
+        "p99Ms": ms(percentile(values, 0.99)),
+        "meanMs": ms(sum(values) / len(values)) if values else None,
+        "throughput": round(len(values) / elapsed, 2) if elapsed else None,
+    }
+    result.update(extra or {})
+    return result
+
+
+def process_tree(pid):
+    # pid and all its descendants, from the parent ids in /proc/<pid>/stat
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # The command name may contain spaces; fields resume after ")"
+                parent = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(parent, []).append(int(entry))
+    tree, stack = [], [pid]
+    while stack:
+        current = stack.pop()
+        tree.append(current)
+        stack.extend(children.get(current, []))
+    return tree
+
+
+def rss_mb(pid):
+    # Current resident size of the server: with --workers the uvicorn
+    # supervisor plus every worker process. From /proc (Linux); None elsewhere
+    if not os.path.isdir("/proc"):
+        return None
+    total = 0
+    for member in process_tree(pid):
+        try:
+            with open(f"/proc/{member}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1])
+        except OSError:
+            # Exited since the tree was listed
+            continue
+    return round(total / 1024, 1)
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL,
+                                       text=True).strip()
+    except Exception:
+        return None
+
+
+async def closed_loop(concurrency, requests, call):
+    # `concurrency` clients, each sending its next request as soon as the
+    # previous one is answered, until `requests` have been sent in total.
+    # `call` returns False on failure, True, or its own latency in seconds.
+    latencies, errors, counter = [], 0, iter(range(requests))
+
+    async def client():
+        nonlocal errors
+        for i in counter:
+            started = time.perf_counter()
+            try:
+                ok = await call(i)
+            except httpx.HTTPError:
+                ok = False
+            if ok is False:
+                errors += 1
+            else:
+                # A call may report its own latency (a number) instead of True
+                latencies.append(time.perf_counter() - started if ok is True else ok)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return latencies, errors, time.perf_counter() - started
+
+
+class LoadRun:
+    def __init__(self, client, args):
+        self.client = client
+        self.args = args
+        self.users = []
+
+    def auth(self, user):
+        return {"Authorization": f"Bearer {user['token']}"}
+
+    async def register_users(self):
+        semaphore = asyncio.Semaphore(self.args.concurrency)
+
+        async def register(i):
+            async with semaphore:
+                name = f"bench-{i}-{os.getpid()}"
+                r = await self.client.post("/api/auth/register", json={"username": name, "password": "bench-pass"})
+                r.raise_for_status()
+                self.users.append({"username": name, "token": r.json()["token"]})
+
+        await asyncio.gather(*(register(i) for i in range(self.args.users)))
+
+    async def upload(self, user, pages, tag):
+        pdf = make_pdf(pages, seed_text=f"Section {tag}")
+        r = await self.client.post("/api/upload/", headers=self.auth(user),
+                                   files={"file": (f"{tag}.pdf", pdf, "application/pdf")})
+        if r.status_code != 202:
+            return None
+        return r.json()["jobId"]
+
+    async def wait_for_job(self, user, job_id, timeout=300):
+        deadline = time.perf_counter() + timeout
+        while time.perf_counter() < deadline:
+            r = await self.client.get(f"/api/upload/jobs/{job_id}", headers=self.auth(user))
+            state = r.json().get("state") if r.status_code == 200 else None
+            if state in ("completed", "failed"):
+                return state == "completed"
+            await asyncio.sleep(0.05)
+        return False
+
+    async def login(self):
+        async def call(i):
+            user = self.users[i % len(self.users)]
+            r = await self.client.post("/api/auth/login", json={"username": user["username"], "password": "bench-pass"})
+            return r.status_code == 200
+
+        return summarize(*await closed_loop(self.args.concurrency, self.args.requests, call))
+
+    async def upload_scenario(self):
+        # Each client waits for its job before the next upload, so the
+        # ingestion queue is never flooded; the 202 and the finished job are
+        # timed separately
+        ingest, ingest_errors = [], 0
+
+        async def call(i):
+            nonlocal ingest_errors
+            user = self.users[i % len(self.users)]
+            started = time.perf_counter()
+            job_id = await self.upload(user, self.args.pdf_pages, f"load-{i}")
+            if job_id is None:
+                return False
+            accepted = time.perf_counter() - started
+            if await self.wait_for_job(user, job_id):
+                ingest.append(time.perf_counter() - started)
+            else:
+                ingest_errors += 1
+            return accepted
+
+        requests = self.args.upload_requests or self.args.requests
+        latencies, errors, elapsed = await closed_loop(self.args.concurrency, requests, call)
+        return {
+            "upload": summarize(latencies, errors, elapsed),
+            "ingest": summarize(ingest, ingest_errors, elapsed, {"pages": self.args.pdf_pages}),
+        }
+
+    async def chat(self):
+        # One small document per user, ingested before the clock starts
+        semaphore = asyncio.Semaphore(8)
+
+        async def prepare(n, user):
+            async with semaphore:
+                job_id = await self.upload(user, 4, f"chat-{n}")
+                if not job_id or not await self.wait_for_job(user, job_id):
+                    raise Exception(f"setup upload failed for {user['username']}")
+
+        await asyncio.gather(*(prepare(n, u) for n, u in enumerate(self.users)))
+        headers = {} if self.args.answer_cache else {"X-Answer-Cache": "off"}
+        first_token = []
+
+        async def call(i):
+            user = self.users[i % len(self.users)]
+            question = QUESTIONS[i % len(QUESTIONS)].format(n=i % 97 + 1)
+            body = {"message": question, "stream": self.args.stream}
+            if not self.args.stream:
+                r = await self.client.post("/api/chat/", json=body, headers={**self.auth(user), **headers})
+                return r.status_code == 200
+            started = time.perf_counter()
+            async with self.client.stream("POST", "/api/chat/", json=body,
+                                          headers={**self.auth(user), **headers}) as r:
+                if r.status_code != 200:
+                    return False
+                ok, seen_token = False, False
+                async for line in r.aiter_lines():
+                    if line.startswith("event: token") and not seen_token:
+                        first_token.append(time.perf_counter() - started)
+                        seen_token = True
+                    elif line.startswith("event: done"):
+                        ok = True
+                    elif line.startswith("event: error"):
+                        return False
+                return ok
+
+        latencies, errors, elapsed = await closed_loop(self.args.concurrency, self.args.requests, call)
+        extra = {"stream": self.args.stream}
+        if first_token:
+            ttft = sorted(first_token)
+            extra.update({"firstTokenP50Ms": round(percentile(ttft, 0.5) * 1000, 2),
+                          "firstTokenP95Ms": round(percentile(ttft, 0.95) * 1000, 2)})
+        return summarize(latencies, errors, elapsed, extra)
+
+    async def stages(self):
+        # Mean time per serving stage, from the server's Prometheus histograms
+        r = await self.client.get("/metrics")
+        sums, counts = {}, {}
+        for line in r.text.splitlines():
+            if not line.startswith("rag_stage_duration_seconds_"):
+                continue
+            name, value = line.rsplit(" ", 1)
+            stage = name.split('stage="', 1)[1].split('"', 1)[0]
+            if name.startswith("rag_stage_duration_seconds_sum"):
+                sums[stage] = float(value)
+            elif name.startswith("rag_stage_duration_seconds_count"):
+                counts[stage] = int(float(value))
+        return {s: {"count": counts[s], "meanMs": round(sums[s] / counts[s] * 1000, 2)}
+                for s in sorted(counts) if counts[s]}
+
+
+def server_env(args, scratch):
+    env = dict(os.environ)
+    env.update({
+        "CHAT_BACKEND": "fake",
+        "EMBEDDING_BACKEND": "fake",
+        "MONGODB_URI": args.mongodb_uri,
+        "JWT_SECRET": env.get("JWT_SECRET", "bench-secret"),
+        "VECTOR_INDEX_DIR": os.path.join(scratch, "collections"),
+        "UPLOAD_DIR": os.path.join(scratch, "uploads"),
+        "EMBEDDING_CACHE_PATH": os.path.join(scratch, "embedding_cache.sqlite3"),
+        "FAKE_LLM_FIRST_TOKEN_LATENCY": str(args.llm_latency),
+        "FAKE_LLM_TOKENS_PER_SECOND": str(args.llm_tps),
+        "FAKE_LLM_ANSWER_TOKENS": str(args.answer_tokens),
+        "FAKE_EMBEDDING_LATENCY": str(args.embed_latency),
+        "FAKE_EMBEDDING_DIM": str(args.embed_dim),
+        "FAKE_DB_LATENCY": str(args.db_latency),
+        "LOG_LEVEL": "WARNING",
+    })
+    return env
+
+
+async def run_scenarios(args, base_url, pid):
+    results, rss = {}, {}
+    limits = httpx.Limits(max_connections=args.concurrency * 2)
+    async with httpx.AsyncClient(base_url=base_url, timeout=120, limits=limits) as client:
+        run = LoadRun(client, args)
+        await run.register_users()
+        for scenario in args.scenarios:
+            if scenario == "login":
+                results["login"] = await run.login()
+            elif scenario == "upload":
+                results.update(await run.upload_scenario())
+            elif scenario == "chat":
+                results["chat"] = await run.chat()
+            rss[scenario] = rss_mb(pid)
+        stages = await run.stages()
+    return results, stages, rss
+
+
+def wait_until_up(base_url, process, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise Exception(f"server exited with code {process.returncode}")
+        try:
+            if httpx.get(f"{base_url}/readyz", timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise Exception("server did not become ready")
+
+
+def compare(current, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"{'scenario':>10} {'p50 ms':>18} {'p95 ms':>18} {'req/s':>16}", file=sys.stderr)
+    for name, now in current["scenarios"].items():
+        before = baseline.get("scenarios", {}).get(name)
+        if not before:
+            continue
+        cells = []
+        for key in ("p50Ms", "p95Ms", "throughput"):
+            a, b = before.get(key), now.get(key)
+            change = f"{(b - a) / a:+.0%}" if a and b is not None else "n/a"
+            cells.append(f"{a}->{b} {change}")
+        print(f"{name:>10} {cells[0]:>18} {cells[1]:>18} {cells[2]:>16}", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scenarios", nargs="+", default=["login", "upload", "chat"],
+                        choices=["login", "upload", "chat"])
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--upload-requests", type=int, default=0, help="defaults to --requests")
+    parser.add_argument("--users", type=int, default=16)
+    parser.add_argument("--pdf-pages", type=int, default=20)
+    parser.add_argument("--stream", action="store_true")
+    parser.add_argument("--answer-cache", action="store_true")
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="fake time to first token (s)")
+    parser.add_argument("--llm-tps", type=float, default=50.0, help="fake answer tokens per second")
+    parser.add_argument("--answer-tokens", type=int, default=60)
+    parser.add_argument("--embed-latency", type=float, default=0.05, help="fake seconds per embedding call")
+    parser.add_argument("--embed-dim", type=int, default=768)
+    parser.add_argument("--db-latency", type=float, default=0.0, help="round trip of the in-memory MongoDB")
+    parser.add_argument("--mongodb-uri", default="memory://")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--output")
+    parser.add_argument("--compare")
+    args = parser.parse_args()
+    if args.workers > 1 and args.mongodb_uri.startswith("memory://"):
+        # Every worker would get its own empty in-memory database: a user
+        # registered on one worker could not log in on another
+        parser.error("--workers > 1 needs a shared MongoDB, pass --mongodb-uri mongodb://...")
+
+    scratch = tempfile.mkdtemp(prefix="rag-load-")
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    command = [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+               "--log-level", "warning", "--workers", str(args.workers)]
+    env = server_env(args, scratch)
+    env["WEB_CONCURRENCY"] = str(args.workers)
+    process = subprocess.Popen(command, env=env)
+    try:
+        started = time.perf_counter()
+        wait_until_up(base_url, process)
+        startup = time.perf_counter() - started
+        results, stages, rss = asyncio.run(run_scenarios(args, base_url, process.pid))
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    peak_mb = peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+    report = {
+        "benchmark": "load",
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "gitCommit": git_commit(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+        "startupSeconds": round(startup, 2),
+        "scenarios": results,
+        "stages": stages,
+        "rssAfterScenarioMb": rss,
+        "peakRssMb": round(peak_mb, 1),
+    }
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == "__main__":
+    main()
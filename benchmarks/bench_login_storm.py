@@ -0,0 +1,101 @@
+"""Chat streaming latency during a burst of logins.
+
+Usage: python -m benchmarks.bench_login_storm [--logins 40] [--streams 8]
+
+Streams answers from a local fake LLM while --logins password checks
+arrive at once. "inline" verifies on the event loop like the old login
+handler; "pooled" goes through the bounded password pool, so only the
+logins wait and token gaps should stay close to the idle baseline.
+--backend pbkdf2 swaps bcrypt for a hashlib stand-in of similar cost,
+for environments where passlib cannot load bcrypt.
+"""
+import argparse
+import asyncio
+import hashlib
+import time
+
+import src.auth as auth
+from src.services.chat_service import ChatService
+from src.services.concurrency import BoundedExecutor, PoolSaturatedError
+from src.services.fake_backends import FakeChatModel
+
+
+def use_backend(args):
+    if args.backend == "bcrypt":
+        return auth.get_password_hash("correct horse")
+    salt = b"bench-salt"
+    hashed = hashlib.pbkdf2_hmac("sha256", b"correct horse", salt, args.pbkdf2_rounds)
+    auth.verify_password = lambda plain, _: hashlib.pbkdf2_hmac(
+        "sha256", plain.encode(), salt, args.pbkdf2_rounds) == hashed
+    return hashed
+
+
+async def stream_gaps(service, prompt):
+    gaps = []
+    last = None
+    async for _ in service.stream_response(prompt):
+        now = time.perf_counter()
+        if last is not None:
+            gaps.append(now - last)
+        last = now
+    return gaps
+
+
+async def run(mode, args, hashed):
+    service = ChatService()
+    service.chat_model = FakeChatModel(first_token_latency=0.01, tokens_per_second=args.tps,
+                                       answer_tokens=args.tokens)
+    auth.password_pool = BoundedExecutor("password", args.pool_size, timeout=60, max_queue=args.max_queue)
+    outcomes = {"ok": 0, "rejected": 0}
+
+    async def login():
+        if mode == "inline":
+            auth.verify_password("correct horse", hashed)
+            outcomes["ok"] += 1
+            return
+        try:
+            await auth.verify_password_async("correct horse", hashed)
+            outcomes["ok"] += 1
+        except PoolSaturatedError:
+            outcomes["rejected"] += 1
+
+    async def storm():
+        await asyncio.sleep(0.05)
+        if mode != "idle":
+            await asyncio.gather(*(login() for _ in range(args.logins)))
+
+    started = time.perf_counter()
+    results = await asyncio.gather(storm(), *(stream_gaps(service, f"q{i}") for i in range(args.streams)))
+    elapsed = time.perf_counter() - started
+    gaps = sorted(g for stream in results[1:] for g in stream)
+    return {
+        "p50": gaps[len(gaps) // 2],
+        "p99": gaps[int(len(gaps) * 0.99)],
+        "max": gaps[-1],
+        "elapsed": elapsed,
+        **outcomes,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--logins", type=int, default=40)
+    parser.add_argument("--streams", type=int, default=8)
+    parser.add_argument("--tokens", type=int, default=200)
+    parser.add_argument("--tps", type=float, default=50.0)
+    parser.add_argument("--pool-size", type=int, default=2)
+    parser.add_argument("--max-queue", type=int, default=32)
+    parser.add_argument("--backend", choices=["bcrypt", "pbkdf2"], default="bcrypt")
+    parser.add_argument("--pbkdf2-rounds", type=int, default=200000)
+    args = parser.parse_args()
+    hashed = use_backend(args)
+
+    print(f"{'mode':>7} {'gap p50 ms':>11} {'gap p99 ms':>11} {'gap max ms':>11} {'logins ok':>10} {'rejected':>9} {'seconds':>8}")
+    for mode in ("idle", "inline", "pooled"):
+        r = asyncio.run(run(mode, args, hashed))
+        print(f"{mode:>7} {r['p50'] * 1000:>11.1f} {r['p99'] * 1000:>11.1f} {r['max'] * 1000:>11.1f} "
+              f"{r['ok']:>10} {r['rejected']:>9} {r['elapsed']:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
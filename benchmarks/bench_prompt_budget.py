@@ -0,0 +1,95 @@
+"""Prompt size and model latency: unbounded prompt vs token-budgeted prompt.
+
+Usage: python -m benchmarks.bench_prompt_budget [--budgets 1000 1500 2000 3000]
+
+Replays a conversation with long assistant answers against four 1000-char
+chunks. "legacy" is build_prompt with six raw history messages; the budgeted
+rows use build_budgeted_prompt with a rolling summary. Latency comes from
+the local fake LLM, whose time to first token grows with prompt length
+(--prefill-tps prompt tokens per second).
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+from src.services.fake_backends import FakeChatModel
+from src.services.prompt_service import PromptService, estimate_tokens
+
+WORDS = ("the agreement supplier customer invoice payment clause warranty liability notice "
+         "termination period days service level data protection audit records schedule").split()
+
+
+def sentence(rng, words):
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def paragraph(rng, chars):
+    text = ""
+    while len(text) < chars:
+        text += sentence(rng, rng.randint(8, 20)) + " "
+    return text[:chars]
+
+
+def make_turns(rng, turns, answer_chars):
+    history = []
+    for _ in range(turns):
+        history.append({"role": "user", "content": paragraph(rng, 120)})
+        history.append({"role": "assistant", "content": paragraph(rng, answer_chars)})
+    return history
+
+
+async def measure(model, prompts):
+    latencies = []
+    for prompt in prompts:
+        started = time.perf_counter()
+        await model.ainvoke(prompt)
+        latencies.append(time.perf_counter() - started)
+    return statistics.mean(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--questions", type=int, default=20)
+    parser.add_argument("--answer-chars", type=int, default=1500)
+    parser.add_argument("--budgets", type=int, nargs="+", default=[1000, 1500, 2000, 3000])
+    parser.add_argument("--prefill-tps", type=float, default=4000.0)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    service = PromptService()
+    summary = paragraph(rng, 900)
+    cases = []
+    for i in range(args.questions):
+        history = make_turns(rng, 3, args.answer_chars)
+        chunks = [paragraph(rng, 1000) for _ in range(4)]
+        cases.append((f"What does clause {i} say about payment?", history, chunks))
+
+    model = FakeChatModel(first_token_latency=0.05, tokens_per_second=1000, answer_tokens=20,
+                          prefill_tokens_per_second=args.prefill_tps)
+
+    print(f"{'builder':>14} {'tokens':>7} {'chars':>7} {'chunks':>7} {'history':>8} {'build ms':>9} {'llm ms':>7}")
+    rows = [("legacy", None)] + [(f"budget {b}", b) for b in args.budgets]
+    for name, budget in rows:
+        prompts, stats, build = [], [], []
+        for question, history, chunks in cases:
+            started = time.perf_counter()
+            if budget is None:
+                prompt = service.build_prompt("\n\n".join(chunks), question, history)
+                used = {"chunks": len(chunks), "historyMessages": len(history)}
+            else:
+                prompt, used = service.build_budgeted_prompt(chunks, question, history, summary, budget=budget)
+            build.append((time.perf_counter() - started) * 1000)
+            prompts.append(prompt)
+            stats.append(used)
+        latency = asyncio.run(measure(model, prompts))
+        print(f"{name:>14} {statistics.mean(estimate_tokens(p) for p in prompts):>7.0f} "
+              f"{statistics.mean(len(p) for p in prompts):>7.0f} "
+              f"{statistics.mean(s['chunks'] for s in stats):>7.2f} "
+              f"{statistics.mean(s['historyMessages'] for s in stats):>8.2f} "
+              f"{statistics.mean(build):>9.2f} {latency * 1000:>7.0f}")
+
+
+if __name__ == "__main__":
+    main()
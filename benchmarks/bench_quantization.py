@@ -0,0 +1,67 @@
+"""Memory and recall of compact vector storage: float32 vs float16, int8 and PQ.
+
+Usage: python -m benchmarks.bench_quantization [--rows 100000] [--dim 768] [--rerank 0 100]
+
+Uses the clustered corpus and perturbed-row queries of bench_ann. Each
+storage mode is written with write_compact_vectors and searched through
+CompactVectors, with and without exact float32 re-ranking of the top
+--rerank candidates. "MB/1M" is what a full scan keeps resident per
+million chunks (codes plus codebook, scaled from --rows); recall@k is
+measured against exact float32 search.
+"""
+import argparse
+import statistics
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.bench_ann import make_corpus
+from src.services.quantization import CompactVectors, write_compact_vectors
+from src.services.vector_index import normalize_rows, top_k
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--rerank", type=int, nargs="+", default=[0, 100])
+    args = parser.parse_args()
+
+    matrix = make_corpus(args.rows, args.dim, clusters=512)
+    rng = np.random.default_rng(1)
+    picks = rng.choice(args.rows, args.queries, replace=False)
+    queries = normalize_rows(matrix[picks] + rng.standard_normal((args.queries, args.dim), dtype=np.float32) * 0.02)
+    exact = [{i for i, _ in top_k(matrix @ q, args.k)} for q in queries]
+    scale = 1_000_000 / args.rows
+
+    print(f"rows={args.rows} dim={args.dim} k={args.k} queries={args.queries}")
+    print(f"{'storage':>8} {'rerank':>7} {'bytes/row':>10} {'MB/1M':>8} {'encode s':>9} "
+          f"{'recall@' + str(args.k):>9} {'p50 ms':>8}")
+    for storage in ("float32", "float16", "int8", "pq"):
+        path = tempfile.mkdtemp()
+        started = time.perf_counter()
+        files = write_compact_vectors(path, "bench", matrix, storage)
+        encode = time.perf_counter() - started
+        compact = CompactVectors.load(path, files, args.rows, args.dim)
+        nbytes = compact.nbytes() if compact is not None else matrix.nbytes
+        for rerank in (args.rerank if compact is not None else [0]):
+            if compact is not None:
+                compact.rerank = rerank
+            hits, samples = 0, []
+            for q, truth in zip(queries, exact):
+                started = time.perf_counter()
+                if compact is None:
+                    found = top_k(matrix @ q, args.k)
+                else:
+                    found = compact.search_batch(matrix, q[None, :], args.k)[0]
+                samples.append((time.perf_counter() - started) * 1000)
+                hits += len(truth & {i for i, _ in found})
+            print(f"{storage:>8} {rerank:>7} {nbytes / args.rows:>10.1f} {nbytes * scale / 2**20:>8.0f} "
+                  f"{encode:>9.2f} {hits / (args.k * len(queries)):>9.3f} {statistics.median(samples):>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
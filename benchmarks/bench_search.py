@@ -0,0 +1,79 @@
+"""Query latency of the vectorized top-k search path.
+
+Usage: python -m benchmarks.bench_search [--sizes 1000 100000 1000000] [--dim 768]
+
+The matrix is generated in slices into a memory-mapped temp file so the 1M
+case does not need the full float32 matrix (~3 GB at dim 768) twice in RAM.
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+import numpy as np
+
+from src.services.vector_index import normalize_rows, top_k
+
+
+def build_matrix(path, rows, dim, seed=0):
+    rng = np.random.default_rng(seed)
+    matrix = np.memmap(path, dtype=np.float32, mode="w+", shape=(rows, dim))
+    step = 50_000
+    for start in range(0, rows, step):
+        end = min(rows, start + step)
+        matrix[start:end] = normalize_rows(rng.standard_normal((end - start, dim), dtype=np.float32))
+    matrix.flush()
+    return np.memmap(path, dtype=np.float32, mode="r", shape=(rows, dim))
+
+
+def naive_search(matrix, query, k):
+    # Roughly what a per-document Python similarity loop costs
+    scored = [(float(np.dot(row, query)), i) for i, row in enumerate(matrix)]
+    scored.sort(reverse=True)
+    return scored[:k]
+
+
+def time_it(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 100_000, 1_000_000])
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--batch", type=int, default=16)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(1)
+    queries = normalize_rows(rng.standard_normal((args.batch, args.dim), dtype=np.float32))
+
+    print(f"{'chunks':>10} {'naive ms':>10} {'single ms':>10} {'batch ms/q':>11}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for rows in args.sizes:
+            matrix = build_matrix(os.path.join(tmp, f"m{rows}.f32"), rows, args.dim)
+            matrix @ queries[0]  # warm the page cache
+
+            naive = "-"
+            if rows <= 100_000:
+                naive = f"{time_it(lambda: naive_search(matrix, queries[0], args.k), 1):.1f}"
+            single = time_it(lambda: top_k(matrix @ queries[0], args.k), args.repeat)
+
+            def batched():
+                scores = matrix @ queries.T
+                return [top_k(scores[:, j], args.k) for j in range(scores.shape[1])]
+
+            batch = time_it(batched, args.repeat) / args.batch
+            print(f"{rows:>10} {naive:>10} {single:>10.2f} {batch:>11.2f}")
+            del matrix
+
+
+if __name__ == "__main__":
+    main()
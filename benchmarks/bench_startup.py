@@ -0,0 +1,179 @@
+"""Cold start: import time of main.py and time until the server answers.
+
+Usage: python -m benchmarks.bench_startup [--repeat 5] [--top 10] [--output startup.json]
+
+Everything runs in fresh interpreter processes with the local stand-ins
+(CHAT_BACKEND=fake, EMBEDDING_BACKEND=fake, MONGODB_URI=memory://), so no
+network or API key is involved and runs are comparable between machines
+and CI jobs:
+  import     `import main` in a new interpreter (median of --repeat), plus
+             the --top slowest top-level imports from -X importtime
+  serve      spawn `uvicorn main:app` and poll: time to the first 200 from
+             /healthz and from /readyz
+  first use  register, upload a small PDF and ask two questions; the first
+             chat includes any model initialisation left to the first request
+             (compare --warmup off with the default background warm-up)
+Prints one JSON document.
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from benchmarks.bench_load import free_port, git_commit
+from benchmarks.pdf_fixture import make_pdf
+
+IMPORT_SNIPPET = "import time; t = time.perf_counter(); import main; print(time.perf_counter() - t)"
+
+
+def stand_in_env(scratch, warmup):
+    env = dict(os.environ)
+    env.update({
+        "CHAT_BACKEND": "fake",
+        "EMBEDDING_BACKEND": "fake",
+        "MONGODB_URI": "memory://",
+        "JWT_SECRET": env.get("JWT_SECRET", "bench-secret"),
+        "VECTOR_INDEX_DIR": os.path.join(scratch, "collections"),
+        "UPLOAD_DIR": os.path.join(scratch, "uploads"),
+        "EMBEDDING_CACHE_PATH": os.path.join(scratch, "embedding_cache.sqlite3"),
+        "FAKE_LLM_FIRST_TOKEN_LATENCY": "0.05",
+        "FAKE_LLM_TOKENS_PER_SECOND": "1000",
+        "FAKE_EMBEDDING_LATENCY": "0.01",
+        "MODEL_WARMUP": warmup,
+        "LOG_LEVEL": "WARNING",
+    })
+    return env
+
+
+def import_seconds(env):
+    out = subprocess.check_output([sys.executable, "-c", IMPORT_SNIPPET], env=env, text=True)
+    return float(out.strip().splitlines()[-1])
+
+
+def slowest_imports(env, top):
+    # -X importtime writes "self | cumulative | <indent>module" to stderr;
+    # main's own imports sit one level below it
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"], env=env,
+                            capture_output=True, text=True)
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line or "self [us]" in line:
+            continue
+        _, cumulative, name = line.split("|", 2)
+        depth = (len(name) - len(name.lstrip())) // 2
+        if depth == 1:
+            rows.append((int(cumulative), name.strip()))
+    rows.sort(reverse=True)
+    return [{"module": name, "ms": round(us / 1000, 1)} for us, name in rows[:top]]
+
+
+def wait_for(url, started, process, timeout=60):
+    while time.perf_counter() - started < timeout:
+        if process.poll() is not None:
+            raise Exception(f"server exited with code {process.returncode}")
+        try:
+            if httpx.get(url, timeout=1).status_code == 200:
+                return time.perf_counter() - started
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.01)
+    raise Exception(f"{url} did not answer 200 within {timeout}s")
+
+
+def first_use(base_url, timeout=120):
+    with httpx.Client(base_url=base_url, timeout=60) as client:
+        r = client.post("/api/auth/register", json={"username": f"startup-{os.getpid()}", "password": "bench-pass"})
+        r.raise_for_status()
+        headers = {"Authorization": f"Bearer {r.json()['token']}", "X-Answer-Cache": "off"}
+        started = time.perf_counter()
+        r = client.post("/api/upload/", headers=headers, files={"file": ("s.pdf", make_pdf(2), "application/pdf")})
+        r.raise_for_status()
+        job_id = r.json()["jobId"]
+        deadline = started + timeout
+        while True:
+            state = client.get(f"/api/upload/jobs/{job_id}", headers=headers).json().get("state")
+            if state == "completed":
+                break
+            if state == "failed":
+                raise Exception(f"upload job {job_id} failed")
+            if time.perf_counter() > deadline:
+                raise Exception(f"upload job {job_id} not done within {timeout}s (state {state})")
+            time.sleep(0.01)
+        upload = time.perf_counter() - started
+        chats = []
+        for question in ("What does clause 3 cover?", "What does clause 4 cover?"):
+            started = time.perf_counter()
+            client.post("/api/chat/", json={"message": question}, headers=headers).raise_for_status()
+            chats.append(time.perf_counter() - started)
+    return upload, chats
+
+
+def serve_once(warmup):
+    # A scratch directory per run: an embedding cache or index left by the
+    # previous run would make its first upload look faster than a cold one
+    scratch = tempfile.mkdtemp(prefix="rag-startup-")
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1",
+                                "--port", str(port), "--log-level", "warning"], env=stand_in_env(scratch, warmup))
+    try:
+        healthz = wait_for(f"{base_url}/healthz", started, process)
+        readyz = wait_for(f"{base_url}/readyz", started, process)
+        upload, chats = first_use(base_url)
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+        shutil.rmtree(scratch, ignore_errors=True)
+    return {"healthz": healthz, "readyz": readyz, "firstUpload": upload, "firstChat": chats[0], "secondChat": chats[1]}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--warmup", choices=["on", "off"], default="on")
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    scratch = tempfile.mkdtemp(prefix="rag-startup-")
+    try:
+        env = stand_in_env(scratch, args.warmup)
+        imports = [import_seconds(env) for _ in range(args.repeat)]
+        serves = [serve_once(args.warmup) for _ in range(args.repeat)]
+        top = slowest_imports(env, args.top)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    median_ms = lambda values: round(statistics.median(values) * 1000, 1)
+    report = {
+        "benchmark": "startup",
+        "gitCommit": git_commit(),
+        "python": sys.version.split()[0],
+        "repeat": args.repeat,
+        "warmup": args.warmup,
+        "importMainMs": median_ms(imports),
+        "importMainMinMs": round(min(imports) * 1000, 1),
+        "firstHealthzMs": median_ms([s["healthz"] for s in serves]),
+        "firstReadyzMs": median_ms([s["readyz"] for s in serves]),
+        "firstUploadMs": median_ms([s["firstUpload"] for s in serves]),
+        "firstChatMs": median_ms([s["firstChat"] for s in serves]),
+        "secondChatMs": median_ms([s["secondChat"] for s in serves]),
+        "slowestImports": top,
+    }
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
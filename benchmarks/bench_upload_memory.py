@@ -0,0 +1,74 @@
+"""Peak Python heap while several large uploads are saved concurrently.
+
+Usage: python -m benchmarks.bench_upload_memory [--uploads 4] [--size-mb 200]
+
+Compares the old whole-file `await file.read()` copy with the chunked
+save_upload_file path. Request bodies are spooled to disk first, as
+Starlette does, so only the copy itself shows up in the measurement.
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+import tracemalloc
+
+import aiofiles
+from starlette.datastructures import UploadFile
+
+from src.services.upload_service import save_upload_file
+
+
+def make_upload(path, size_mb):
+    handle = open(path, "rb")
+    return UploadFile(file=handle, filename=os.path.basename(path), size=size_mb * 1024 * 1024)
+
+
+async def read_whole(upload, dest):
+    async with aiofiles.open(dest, "wb") as out_file:
+        content = await upload.read()
+        await out_file.write(content)
+
+
+async def read_chunked(upload, dest):
+    await save_upload_file(upload, dest, max_bytes=1 << 40)
+
+
+async def measure(copy, sources, tmp):
+    uploads = [make_upload(path, 0) for path in sources]
+    tracemalloc.start()
+    started = time.perf_counter()
+    await asyncio.gather(*(copy(u, os.path.join(tmp, f"out-{i}.pdf")) for i, u in enumerate(uploads)))
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    for upload in uploads:
+        upload.file.close()
+    return peak / (1024 * 1024), elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--uploads", type=int, default=4)
+    parser.add_argument("--size-mb", type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        sources = []
+        block = os.urandom(1024 * 1024)
+        for i in range(args.uploads):
+            path = os.path.join(tmp, f"in-{i}.pdf")
+            with open(path, "wb") as f:
+                for _ in range(args.size_mb):
+                    f.write(block)
+            sources.append(path)
+
+        print(f"{args.uploads} concurrent uploads x {args.size_mb} MB")
+        print(f"{'copy':>10} {'peak heap MB':>13} {'seconds':>8}")
+        for name, copy in (("whole", read_whole), ("chunked", read_chunked)):
+            peak, elapsed = asyncio.run(measure(copy, sources, tmp))
+            print(f"{name:>10} {peak:>13.1f} {elapsed:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
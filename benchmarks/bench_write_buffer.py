@@ -0,0 +1,81 @@
+"""Chat turn write cost: direct MongoDB writes vs the write-behind buffer.
+
+Usage: python -m benchmarks.bench_write_buffer [--users 50] [--turns 20] [--db-latency 0.003]
+
+Each turn saves two messages and increments the user's usage counters, as
+chat_routes._record_turn does. MongoDB is the in-memory FakeDatabase with
+--db-latency seconds per round trip. After the buffered run is drained the
+stored messages and counters are checked against the direct run.
+"""
+import argparse
+import asyncio
+import time
+
+from bson import ObjectId
+
+import src.database as database
+from src.services.chat_service import ChatService
+from src.services.fake_backends import FakeDatabase
+
+
+async def run(buffered, args):
+    db = FakeDatabase(latency=args.db_latency)
+    database.db_config.db = db
+    service = ChatService()
+    users = [ObjectId() for _ in range(args.users)]
+    for user_id in users:
+        db.users.docs.append({"_id": user_id, "chatCount": 0, "totalTokens": 0})
+    if buffered:
+        service.writes.start()
+
+    latencies = []
+
+    async def user_session(user_id):
+        for turn in range(args.turns):
+            started = time.perf_counter()
+            await service.save_message(str(user_id), "user", f"question {turn}")
+            await service.save_message(str(user_id), "assistant", f"answer {turn}")
+            await service.record_usage(user_id, 10)
+            latencies.append(time.perf_counter() - started)
+            await asyncio.sleep(args.think_time)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(user_session(u) for u in users))
+    elapsed = time.perf_counter() - started
+    if buffered:
+        await service.writes.stop()
+
+    expected_turns = args.turns
+    counters_ok = all(d["chatCount"] == expected_turns and d["totalTokens"] == 10 * expected_turns
+                      for d in db.users.docs)
+    messages_ok = len(db.messages.docs) == 2 * args.users * args.turns
+    round_trips = sum(sum(c.calls.values()) for c in db._collections.values())
+    latencies.sort()
+    return {
+        "p50": latencies[len(latencies) // 2],
+        "p99": latencies[int(len(latencies) * 0.99)],
+        "turnsPerSecond": len(latencies) / elapsed,
+        "roundTrips": round_trips,
+        "consistent": counters_ok and messages_ok,
+        "flushes": service.writes.stats["flushes"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument("--db-latency", type=float, default=0.003)
+    parser.add_argument("--think-time", type=float, default=0.01)
+    args = parser.parse_args()
+
+    print(f"{'writes':>9} {'p50 ms':>8} {'p99 ms':>8} {'turns/s':>8} {'round trips':>12} {'flushes':>8} {'consistent':>11}")
+    for buffered in (False, True):
+        r = asyncio.run(run(buffered, args))
+        print(f"{'buffered' if buffered else 'direct':>9} {r['p50'] * 1000:>8.2f} {r['p99'] * 1000:>8.2f} "
+              f"{r['turnsPerSecond']:>8.0f} {r['roundTrips']:>12} {r['flushes']:>8} {str(r['consistent']):>11}")
+    print(f"mean of {args.users * args.turns} turns per mode")
+
+
+if __name__ == "__main__":
+    main()
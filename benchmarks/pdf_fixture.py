@@ -0,0 +1,44 @@
+"""Generates small text PDFs for benchmarks without any PDF library."""
+
+
+def make_pdf(pages: int = 10, lines_per_page: int = 40, seed_text: str = "Section") -> bytes:
+    objects = []
+
+    def add(body: bytes) -> int:
+        objects.append(body)
+        return len(objects)
+
+    font = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    pages_id = len(objects) + 1  # reserved below, after page objects are known
+    objects.append(None)
+
+    page_ids = []
+    for p in range(pages):
+        lines = [
+            f"{seed_text} {p + 1}.{i + 1}: clause {p * lines_per_page + i} covers product code "
+            f"PX-{(p * 7919 + i * 104729) % 100000:05d} and its warranty terms."
+            for i in range(lines_per_page)
+        ]
+        text = " T* ".join(f"({line})" + " Tj" for line in lines)
+        stream = f"BT /F1 9 Tf 11 TL 40 800 Td {text} ET".encode("latin-1")
+        content = add(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        page_ids.append(add(
+            b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 612 842] "
+            b"/Resources << /Font << /F1 %d 0 R >> >> /Contents %d 0 R >>" % (pages_id, font, content)
+        ))
+
+    kids = b" ".join(b"%d 0 R" % i for i in page_ids)
+    objects[pages_id - 1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(page_ids))
+    catalog = add(b"<< /Type /Catalog /Pages %d 0 R >>" % pages_id)
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, catalog, xref)
+    return bytes(out)
@@ -1,4 +1,7 @@
+import asyncio
+import logging
 import os
+import time
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
@@ -8,8 +11,23 @@ import uvicorn
 # Load environment variables
 load_dotenv()
 
-from src.database import connect_db
-from src.routes import auth_routes, chat_routes, upload_routes, prompt_routes
+from src.logging_config import configure_logging
+configure_logging()
+logger = logging.getLogger("main")
+
+from src.database import connect_db, close_db
+from src.routes import auth_routes, chat_routes, upload_routes, prompt_routes, health_routes
+from src.services.ingestion_jobs import ingestion_jobs
+from src.services.chat_service import chat_service, CHAT_BACKEND
+from src.services.embedding_service import embedding_service, EMBEDDING_BACKEND
+from src.services.document_service import document_service
+from src.auth import pwd_context
+from src.services.metrics import (SERVER_TIMING, REQUEST_SECONDS, start_request,
+                                  server_timing_header)
+
+# Import and build model clients in the background once the server is up,
+# rather than at import time or on the first request
+MODEL_WARMUP = os.getenv("MODEL_WARMUP", "on").lower() not in ("0", "off", "false")
 
 app = FastAPI(title="RAG Python Backend")
 
@@ -22,25 +40,84 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def instrument_requests(request: Request, call_next):
+    # Latency histogram per route template, plus a Server-Timing header with
+    # the stages (history, retrieval, llm, ...) recorded while handling it.
+    # Streamed responses send headers first, so their header only covers the
+    # stages that ran before the first byte.
+    timings = start_request()
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+    finally:
+        elapsed = time.perf_counter() - started
+        route = request.scope.get("route")
+        route = ROUTE_TEMPLATES.get(id(route)) or getattr(route, "path_format", None) or "unmatched"
+        REQUEST_SECONDS.observe(elapsed, request.method, route, str(status))
+    if SERVER_TIMING:
+        response.headers["Server-Timing"] = server_timing_header(timings, elapsed)
+    return response
+
 # Startup event
 @app.on_event("startup")
 async def startup_event():
     await connect_db()
-    print("✓ Connected to MongoDB")
+    logger.info("✓ Connected to MongoDB (indexes ready, connection pool warm)")
     
     # Check for API Key
     api_key = os.getenv("GOOGLE_API_KEY")
-    if not api_key or api_key == "your_google_api_key_here":
-        print("\n❌ ERROR: Google API Key is missing or invalid!")
-        print("📝 Please update your .env file with a valid GOOGLE_API_KEY")
+    if CHAT_BACKEND == "fake" and EMBEDDING_BACKEND == "fake":
+        logger.info("✓ Using local fake chat and embedding backends")
+    elif not api_key or api_key == "your_google_api_key_here":
+        logger.error("❌ Google API Key is missing or invalid!")
+        logger.error("📝 Please update your .env file with a valid GOOGLE_API_KEY")
     else:
-        print("✓ Google API Key detected")
+        logger.info("✓ Google API Key detected")
+
+    await ingestion_jobs.start()
+    chat_service.writes.start()
+
+    if MODEL_WARMUP:
+        # Runs in a thread after startup returns, so the server is already
+        # accepting requests; the first chat or upload finds everything loaded
+        app.state.warmup = asyncio.create_task(asyncio.to_thread(_warm_up))
+
+def _warm_up():
+    started = time.perf_counter()
+    for name, step in (("chat model", chat_service._ensure_model), ("embeddings", embedding_service.get_embeddings),
+                       ("pdf parser", document_service.warm_up), ("password hashing", pwd_context)):
+        try:
+            step()
+        except Exception as e:
+            logger.warning(f"Warm-up of {name} skipped: {str(e)}")
+    logger.info(f"✓ Background warm-up finished in {time.perf_counter() - started:.2f}s")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await ingestion_jobs.stop()
+    # Flush buffered chat messages and usage counters before exiting
+    await chat_service.writes.stop()
+    await close_db()
+
+# Full path template per route, for the latency histogram label. Newer
+# FastAPI versions put the route as declared on its router in
+# scope["route"], whose path lacks the prefix it was included under.
+ROUTE_TEMPLATES = {}
+
+def include_router(router, prefix: str = "", **kwargs):
+    app.include_router(router, prefix=prefix, **kwargs)
+    for route in router.routes:
+        ROUTE_TEMPLATES[id(route)] = prefix + getattr(route, "path_format", "")
 
 # Include Routes
-app.include_router(auth_routes.router, prefix="/api/auth", tags=["Authentication"])
-app.include_router(chat_routes.router, prefix="/api/chat", tags=["Chat"])
-app.include_router(upload_routes.router, prefix="/api/upload", tags=["Upload"])
-app.include_router(prompt_routes.router, prefix="/api/system-prompt", tags=["System Prompt"])
+include_router(auth_routes.router, prefix="/api/auth", tags=["Authentication"])
+include_router(chat_routes.router, prefix="/api/chat", tags=["Chat"])
+include_router(upload_routes.router, prefix="/api/upload", tags=["Upload"])
+include_router(prompt_routes.router, prefix="/api/system-prompt", tags=["System Prompt"])
+include_router(health_routes.router, tags=["Health"])
 
 # Serve Static Files (Frontend)
 app.mount("/", StaticFiles(directory="public", html=True), name="static")
@@ -1,24 +1,45 @@
+import functools
 import os
 import jwt
 from datetime import datetime, timedelta
-from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from src.database import get_db
+from src.services.auth_cache import auth_cache
+from src.services.concurrency import BoundedExecutor
 from bson import ObjectId
 
 SECRET_KEY = os.getenv("JWT_SECRET", "your_secret_key")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7 # 1 week
+# bcrypt costs 100-300 ms of CPU per call; it runs on this many threads
+PASSWORD_POOL_SIZE = int(os.getenv("PASSWORD_POOL_SIZE", 2))
+PASSWORD_MAX_QUEUE = int(os.getenv("PASSWORD_MAX_QUEUE", 32))
+PASSWORD_TIMEOUT = float(os.getenv("PASSWORD_TIMEOUT", 10))
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/auth/login")
+# bcrypt releases the GIL, so threads keep hashing off the event loop
+# without a process pool. A full queue raises PoolSaturatedError.
+password_pool = BoundedExecutor("password", PASSWORD_POOL_SIZE, timeout=PASSWORD_TIMEOUT,
+                                max_queue=PASSWORD_MAX_QUEUE)
+
+@functools.lru_cache(maxsize=None)
+def pwd_context():
+    # passlib is imported on the first login/registration, not at startup
+    from passlib.context import CryptContext
+    return CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+    return pwd_context().verify(plain_password, hashed_password)
 
 def get_password_hash(password):
-    return pwd_context.hash(password)
+    return pwd_context().hash(password)
+
+async def verify_password_async(plain_password, hashed_password):
+    return await password_pool.run_sync(verify_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password):
+    return await password_pool.run_sync(get_password_hash, password)
 
 def create_access_token(data: dict):
     to_encode = data.copy()
@@ -33,16 +54,24 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id: str = payload.get("_id")
-        if user_id is None:
+    # Signature and expiry are only checked once per token and TTL
+    user_id = auth_cache.get_token(token)
+    if user_id is None:
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+            user_id: str = payload.get("_id")
+            if user_id is None:
+                raise credentials_exception
+        except jwt.PyJWTError:
             raise credentials_exception
-    except jwt.PyJWTError:
-        raise credentials_exception
+        auth_cache.put_token(token, user_id, payload.get("exp"))
         
-    db = get_db()
-    user = await db.users.find_one({"_id": ObjectId(user_id)})
+    user = auth_cache.get_user(user_id)
     if user is None:
-        raise credentials_exception
+        db = get_db()
+        generation = auth_cache.user_generation()
+        user = await db.users.find_one({"_id": ObjectId(user_id)})
+        if user is None:
+            raise credentials_exception
+        auth_cache.put_user(user_id, user, generation)
     return user
@@ -1,24 +1,205 @@
+import asyncio
+import logging
 import os
+import threading
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.monitoring import ConnectionPoolListener, ConnectionCheckOutFailedReason
 from dotenv import load_dotenv
 
+logger = logging.getLogger(__name__)
+
 load_dotenv()
 
+# Connection pool, per worker process. Leave MONGODB_MAX_POOL_SIZE unset and
+# set MONGODB_MAX_CONNECTIONS instead to split one connection budget across
+# WEB_CONCURRENCY workers, so adding workers never multiplies the load on
+# MongoDB.
+WEB_CONCURRENCY = max(1, int(os.getenv("WEB_CONCURRENCY", 1)))
+MONGODB_MAX_CONNECTIONS = int(os.getenv("MONGODB_MAX_CONNECTIONS", 0))
+MONGODB_MAX_POOL_SIZE = int(os.getenv("MONGODB_MAX_POOL_SIZE", 0)) or (
+    max(1, MONGODB_MAX_CONNECTIONS // WEB_CONCURRENCY) if MONGODB_MAX_CONNECTIONS else 50
+)
+MONGODB_MIN_POOL_SIZE = min(int(os.getenv("MONGODB_MIN_POOL_SIZE", 5)), MONGODB_MAX_POOL_SIZE)
+MONGODB_MAX_IDLE_TIME_MS = int(os.getenv("MONGODB_MAX_IDLE_TIME_MS", 300000))
+# How long a request waits for a free pooled connection before failing
+MONGODB_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGODB_WAIT_QUEUE_TIMEOUT_MS", 5000))
+MONGODB_CONNECT_TIMEOUT_MS = int(os.getenv("MONGODB_CONNECT_TIMEOUT_MS", 5000))
+MONGODB_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGODB_SERVER_SELECTION_TIMEOUT_MS", 5000))
+# Comma-separated wire compressors in order of preference, e.g. "zstd,zlib";
+# empty disables compression
+MONGODB_COMPRESSORS = os.getenv("MONGODB_COMPRESSORS", "")
+# Startup pings before giving up on MongoDB (exponential backoff between them)
+MONGODB_STARTUP_RETRIES = int(os.getenv("MONGODB_STARTUP_RETRIES", 5))
+
+class PoolStats(ConnectionPoolListener):
+    # pymongo calls these from its own threads, hence the lock
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.open = 0
+        self.checked_out = 0
+        self.waiting = 0
+        self.peak_checked_out = 0
+        self.checkouts = 0
+        self.checkout_failures = 0
+        self.checkout_timeouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.pool_clears = 0
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        with self._lock:
+            self.pool_clears += 1
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        with self._lock:
+            self.open += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.open = max(0, self.open - 1)
+
+    def connection_check_out_started(self, event):
+        with self._lock:
+            self.waiting += 1
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self.waiting = max(0, self.waiting - 1)
+            self.checkout_failures += 1
+            if event.reason == ConnectionCheckOutFailedReason.TIMEOUT:
+                self.checkout_timeouts += 1
+
+    def connection_checked_out(self, event):
+        with self._lock:
+            self.waiting = max(0, self.waiting - 1)
+            self.checked_out += 1
+            self.checkouts += 1
+            self.peak_checked_out = max(self.peak_checked_out, self.checked_out)
+            duration = getattr(event, "duration", None) or 0.0
+            self.wait_seconds += duration
+            self.max_wait_seconds = max(self.max_wait_seconds, duration)
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.checked_out = max(0, self.checked_out - 1)
+
+    def metrics(self):
+        with self._lock:
+            return {
+                "maxPoolSize": MONGODB_MAX_POOL_SIZE,
+                "minPoolSize": MONGODB_MIN_POOL_SIZE,
+                "workers": WEB_CONCURRENCY,
+                "open": self.open,
+                "checkedOut": self.checked_out,
+                "waiting": self.waiting,
+                "peakCheckedOut": self.peak_checked_out,
+                "utilization": round(self.checked_out / MONGODB_MAX_POOL_SIZE, 3),
+                "checkouts": self.checkouts,
+                "checkoutFailures": self.checkout_failures,
+                "checkoutTimeouts": self.checkout_timeouts,
+                "avgCheckoutWaitMs": round(self.wait_seconds * 1000 / self.checkouts, 3) if self.checkouts else 0.0,
+                "maxCheckoutWaitMs": round(self.max_wait_seconds * 1000, 3),
+                "poolClears": self.pool_clears
+            }
+
+pool_stats = PoolStats()
+
 class Database:
     client: AsyncIOMotorClient = None
     db = None
+    ready = False
 
 db_config = Database()
 
+def client_options():
+    options = {
+        "maxPoolSize": MONGODB_MAX_POOL_SIZE,
+        "minPoolSize": MONGODB_MIN_POOL_SIZE,
+        "maxIdleTimeMS": MONGODB_MAX_IDLE_TIME_MS,
+        "waitQueueTimeoutMS": MONGODB_WAIT_QUEUE_TIMEOUT_MS,
+        "connectTimeoutMS": MONGODB_CONNECT_TIMEOUT_MS,
+        "serverSelectionTimeoutMS": MONGODB_SERVER_SELECTION_TIMEOUT_MS,
+        "event_listeners": [pool_stats]
+    }
+    compressors = [c.strip() for c in MONGODB_COMPRESSORS.split(",") if c.strip()]
+    if compressors:
+        options["compressors"] = compressors
+    return options
+
 async def connect_db():
     mongodb_uri = os.getenv("MONGODB_URI")
     if not mongodb_uri:
         raise Exception("MONGODB_URI not found in environment variables")
-    
-    db_config.client = AsyncIOMotorClient(mongodb_uri)
+
+    if mongodb_uri.startswith("memory://"):
+        # In-process stand-in (benchmarks, running without MongoDB); data is
+        # per worker and lost on exit
+        from src.services.fake_backends import fake_database_from_env
+        db_config.db = fake_database_from_env()
+        await ensure_indexes(db_config.db)
+        db_config.ready = True
+        return
+
+    db_config.client = AsyncIOMotorClient(mongodb_uri, **client_options())
     # Extract DB name from URI or use default
     db_name = mongodb_uri.split("/")[-1].split("?")[0] or "rag_app"
     db_config.db = db_config.client[db_name]
+    await wait_for_db(db_config.db)
+    await ensure_indexes(db_config.db)
+    db_config.ready = True
+
+async def wait_for_db(db):
+    # Fail at startup, not on the first request, when MongoDB is unreachable
+    delay = 0.5
+    for attempt in range(MONGODB_STARTUP_RETRIES):
+        try:
+            await db.command("ping")
+            break
+        except Exception as e:
+            if attempt == MONGODB_STARTUP_RETRIES - 1:
+                raise Exception(f"MongoDB not reachable after {MONGODB_STARTUP_RETRIES} attempts: {str(e)}")
+            logger.warning(f"MongoDB ping failed ({str(e)}), retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 10)
+    # Concurrent pings each check out a connection, so the pool holds
+    # minPoolSize warm connections before the first request arrives
+    if MONGODB_MIN_POOL_SIZE > 1:
+        await asyncio.gather(*(db.command("ping") for _ in range(MONGODB_MIN_POOL_SIZE)))
+
+async def ping_db(timeout: float = 2.0):
+    db = get_db()
+    if db is None or not db_config.ready:
+        return False
+    try:
+        await asyncio.wait_for(db.command("ping"), timeout)
+        return True
+    except Exception:
+        return False
+
+async def close_db():
+    db_config.ready = False
+    if db_config.client:
+        db_config.client.close()
+
+async def ensure_indexes(db):
+    # Idempotent; MongoDB returns immediately when an index already exists.
+    # History reads filter on userId and walk timestamp (then _id, the keyset
+    # tie-breaker) newest first, so this one index serves them without a sort.
+    await db.messages.create_index([("userId", 1), ("timestamp", -1), ("_id", -1)],
+                                   name="userId_timestamp_id")
+    await db.conversation_summaries.create_index([("userId", 1)], unique=True)
 
 def get_db():
     return db_config.db
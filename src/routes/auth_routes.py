@@ -1,7 +1,9 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from src.models import UserModel
 from src.database import get_db
-from src.auth import get_password_hash, verify_password, create_access_token, get_current_user
+from src.auth import get_password_hash_async, verify_password_async, create_access_token, get_current_user
+from src.services.concurrency import PoolSaturatedError
+from src.services.chat_service import chat_service
 from pydantic import BaseModel
 
 router = APIRouter()
@@ -10,6 +12,15 @@ class AuthRequest(BaseModel):
     username: str
     password: str
 
+async def _password_work(fn, *args):
+    try:
+        return await fn(*args)
+    except PoolSaturatedError:
+        raise HTTPException(status_code=429, detail="Too many login attempts in progress, please retry shortly",
+                            headers={"Retry-After": "2"})
+    except TimeoutError:
+        raise HTTPException(status_code=503, detail="Password check timed out, please retry")
+
 @router.post("/register")
 async def register(req: AuthRequest):
     db = get_db()
@@ -17,7 +28,7 @@ async def register(req: AuthRequest):
     if existing_user:
         raise HTTPException(status_code=400, detail="Username already exists")
     
-    hashed_password = get_password_hash(req.password)
+    hashed_password = await _password_work(get_password_hash_async, req.password)
     user_dict = {
         "username": req.username,
         "password": hashed_password,
@@ -36,24 +47,16 @@ async def login(req: AuthRequest):
     db = get_db()
     user = await db.users.find_one({"username": req.username})
     
-    if not user or not verify_password(req.password, user["password"]):
+    if not user or not await _password_work(verify_password_async, req.password, user["password"]):
         raise HTTPException(status_code=400, detail="Invalid login credentials")
     
     token = create_access_token({"_id": str(user["_id"])})
     
     return {
-        "user": {
-            "username": user["username"],
-            "chatCount": user.get("chatCount", 0),
-            "totalTokens": user.get("totalTokens", 0)
-        },
+        "user": {"username": user["username"], **chat_service.usage_totals(user)},
         "token": token
     }
 
 @router.get("/profile")
 async def get_profile(user: dict = Depends(get_current_user)):
-    return {
-        "username": user["username"],
-        "chatCount": user.get("chatCount", 0),
-        "totalTokens": user.get("totalTokens", 0)
-    }
+    return {"username": user["username"], **chat_service.usage_totals(user)}
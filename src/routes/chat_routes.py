@@ -1,17 +1,86 @@
-from fastapi import APIRouter, Depends, HTTPException, Body
+from fastapi import APIRouter, Depends, HTTPException, Body, Header, Query
+from fastapi.responses import StreamingResponse
+from typing import Optional, List
 from src.services.document_service import document_service
 from src.services.chat_service import chat_service
 from src.services.prompt_service import prompt_service
-from src.auth import get_current_user
-from src.database import get_db
+from src.services.answer_cache import answer_cache
+from src.auth import get_current_user, password_pool
+from src.database import pool_stats
+from src.services.metrics import metrics, timed
+import asyncio
+import json
+import logging
 import math
+import time
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+ANSWER_CACHE_LOOKUPS = metrics.counter(
+    "rag_answer_cache_lookups_total", "Answer cache lookups by result.", ("result",)
+)
+
+async def _prepare_prompt(user_id: str, message: str, query_vector=None, document_ids=None, mode: str = None,
+                          documents=None, conversation=None):
+    # The rolling summary and every message it does not cover yet, in
+    # chronological order; conversation: get_prompt_history already read
+    history, summary, complete = conversation or await chat_service.get_prompt_history(user_id)
+    
+    # Retrieve context, best match first; overlapping hits come back merged
+    context_chunks = await document_service.retrieve_context(
+        message, 4, query_vector=query_vector, user_id=user_id, document_ids=document_ids, mode=mode,
+        history=history, documents=documents
+    )
+    
+    # Build prompt within the token budget
+    with timed("prompt_build"):
+        prompt, stats = prompt_service.build_budgeted_prompt(context_chunks, message, history, summary)
+    if stats["historyDropped"] or not complete:
+        # Messages left out here would be in neither the prompt nor the
+        # summary. The background update after each turn normally prevents
+        # this; otherwise fold them now, at the cost of one model call.
+        if await chat_service.update_history_summary(user_id, window_tokens=stats["historyBudget"], force=True):
+            history, summary, _ = await chat_service.get_prompt_history(user_id)
+            with timed("prompt_build"):
+                prompt, stats = prompt_service.build_budgeted_prompt(context_chunks, message, history, summary)
+    logger.debug("Prompt: %s tokens, %s chunks (%s dropped, %s trimmed)", stats["promptTokens"],
+                 stats["chunks"], stats["chunksDropped"], stats["chunksTrimmed"])
+    return prompt, stats
+
+async def _record_turn(user: dict, message: str, answer: str):
+    user_id = str(user["_id"])
+    
+    # Estimate tokens
+    tokens_used = math.ceil((len(message) + len(answer)) / 4)
+    
+    # Save messages and update user usage; both are only enqueued while the
+    # write-behind buffer is running
+    await chat_service.save_message(user_id, "user", message)
+    await chat_service.save_message(user_id, "assistant", answer)
+    unsaved = await chat_service.record_usage(user["_id"], tokens_used)
+    chat_service.schedule_summary_update(user_id)
+    
+    return {"tokensUsed": tokens_used, **chat_service.usage_totals(user, unsaved)}
+
+def _sse(event: str, data: dict):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def _cache_opt_out(cache_control: str, answer_cache_header: str):
+    if answer_cache_header and answer_cache_header.lower() in ("off", "bypass", "no-cache"):
+        return True
+    return bool(cache_control) and "no-cache" in cache_control.lower()
+
 @router.post("/")
 async def chat(
     message: str = Body(..., embed=True),
-    user: dict = Depends(get_current_user)
+    stream: bool = Body(False, embed=True),
+    documentIds: Optional[List[str]] = Body(None, embed=True),
+    searchMode: Optional[str] = Body(None, embed=True),
+    user: dict = Depends(get_current_user),
+    cache_control: Optional[str] = Header(None),
+    x_answer_cache: Optional[str] = Header(None)
 ):
     try:
         user_id = str(user["_id"])
@@ -20,53 +89,154 @@ async def chat(
         if not message:
             raise HTTPException(status_code=400, detail="Message is required")
             
-        if not document_service.has_document():
+        # One manifest listing per request serves this check, the answer
+        # cache key and the search
+        documents = document_service.list_documents(user_id)
+        if not documents:
             raise HTTPException(status_code=400, detail="Please upload a PDF first")
+        if documentIds:
+            # Checked before the query is embedded; ids of other users'
+            # documents are unknown here too
+            unknown = sorted(set(documentIds) - {d["documentId"] for d in documents})
+            if unknown:
+                raise HTTPException(status_code=404, detail=f"Unknown document ids: {', '.join(unknown)}")
+        
+        try:
+            mode = document_service.resolve_mode(searchMode)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
             
-        print(f"Query ({username}): {message}")
+        logger.debug("Query (%s): %s", username, message)
+        started = time.perf_counter()
         
-        # Get recent history
-        raw_history = await chat_service.get_recent_history(user_id, 6)
-        # Reverse history for chronological order in prompt
-        history = raw_history[::-1]
+        # One query embedding and one read of the conversation serve both the
+        # answer cache and the prompt; keyword-only retrieval skips the
+        # embedding call altogether
+        conversation = chat_service.get_prompt_history(user_id)
+        if mode != "keyword":
+            query_vector, conversation = await asyncio.gather(document_service.embed_query(message), conversation)
+        else:
+            query_vector, conversation = None, await conversation
+        use_cache = answer_cache.enabled and not _cache_opt_out(cache_control, x_answer_cache)
+        namespace = answer_cache.namespace(
+            f"{document_service.document_version(user_id, documentIds, documents)}:{mode}", prompt_service.get_current_prompt(),
+            answer_cache.conversation_key(conversation[0], conversation[1])
+        )
         
-        # Retrieve context
-        context_chunks = await document_service.search_similar_documents(message, 4)
-        context = "\n\n".join(context_chunks)
+        cached = None
+        if use_cache:
+            with timed("answer_cache"):
+                cached = answer_cache.lookup(namespace, message, query_vector)
+            ANSWER_CACHE_LOOKUPS.inc(1, cached["kind"] if cached else "miss")
+        if cached:
+            logger.debug("Answer cache hit (%s)", cached["kind"])
+            meta = {"sources": cached["sources"], "historyCount": 0, "cached": cached["kind"]}
+            if stream:
+                return _event_stream(user, message, _single_token(cached["answer"]), meta)
+            usage = await _record_turn(user, message, cached["answer"])
+            return {"success": True, "answer": cached["answer"], **meta, "usage": usage}
         
-        # Build prompt
-        prompt = prompt_service.build_prompt(context, message, history)
+        prompt, stats = await _prepare_prompt(user_id, message, query_vector, documentIds, mode, documents,
+                                              conversation)
         
-        # Get response
-        answer = await chat_service.generate_response(prompt)
+        def remember(answer: str):
+            if use_cache:
+                answer_cache.store(namespace, message, query_vector, answer,
+                                   time.perf_counter() - started, stats["chunks"])
         
-        # Estimate tokens
-        tokens_used = math.ceil((len(message) + len(answer)) / 4)
+        if stream:
+            meta = {"sources": stats["chunks"], "historyCount": stats["historyMessages"],
+                    "promptTokens": stats["promptTokens"], "cached": None}
+            return _event_stream(user, message, chat_service.stream_response(prompt), meta, remember)
         
-        # Update metrics and save messages
-        db = get_db()
-        await chat_service.save_message(user_id, "user", message)
-        await chat_service.save_message(user_id, "assistant", answer)
+        # Get response
+        answer = await chat_service.generate_response(prompt)
+        remember(answer)
         
-        # Update user usage
-        await db.users.update_one(
-            {"_id": user["_id"]},
-            {"$inc": {"chatCount": 1, "totalTokens": tokens_used}}
-        )
+        usage = await _record_turn(user, message, answer)
         
-        print(f"Answer: {answer[:100]}...")
+        logger.debug("Answer: %.100s...", answer)
         
         return {
             "success": True,
             "answer": answer,
-            "sources": len(context_chunks),
-            "historyCount": len(history),
-            "usage": {
-                "tokensUsed": tokens_used,
-                "totalTokens": user.get("totalTokens", 0) + tokens_used,
-                "chatCount": user.get("chatCount", 0) + 1
-            }
+            "sources": stats["chunks"],
+            "historyCount": stats["historyMessages"],
+            "promptTokens": stats["promptTokens"],
+            "cached": None,
+            "usage": usage
         }
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"Chat error: {str(e)}")
+        logger.exception("Chat error: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
+
+async def _single_token(answer: str):
+    yield answer
+
+def _event_stream(user: dict, message: str, tokens, meta: dict, on_answer=None):
+    return StreamingResponse(
+        _stream_answer(user, message, tokens, meta, on_answer),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+async def _stream_answer(user: dict, message: str, tokens, meta: dict, on_answer=None):
+    # Server-sent events: "meta" first, one "token" per model delta, then
+    # "done" with usage once the answer has been saved, or "error".
+    yield _sse("meta", meta)
+    parts = []
+    try:
+        async for token in tokens:
+            parts.append(token)
+            yield _sse("token", {"token": token})
+        
+        answer = "".join(parts)
+        if on_answer:
+            on_answer(answer)
+        usage = await _record_turn(user, message, answer)
+        logger.debug("Answer: %.100s...", answer)
+        yield _sse("done", {"success": True, "usage": usage})
+    except Exception as e:
+        logger.exception("Chat stream error: %s", e)
+        yield _sse("error", {"detail": str(e)})
+
+@router.get("/history")
+async def get_history(
+    limit: int = Query(20, ge=1, le=100),
+    before: Optional[str] = None,
+    user: dict = Depends(get_current_user)
+):
+    # Newest first; pass nextCursor back as `before` for the next page
+    try:
+        messages, next_cursor = await chat_service.get_history_page(str(user["_id"]), limit, before)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {
+        "messages": [
+            {
+                "id": str(m["_id"]),
+                "role": m["role"],
+                "content": m["content"],
+                "timestamp": m["timestamp"].isoformat()
+            }
+            for m in messages
+        ],
+        "nextCursor": next_cursor
+    }
+
+@router.get("/pools")
+async def get_pool_metrics(user: dict = Depends(get_current_user)):
+    return {
+        "llm": chat_service.pool.metrics(),
+        "retrieval": document_service.pool.metrics(),
+        "password": password_pool.metrics(),
+        "writeBuffer": chat_service.writes.metrics(),
+        "mongodb": pool_stats.metrics(),
+        "collections": document_service.collections.memory_stats()
+    }
+
+@router.get("/cache")
+async def get_answer_cache_stats(user: dict = Depends(get_current_user)):
+    return answer_cache.cache_stats()
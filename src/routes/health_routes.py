@@ -0,0 +1,47 @@
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse, PlainTextResponse
+from src.database import ping_db, pool_stats
+from src.services.chat_service import chat_service
+from src.services.document_service import document_service
+from src.services.metrics import metrics
+from src.auth import password_pool
+
+router = APIRouter()
+
+_POOLS = (chat_service.pool, document_service.pool, password_pool)
+
+metrics.gauge("rag_pool_active", "Calls running in a bounded executor.",
+              lambda: {(p.name,): p.active for p in _POOLS}, ("pool",))
+metrics.gauge("rag_pool_waiting", "Calls waiting for a bounded executor slot.",
+              lambda: {(p.name,): p.waiting for p in _POOLS}, ("pool",))
+metrics.gauge("mongodb_pool_connections", "MongoDB connections in this worker's pool by state.",
+              lambda: {(state,): pool_stats.metrics()[key]
+                       for state, key in (("open", "open"), ("checked_out", "checkedOut"), ("waiting", "waiting"))},
+              ("state",))
+metrics.gauge("rag_write_buffer_pending", "Chat messages and usage updates not yet written to MongoDB.",
+              lambda: chat_service.writes.pending_count())
+metrics.gauge("rag_collections_resident_bytes", "Memory-mapped index bytes loaded in this worker.",
+              lambda: document_service.collections.memory_stats()["residentBytes"])
+metrics.gauge("rag_ivf_max_list_skew", "Largest IVF list over the mean list size, worst loaded collection.",
+              lambda: document_service.collections.memory_stats()["ivfMaxSkew"])
+
+@router.get("/healthz")
+async def healthz():
+    # Liveness: the worker is up and its event loop answers
+    return {"status": "ok"}
+
+@router.get("/readyz")
+async def readyz():
+    # Readiness: MongoDB answers a ping through this worker's pool
+    ready = await ping_db()
+    body = {
+        "status": "ready" if ready else "unavailable",
+        "mongodb": {"connected": ready, "pool": pool_stats.metrics()},
+        "writeBuffer": {"running": chat_service.writes.running(), "pending": chat_service.writes.pending_count()}
+    }
+    return JSONResponse(status_code=200 if ready else 503, content=body)
+
+@router.get("/metrics")
+async def prometheus_metrics():
+    # Per worker; scrape each worker (or sum across them) when running several
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
@@ -1,13 +1,18 @@
 from fastapi import APIRouter, Depends, UploadFile, File, HTTPException
+from fastapi.responses import JSONResponse
+from src.services.ingestion_jobs import ingestion_jobs, QueueFullError
 from src.services.document_service import document_service
-from src.services.embedding_service import embedding_service
+from src.services.upload_service import save_upload_file, UploadTooLargeError, MAX_UPLOAD_MB
 from src.auth import get_current_user
+import logging
 import os
-import aiofiles
+import uuid
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
-UPLOAD_DIR = "uploads"
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploads")
 if not os.path.exists(UPLOAD_DIR):
     os.makedirs(UPLOAD_DIR)
 
@@ -19,30 +24,57 @@ async def upload_pdf(
     if not file.filename.lower().endswith(".pdf"):
         raise HTTPException(status_code=400, detail="Only PDF files are allowed")
     
-    file_path = os.path.join(UPLOAD_DIR, file.filename)
+    max_bytes = MAX_UPLOAD_MB * 1024 * 1024
+    if file.size is not None and file.size > max_bytes:
+        raise HTTPException(status_code=413, detail=f"File exceeds the {MAX_UPLOAD_MB} MB upload limit")
+
+    # Unique name: the file outlives this request until a worker picks it up
+    file_path = os.path.join(UPLOAD_DIR, f"{uuid.uuid4().hex}-{os.path.basename(file.filename)}")
     
     try:
-        # Save file temporarily
-        async with aiofiles.open(file_path, 'wb') as out_file:
-            content = await file.read()
-            await out_file.write(content)
-        
-        print(f"Processing PDF: {file.filename}")
-        
-        embeddings = embedding_service.get_embeddings()
-        chunks = await document_service.process_pdf(file_path, embeddings)
+        # Stream file to disk for the ingestion worker
+        size, content_hash = await save_upload_file(file, file_path, max_bytes)
         
-        # Clean up
-        if os.path.exists(file_path):
-            os.remove(file_path)
+        logger.info(f"Queued PDF: {file.filename} ({size} bytes)")
+        job = ingestion_jobs.submit(str(user["_id"]), file.filename, file_path, content_hash)
             
-        return {
+        return JSONResponse(status_code=202, content={
             "success": True,
-            "message": "PDF processed successfully",
-            "chunks": chunks,
-            "filename": file.filename
-        }
+            "message": "PDF queued for processing",
+            "jobId": job.id,
+            "documentId": job.document_id,
+            "state": job.state,
+            "filename": file.filename,
+            "contentHash": content_hash
+        })
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except QueueFullError as e:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "5"})
     except Exception as e:
         if os.path.exists(file_path):
             os.remove(file_path)
         raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/jobs/{job_id}")
+async def get_upload_job(job_id: str, user: dict = Depends(get_current_user)):
+    job = await ingestion_jobs.get(job_id)
+    if not job or job.get("userId") != str(user["_id"]):
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@router.get("/documents")
+async def list_documents(user: dict = Depends(get_current_user)):
+    return {"documents": document_service.list_documents(str(user["_id"]))}
+
+@router.delete("/documents/{document_id}")
+async def delete_document(document_id: str, user: dict = Depends(get_current_user)):
+    try:
+        deleted = document_service.delete_document(str(user["_id"]), document_id)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not deleted:
+        raise HTTPException(status_code=404, detail="Document not found")
+    return {"success": True, "documentId": document_id}
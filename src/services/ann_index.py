@@ -0,0 +1,141 @@
+import json
+import os
+import numpy as np
+from src.services.vector_index import normalize_rows, top_k
+
+# Inverted-file (IVF) index over the rows of a VectorIndex matrix.
+# Rows are bucketed by their nearest k-means centroid; a query only scores the
+# rows in its `nprobe` closest buckets. `nlist` and `nprobe` trade recall for
+# speed. New rows are assigned to the existing centroids, so inserts never
+# re-run k-means.
+class IVFIndex:
+    def __init__(self, nlist: int = 256, nprobe: int = 8, train_iters: int = 10,
+                 sample_per_list: int = 64, seed: int = 0):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.train_iters = train_iters
+        self.sample_per_list = sample_per_list
+        self.seed = seed
+        self.centroids = None
+        # Rows the centroids were trained on; None for centroids saved before this was recorded
+        self.trained_rows = None
+        self.assignments = np.empty(0, dtype=np.int32)
+        self._lists = None
+
+    def is_trained(self):
+        return self.centroids is not None
+
+    def min_train_size(self):
+        return self.nlist * 4
+
+    def train(self, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if len(vectors) < self.min_train_size():
+            raise Exception(f"Need at least {self.min_train_size()} vectors to train {self.nlist} lists")
+
+        rng = np.random.default_rng(self.seed)
+        sample_size = min(len(vectors), self.nlist * self.sample_per_list)
+        sample = normalize_rows(vectors[np.sort(rng.choice(len(vectors), sample_size, replace=False))])
+
+        # Spherical k-means: rows are unit length, so nearest == max dot product
+        centroids = sample[rng.choice(sample_size, self.nlist, replace=False)].copy()
+        for _ in range(self.train_iters):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            empty = ~np.bincount(labels, minlength=self.nlist).astype(bool)
+            # Re-seed empty lists from random samples instead of leaving them dead
+            sums[empty] = sample[rng.choice(sample_size, int(empty.sum()))]
+            centroids = normalize_rows(sums)
+
+        self.centroids = centroids
+        self.trained_rows = len(vectors)
+        self.reset()
+
+    def reset(self):
+        self.assignments = np.empty(0, dtype=np.int32)
+        self._lists = None
+
+    def add(self, vectors):
+        # Rows are appended in order, so row ids are positions in the matrix
+        if not self.is_trained():
+            raise Exception("IVF index must be trained before adding vectors")
+        if len(vectors) == 0:
+            return
+        # Assign in slices to bound the (rows x nlist) score matrix
+        labels = np.concatenate([
+            np.argmax(vectors[start:start + 65536] @ self.centroids.T, axis=1).astype(np.int32)
+            for start in range(0, len(vectors), 65536)
+        ])
+        self.assignments = np.concatenate([self.assignments, labels])
+        self._lists = None
+
+    def search_batch(self, vectors, queries, k: int = 4, nprobe: int = None):
+        queries = normalize_rows(np.atleast_2d(np.asarray(queries, dtype=np.float32)))
+        if not self.is_trained() or len(self.assignments) == 0:
+            return [[] for _ in range(len(queries))]
+
+        order, bounds = self._inverted_lists()
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        probe_scores = queries @ self.centroids.T
+        results = []
+        for j, query in enumerate(queries):
+            probes = np.argpartition(-probe_scores[j], nprobe - 1)[:nprobe]
+            candidates = np.concatenate([order[bounds[p]:bounds[p + 1]] for p in probes])
+            # Guards against lists from an older generation during an index swap
+            candidates = candidates[candidates < len(vectors)]
+            if len(candidates) == 0:
+                results.append([])
+                continue
+            candidates.sort()  # sequential reads from the memmap
+            scores = vectors[candidates] @ query
+            results.append([(int(candidates[i]), s) for i, s in top_k(scores, k)])
+        return results
+
+    def list_stats(self):
+        # skew = largest list / mean list size; about 1.5-3 right after training.
+        # A query probing the largest lists scores that many times more rows,
+        # and rows crowded into a few lists are found less reliably.
+        sizes = np.bincount(self.assignments, minlength=self.nlist) if len(self.assignments) else np.zeros(self.nlist)
+        mean = len(self.assignments) / self.nlist
+        return {
+            "lists": self.nlist,
+            "rows": len(self.assignments),
+            "trainedRows": self.trained_rows,
+            "maxListSize": int(sizes.max()) if len(sizes) else 0,
+            "emptyLists": int((sizes == 0).sum()),
+            "skew": round(float(sizes.max()) / mean, 2) if mean else 0.0,
+        }
+
+    def _inverted_lists(self):
+        if self._lists is None:
+            order = np.argsort(self.assignments, kind="stable")
+            counts = np.bincount(self.assignments, minlength=self.nlist)
+            bounds = np.zeros(self.nlist + 1, dtype=np.int64)
+            bounds[1:] = np.cumsum(counts)
+            self._lists = (order, bounds)
+        return self._lists
+
+    def save_centroids(self, path: str):
+        tmp_path = f"{path}.tmp.npy"
+        np.save(tmp_path, self.centroids)
+        os.replace(tmp_path, path)
+        info_path = os.path.splitext(path)[0] + ".json"
+        with open(f"{info_path}.tmp", "w") as f:
+            json.dump({"trainedRows": self.trained_rows}, f)
+        os.replace(f"{info_path}.tmp", info_path)
+
+    def load_centroids(self, path: str, dim: int):
+        if not os.path.exists(path):
+            return False
+        centroids = np.load(path)
+        if centroids.shape != (self.nlist, dim):
+            return False
+        self.centroids = centroids
+        try:
+            with open(os.path.splitext(path)[0] + ".json", "r") as f:
+                self.trained_rows = json.load(f).get("trainedRows")
+        except (OSError, ValueError):
+            self.trained_rows = None
+        self.reset()
+        return True
@@ -0,0 +1,132 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+
+ANSWER_CACHE = os.getenv("ANSWER_CACHE", "on").lower() not in ("0", "off", "false")
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", 1000))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", 3600))
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", 0.97))
+
+class AnswerCache:
+    # Answers are namespaced by (document version, system prompt, conversation
+    # state), so a new upload or prompt change never serves stale answers, and
+    # a follow-up such as "and the second one?" is only answered from the
+    # cache within the same conversation state. Within a namespace a
+    # query hits on its normalized text, or on any stored query whose embedding
+    # has cosine similarity >= threshold.
+    def __init__(self, max_entries: int = ANSWER_CACHE_MAX_ENTRIES, ttl: float = ANSWER_CACHE_TTL,
+                 threshold: float = ANSWER_CACHE_THRESHOLD, enabled: bool = ANSWER_CACHE):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.threshold = threshold
+        self.enabled = enabled
+        self._entries = OrderedDict()  # (namespace, text key) -> entry, in LRU order
+        self._namespaces = {}          # namespace -> {"keys": [...], "matrix": ndarray or None}
+        self._lock = threading.Lock()
+        self.stats = {"exactHits": 0, "semanticHits": 0, "misses": 0, "savedSeconds": 0.0}
+
+    @staticmethod
+    def namespace(document_version: str, system_prompt: str, conversation: str = ""):
+        return (f"{document_version}:{hashlib.sha256(system_prompt.encode('utf-8')).hexdigest()[:16]}"
+                f":{conversation}")
+
+    @staticmethod
+    def conversation_key(history, summary=None):
+        # Everything of the conversation the prompt and query rewriting see:
+        # the rolling summary and the messages it does not cover yet
+        if not history and not summary:
+            return ""
+        digest = hashlib.sha256((summary or "").encode("utf-8"))
+        for m in history:
+            digest.update(f"\0{m.get('role')}\0{m.get('content')}".encode("utf-8"))
+        return digest.hexdigest()[:16]
+
+    @staticmethod
+    def _text_key(query: str):
+        return hashlib.sha256(" ".join(query.lower().split()).encode("utf-8")).hexdigest()
+
+    def lookup(self, namespace: str, query: str, query_vector=None):
+        if not self.enabled:
+            return None
+        now = time.time()
+        with self._lock:
+            key = (namespace, self._text_key(query))
+            entry = self._entries.get(key)
+            kind = "exact"
+            if entry is None and query_vector is not None:
+                key, entry = self._nearest(namespace, query_vector)
+                kind = "semantic"
+            if entry is not None and now - entry["createdAt"] > self.ttl:
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats["exactHits" if kind == "exact" else "semanticHits"] += 1
+            self.stats["savedSeconds"] += entry["latency"]
+            return {**entry, "kind": kind}
+
+    def store(self, namespace: str, query: str, query_vector, answer: str, latency: float, sources: int = 0):
+        if not self.enabled:
+            return
+        vector = None
+        if query_vector is not None:
+            vector = np.asarray(query_vector, dtype=np.float32)
+            vector = vector / (np.linalg.norm(vector) or 1.0)
+        with self._lock:
+            key = (namespace, self._text_key(query))
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = {
+                "answer": answer,
+                "vector": vector,
+                "latency": latency,
+                "sources": sources,
+                "createdAt": time.time(),
+            }
+            if vector is not None:
+                # Answers without a query embedding (keyword retrieval) only hit exactly
+                bucket = self._namespaces.setdefault(namespace, {"keys": [], "matrix": None})
+                bucket["keys"].append(key)
+                bucket["matrix"] = None
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def _nearest(self, namespace: str, query_vector):
+        bucket = self._namespaces.get(namespace)
+        if not bucket or not bucket["keys"]:
+            return None, None
+        if bucket["matrix"] is None:
+            bucket["matrix"] = np.stack([self._entries[k]["vector"] for k in bucket["keys"]])
+        query = np.asarray(query_vector, dtype=np.float32)
+        scores = bucket["matrix"] @ (query / (np.linalg.norm(query) or 1.0))
+        best = int(np.argmax(scores))
+        if scores[best] < self.threshold:
+            return None, None
+        key = bucket["keys"][best]
+        return key, self._entries[key]
+
+    def _remove(self, key):
+        self._entries.pop(key, None)
+        bucket = self._namespaces.get(key[0])
+        if bucket and key in bucket["keys"]:
+            bucket["keys"].remove(key)
+            bucket["matrix"] = None
+            if not bucket["keys"]:
+                del self._namespaces[key[0]]
+
+    def cache_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats["entries"] = len(self._entries)
+        hits = stats["exactHits"] + stats["semanticHits"]
+        lookups = hits + stats["misses"]
+        stats["hitRate"] = round(hits / lookups, 4) if lookups else 0.0
+        stats["savedSeconds"] = round(stats["savedSeconds"], 3)
+        return stats
+
+answer_cache = AnswerCache()
@@ -0,0 +1,129 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+AUTH_CACHE = os.getenv("AUTH_CACHE", "on").lower() not in ("0", "off", "false")
+AUTH_TOKEN_CACHE_TTL = float(os.getenv("AUTH_TOKEN_CACHE_TTL", 300))
+AUTH_USER_CACHE_TTL = float(os.getenv("AUTH_USER_CACHE_TTL", 30))
+AUTH_CACHE_MAX_ENTRIES = int(os.getenv("AUTH_CACHE_MAX_ENTRIES", 10000))
+
+class TTLCache:
+    # Small LRU whose entries also expire at a per-entry deadline
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0}
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= now:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return entry[1]
+
+    def put(self, key, value, expires_at: float):
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+class AuthCache:
+    # Verified tokens map to a user id until min(TTL, token expiry); user
+    # documents are kept for a shorter TTL and dropped explicitly whenever
+    # this worker writes to them. Other workers see writes after at most
+    # AUTH_USER_CACHE_TTL seconds.
+    # A user document read before an invalidation must not be stored after
+    # it: every invalidation takes the next generation number, and a fill
+    # passes the generation it started at to put_user, which drops it if
+    # the user was invalidated since.
+    def __init__(self, token_ttl: float = AUTH_TOKEN_CACHE_TTL, user_ttl: float = AUTH_USER_CACHE_TTL,
+                 max_entries: int = AUTH_CACHE_MAX_ENTRIES, enabled: bool = AUTH_CACHE):
+        self.token_ttl = token_ttl
+        self.user_ttl = user_ttl
+        self.enabled = enabled
+        self.max_entries = max_entries
+        self.tokens = TTLCache(max_entries)
+        self.users = TTLCache(max_entries)
+        self._generation = 0
+        self._invalidated = OrderedDict()  # user id -> generation of its last invalidation
+        self._forgotten = 0                # newest generation evicted from _invalidated
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _token_key(token: str):
+        # Keep digests rather than bearer tokens in memory
+        return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+    def get_token(self, token: str):
+        return self.tokens.get(self._token_key(token)) if self.enabled else None
+
+    def put_token(self, token: str, user_id: str, expires_at: float = None):
+        if not self.enabled:
+            return
+        deadline = time.time() + self.token_ttl
+        if expires_at is not None:
+            deadline = min(deadline, expires_at)
+        self.tokens.put(self._token_key(token), user_id, deadline)
+
+    def get_user(self, user_id: str):
+        user = self.users.get(user_id) if self.enabled else None
+        # Callers may modify the document; never hand out the cached one
+        return dict(user) if user is not None else None
+
+    def user_generation(self):
+        # Taken before reading a user document from MongoDB
+        return self._generation
+
+    def put_user(self, user_id: str, user: dict, generation: int = None):
+        if not self.enabled:
+            return
+        with self._lock:
+            if generation is not None and max(self._invalidated.get(user_id, 0), self._forgotten) > generation:
+                # Invalidated while the document was being read; it may be stale
+                return
+            self.users.put(user_id, dict(user), time.time() + self.user_ttl)
+
+    def invalidate_user(self, user_id: str):
+        with self._lock:
+            self._generation += 1
+            self._invalidated[user_id] = self._generation
+            self._invalidated.move_to_end(user_id)
+            while len(self._invalidated) > self.max_entries:
+                # Fills older than a forgotten invalidation are all dropped
+                _, self._forgotten = self._invalidated.popitem(last=False)
+            self.users.pop(user_id)
+
+    def cache_stats(self):
+        stats = {}
+        for name, cache in (("tokens", self.tokens), ("users", self.users)):
+            lookups = cache.stats["hits"] + cache.stats["misses"]
+            stats[name] = {
+                **cache.stats,
+                "entries": len(cache),
+                "hitRate": round(cache.stats["hits"] / lookups, 4) if lookups else 0.0,
+            }
+        return stats
+
+auth_cache = AuthCache()
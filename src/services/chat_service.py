@@ -1,51 +1,294 @@
+import asyncio
+import base64
+import logging
 import os
-from langchain_google_genai import ChatGoogleGenerativeAI
+import threading
+import time
+import weakref
 from src.database import get_db
 from src.models import MessageModel
+from src.services.concurrency import BoundedExecutor
+from src.services.prompt_service import prompt_service, recent_that_fit, PROMPT_HISTORY_TOKENS
+from src.services.write_buffer import WriteBehindBuffer
+from src.services.auth_cache import auth_cache
+from src.services.metrics import timed, record_stage
 from bson import ObjectId
 from datetime import datetime
 
+logger = logging.getLogger(__name__)
+
+# "gemini", or "fake" for the local stand-in in fake_backends
+CHAT_BACKEND = os.getenv("CHAT_BACKEND", "gemini").lower()
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 16))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", 60))
+# Every message is either in the rolling summary or in the prompt verbatim.
+# The prompt gets all messages the summary does not cover yet; after a turn,
+# all but the newest HISTORY_RECENT_MESSAGES (fewer if they would take more
+# than half of PROMPT_HISTORY_TOKENS) are folded into the summary once
+# HISTORY_SUMMARY_BATCH of them have accumulated, or sooner if the
+# uncovered messages no longer fit PROMPT_HISTORY_TOKENS.
+HISTORY_RECENT_MESSAGES = int(os.getenv("HISTORY_RECENT_MESSAGES", 6))
+HISTORY_SUMMARY_BATCH = int(os.getenv("HISTORY_SUMMARY_BATCH", 6))
+# Uncovered messages read per prompt; more than this many means the summary
+# is behind and is brought up to date before the prompt is built
+HISTORY_PROMPT_MESSAGES = HISTORY_RECENT_MESSAGES + HISTORY_SUMMARY_BATCH
+HISTORY_PAGE_MAX = 100
+# Prompts and the history endpoint only need these fields; _id is always returned
+HISTORY_PROJECTION = {"role": 1, "content": 1, "timestamp": 1}
+# Newest first, matching the (userId, timestamp, _id) index
+HISTORY_SORT = [("timestamp", -1), ("_id", -1)]
+
+def encode_history_cursor(message: dict):
+    raw = f"{message['timestamp'].isoformat()}|{message['_id']}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+def decode_history_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("utf-8")
+        timestamp, message_id = raw.split("|", 1)
+        return datetime.fromisoformat(timestamp), ObjectId(message_id)
+    except Exception:
+        raise ValueError("Invalid history cursor")
+
 class ChatService:
     def __init__(self):
         self.chat_model = None
+        self.pool = BoundedExecutor("llm", LLM_MAX_CONCURRENCY, timeout=LLM_TIMEOUT)
+        self._init_lock = threading.Lock()
+        # One summary update per user at a time; entries go away with their lock
+        self._summary_locks = weakref.WeakValueDictionary()
+        self._background = set()
+        # Cached user documents are dropped once their $inc has reached MongoDB
+        self.writes = WriteBehindBuffer(on_usage_flushed=self._usage_flushed)
+
+    def _usage_flushed(self, user_ids):
+        for user_id in user_ids:
+            auth_cache.invalidate_user(str(user_id))
 
     def initialize(self, api_key: str):
         if not api_key:
             raise Exception("GOOGLE_API_KEY is required for chat functionality")
-        
+
+        # Imported here: langchain_google_genai alone adds most of a second to startup
+        from langchain_google_genai import ChatGoogleGenerativeAI
         self.chat_model = ChatGoogleGenerativeAI(
             model="gemini-2.0-flash", # Updated to a common available version or matching Node's intent
             google_api_key=api_key,
             temperature=0.7
         )
-        print("✓ Chat model initialized")
+        logger.info("✓ Chat model initialized")
 
-    async def generate_response(self, prompt: str):
-        if not self.chat_model:
+    def _ensure_model(self):
+        with self._init_lock:
+            if self.chat_model:
+                return
+            if CHAT_BACKEND == "fake":
+                from src.services.fake_backends import fake_chat_model_from_env
+                self.chat_model = fake_chat_model_from_env()
+                logger.info("✓ Fake chat model initialized")
+                return
             # Auto-init if possible
             api_key = os.getenv("GOOGLE_API_KEY")
             if api_key:
                 self.initialize(api_key)
             else:
                 raise Exception("Chat model not initialized")
+
+    async def _ensure_model_async(self):
+        # First use imports and builds the client; keep that off the event loop
+        if not self.chat_model:
+            await asyncio.to_thread(self._ensure_model)
+
+    async def generate_response(self, prompt: str):
+        await self._ensure_model_async()
         
-        response = self.chat_model.invoke(prompt)
+        with timed("llm"):
+            response = await self.pool.run(self.chat_model.ainvoke, prompt)
         return response.content
 
+    async def stream_response(self, prompt: str):
+        # Yields text deltas as the model produces them
+        await self._ensure_model_async()
+
+        async with self.pool.slot():
+            started = time.perf_counter()
+            first = True
+            chunks = self.chat_model.astream(prompt).__aiter__()
+            while True:
+                # LLM_TIMEOUT bounds the wait for each delta, not the whole answer
+                try:
+                    chunk = await asyncio.wait_for(chunks.__anext__(), LLM_TIMEOUT)
+                except StopAsyncIteration:
+                    break
+                except asyncio.TimeoutError:
+                    self.pool.stats["timeouts"] += 1
+                    raise TimeoutError(f"llm stream stalled for {LLM_TIMEOUT}s")
+                if first:
+                    record_stage("llm_first_token", time.perf_counter() - started)
+                    first = False
+                if chunk.content:
+                    yield chunk.content
+            record_stage("llm", time.perf_counter() - started)
+
     async def save_message(self, user_id: str, role: str, content: str):
-        db = get_db()
         message = {
             "userId": ObjectId(user_id),
             "role": role,
             "content": content,
             "timestamp": datetime.utcnow()
         }
-        await db.messages.insert_one(message)
+        if self.writes.running():
+            # Returns once enqueued; the buffer writes it with the next batch
+            self.writes.add_message(message)
+            return
+        db = get_db()
+        with timed("db_write"):
+            await db.messages.insert_one(message)
+
+    async def record_usage(self, user_id, tokens_used: int):
+        # Returns the increments that usage_totals cannot see yet: none while
+        # the write buffer holds them, this turn's once written directly
+        increments = {"chatCount": 1, "totalTokens": tokens_used}
+        if self.writes.running():
+            self.writes.add_usage(user_id, increments)
+            return {}
+        db = get_db()
+        with timed("db_write"):
+            await db.users.update_one({"_id": user_id}, {"$inc": increments})
+        auth_cache.invalidate_user(str(user_id))
+        return increments
+
+    def usage_totals(self, user: dict, unsaved: dict = None):
+        # Counters of a user document as read, plus the increments still in
+        # the write buffer, like get_history_page adds pending messages
+        pending = self.writes.pending_usage(user["_id"])
+        for key, amount in (unsaved or {}).items():
+            pending[key] = pending.get(key, 0) + amount
+        return {key: user.get(key, 0) + pending.get(key, 0) for key in ("chatCount", "totalTokens")}
 
     async def get_recent_history(self, user_id: str, limit: int = 10):
+        messages, _ = await self.get_history_page(user_id, limit)
+        return messages
+
+    async def get_history_page(self, user_id: str, limit: int = 20, before: str = None):
+        # Keyset pagination: each page continues strictly after the last
+        # (timestamp, _id) of the previous one, so deep pages cost the same
+        # index seek as the first instead of skipping over everything before.
+        db = get_db()
+        limit = max(1, min(limit, HISTORY_PAGE_MAX))
+        query = {"userId": ObjectId(user_id)}
+        if before:
+            timestamp, message_id = decode_history_cursor(before)
+            query["$or"] = [
+                {"timestamp": {"$lt": timestamp}},
+                {"timestamp": timestamp, "_id": {"$lt": message_id}},
+            ]
+        cursor = db.messages.find(query, HISTORY_PROJECTION).sort(HISTORY_SORT).limit(limit + 1)
+        with timed("history"):
+            messages = await cursor.to_list(length=limit + 1)
+
+        # Messages still in the write buffer are newer than anything stored
+        pending = self.writes.pending_messages({"userId": ObjectId(user_id)})
+        if pending:
+            stored = {m["_id"] for m in messages}
+            pending = [
+                {k: m[k] for k in ("_id", *HISTORY_PROJECTION)} for m in pending
+                if m["_id"] not in stored and (not before or (m["timestamp"], m["_id"]) < (timestamp, message_id))
+            ]
+            messages = sorted(pending + messages, key=lambda m: (m["timestamp"], m["_id"]), reverse=True)
+
+        next_cursor = encode_history_cursor(messages[limit - 1]) if len(messages) > limit else None
+        return messages[:limit], next_cursor
+
+    async def get_summary_state(self, user_id: str):
         db = get_db()
-        cursor = db.messages.find({"userId": ObjectId(user_id)}).sort("timestamp", -1).limit(limit)
-        history = await cursor.to_list(length=limit)
-        return history
+        with timed("history_summary"):
+            state = await db.conversation_summaries.find_one({"userId": ObjectId(user_id)})
+        return state or {}
+
+    async def get_prompt_history(self, user_id: str):
+        # (messages the summary does not cover, oldest first; the summary;
+        # whether those messages are complete). Incomplete means more than
+        # HISTORY_PROMPT_MESSAGES are uncovered and the summary is behind.
+        recent, state = await asyncio.gather(
+            self.get_recent_history(user_id, HISTORY_PROMPT_MESSAGES),
+            self.get_summary_state(user_id)
+        )
+        covered = state.get("coveredUntil")
+        history = [m for m in recent[::-1] if covered is None or m["timestamp"] > covered]
+        return history, state.get("summary"), len(history) < HISTORY_PROMPT_MESSAGES
+
+    def schedule_summary_update(self, user_id: str):
+        # Runs after the answer is sent; keep a reference so the task is not collected
+        task = asyncio.create_task(self.update_history_summary(user_id))
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def update_history_summary(self, user_id: str, keep_recent: int = HISTORY_RECENT_MESSAGES,
+                                     window_tokens: int = PROMPT_HISTORY_TOKENS // 2, force: bool = False):
+        # Folds messages that have left the verbatim window into the stored
+        # summary, oldest first. Each update only reads the messages newer
+        # than `coveredUntil`, so the cost does not grow with history length.
+        # The verbatim window is the newest keep_recent messages that fit in
+        # window_tokens. force: called while building a prompt that has no
+        # room for all uncovered messages (window_tokens is then its history
+        # budget); waits for a running update instead of skipping, and folds
+        # whatever is outside the window even below the batch size.
+        # Returns whether the summary was updated.
+        lock = self._summary_locks.get(user_id)
+        if lock is None:
+            lock = self._summary_locks[user_id] = asyncio.Lock()
+        if lock.locked() and not force:
+            return False
+        async with lock:
+            return await self._fold_history(user_id, keep_recent, window_tokens, force)
+
+    async def _fold_history(self, user_id: str, keep_recent: int, window_tokens: int, force: bool):
+        try:
+            db = get_db()
+            oid = ObjectId(user_id)
+            state = await db.conversation_summaries.find_one({"userId": oid}) or {}
+            covered = state.get("coveredUntil")
+            query = {"userId": oid}
+            if covered:
+                query["timestamp"] = {"$gt": covered}
+            limit = keep_recent + HISTORY_SUMMARY_BATCH * 4
+            cursor = db.messages.find(query, HISTORY_PROJECTION).sort("timestamp", 1).limit(limit)
+            newer = await cursor.to_list(length=limit)
+            if len(newer) == limit:
+                # Even more are uncovered; these are all older than the window
+                keep = 0
+            else:
+                # The turn that scheduled this update is usually still in the
+                # write buffer; it counts towards the window like stored ones
+                stored = {m["_id"] for m in newer}
+                newer += sorted((m for m in self.writes.pending_messages({"userId": oid})
+                                 if m["_id"] not in stored and (not covered or m["timestamp"] > covered)),
+                                key=lambda m: (m["timestamp"], m["_id"]))
+                keep = min(keep_recent, recent_that_fit(newer, window_tokens))
+            folded = newer[:len(newer) - keep]
+            overflowing = recent_that_fit(newer, PROMPT_HISTORY_TOKENS) < len(newer)
+            if not folded or (len(folded) < HISTORY_SUMMARY_BATCH and not overflowing and not force):
+                return False
+
+            summary = await self.generate_response(
+                prompt_service.build_summary_prompt(state.get("summary"), folded)
+            )
+            await db.conversation_summaries.update_one(
+                {"userId": oid},
+                {
+                    "$set": {
+                        "summary": summary.strip(),
+                        "coveredUntil": folded[-1]["timestamp"],
+                        "updatedAt": datetime.utcnow()
+                    },
+                    "$inc": {"messagesSummarized": len(folded)}
+                },
+                upsert=True
+            )
+            return True
+        except Exception as e:
+            logger.warning(f"History summary update failed: {str(e)}")
+            return False
 
 chat_service = ChatService()
@@ -0,0 +1,246 @@
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+from collections import OrderedDict
+import numpy as np
+from src.services.vector_index import VectorIndex, MANIFEST_FILE, top_k
+from src.services.ann_index import IVFIndex
+from src.services.keyword_index import reciprocal_rank_fusion
+
+logger = logging.getLogger(__name__)
+
+# "exact" scores every chunk; "ivf" probes IVF_NPROBE of IVF_NLIST k-means lists
+VECTOR_INDEX_TYPE = os.getenv("VECTOR_INDEX_TYPE", "exact")
+IVF_NLIST = int(os.getenv("IVF_NLIST", 256))
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", 8))
+IVF_CENTROIDS_FILE = "ivf-centroids.npy"
+# Centroids are reused across generations until the rows have grown by this
+# factor since training, or the largest list holds IVF_MAX_SKEW times the mean
+IVF_RETRAIN_GROWTH = float(os.getenv("IVF_RETRAIN_GROWTH", 2.0))
+IVF_MAX_SKEW = float(os.getenv("IVF_MAX_SKEW", 4.0))
+COLLECTION_RAM_BUDGET_MB = int(os.getenv("COLLECTION_RAM_BUDGET_MB", 1024))
+
+_SAFE_ID = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+class Collection:
+    # One document's index (plus optional IVF lists) inside a user's namespace
+    def __init__(self, path: str, index_type: str = VECTOR_INDEX_TYPE):
+        self.index = VectorIndex(path)
+        self.ann = IVFIndex(nlist=IVF_NLIST, nprobe=IVF_NPROBE) if index_type == "ivf" else None
+        self._ann_version = None
+        self._ann_lock = threading.Lock()
+
+    def resident_bytes(self):
+        if not self.index.is_loaded():
+            return 0
+        size = self.index.texts.nbytes + self.index.offsets.nbytes
+        if self.ann is not None:
+            # IVF scores its probed lists on the float32 rows
+            size += self.index.vectors.nbytes + self.ann.assignments.nbytes
+        else:
+            size += self.index.vector_bytes()
+        if self.index.keywords is not None:
+            # Only once a keyword search has loaded it
+            size += self.index.keywords.nbytes()
+        return size
+
+    def search_batch(self, query_vectors, k: int):
+        if self.sync_ann():
+            return self.ann.search_batch(self.index.vectors, query_vectors, k)
+        return self.index.search_batch(query_vectors, k)
+
+    def sync_ann(self):
+        # Keep the IVF lists in step with the mapped index generation. Centroids
+        # are trained once, persisted and reused, so most uploads never pay
+        # for another k-means run; they are retrained once the data has
+        # drifted away from them (see retrain_reason).
+        if self.ann is None or not self.index.is_loaded():
+            return False
+        with self._ann_lock:
+            return self._sync_ann_locked()
+
+    def _sync_ann_locked(self):
+        version = self.index.manifest["version"]
+        if self._ann_version == version:
+            return self.ann.is_trained()
+
+        centroids_path = os.path.join(self.index.path, IVF_CENTROIDS_FILE)
+        trainable = len(self.index) >= self.ann.min_train_size()
+        if self.ann.load_centroids(centroids_path, self.index.manifest["dim"]):
+            self.ann.add(self.index.vectors)
+            reason = self.retrain_reason()
+            if reason is None or not trainable:
+                self._ann_version = version
+                return True
+            logger.info(f"Retraining IVF centroids: {reason}")
+        elif not trainable:
+            # Too small to cluster; exact search is fast enough here anyway
+            self.ann.centroids = None
+            self._ann_version = version
+            return False
+        self.ann.train(self.index.vectors)
+        self.ann.save_centroids(centroids_path)
+        self.ann.add(self.index.vectors)
+        logger.info(f"✓ Trained IVF index with {self.ann.nlist} lists")
+        self._ann_version = version
+        return True
+
+    def retrain_reason(self):
+        # Lists assigned to stale centroids fill unevenly, and recall at a
+        # fixed IVF_NPROBE drops without any error
+        stats = self.ann.list_stats()
+        if stats["trainedRows"] and stats["rows"] >= stats["trainedRows"] * IVF_RETRAIN_GROWTH:
+            return f"rows grew from {stats['trainedRows']} to {stats['rows']}"
+        if stats["skew"] > IVF_MAX_SKEW:
+            return f"largest list is {stats['skew']}x the mean"
+        return None
+
+class CollectionManager:
+    # Indexes live on disk under <root>/<user_id>/<document_id>/ and are mapped
+    # into memory on first use. Least recently used collections are dropped
+    # once the mapped total exceeds the RAM budget; they reload in milliseconds.
+    def __init__(self, root: str, ram_budget_bytes: int = COLLECTION_RAM_BUDGET_MB * 1024 * 1024,
+                 index_type: str = VECTOR_INDEX_TYPE):
+        self.root = root
+        self.ram_budget_bytes = ram_budget_bytes
+        self.index_type = index_type
+        self._loaded = OrderedDict()
+        self._lock = threading.Lock()
+        # Listing entries keyed by manifest path, valid while its stamp matches
+        self._listing = {}
+        self.stats = {"loads": 0, "evictions": 0}
+
+    def path(self, user_id: str, document_id: str):
+        if not _SAFE_ID.match(user_id) or not _SAFE_ID.match(document_id):
+            raise Exception("Invalid user or document id")
+        return os.path.join(self.root, user_id, document_id)
+
+    def get(self, user_id: str, document_id: str):
+        key = (user_id, document_id)
+        with self._lock:
+            collection = self._loaded.get(key)
+            if collection is not None:
+                self._loaded.move_to_end(key)
+        if collection is not None:
+            return collection if collection.index.refresh() else None
+
+        collection = Collection(self.path(user_id, document_id), self.index_type)
+        if not collection.index.load():
+            return None
+        with self._lock:
+            self._loaded[key] = self._loaded.get(key, collection)
+            self._loaded.move_to_end(key)
+            collection = self._loaded[key]
+            self.stats["loads"] += 1
+            self._evict()
+        return collection
+
+    def _evict(self):
+        total = sum(c.resident_bytes() for c in self._loaded.values())
+        while total > self.ram_budget_bytes and len(self._loaded) > 1:
+            _, collection = self._loaded.popitem(last=False)
+            total -= collection.resident_bytes()
+            self.stats["evictions"] += 1
+
+    def list_documents(self, user_id: str):
+        # Reads only each manifest.json (and only when its stamp changed, the
+        # same check VectorIndex.refresh() uses); nothing is mapped or parsed
+        # beyond it, so chat requests can call this on the event loop
+        user_dir = os.path.join(self.root, user_id)
+        if not _SAFE_ID.match(user_id) or not os.path.isdir(user_dir):
+            return []
+        documents = []
+        for document_id in os.listdir(user_dir):
+            if not _SAFE_ID.match(document_id):
+                continue
+            entry = self._listing_entry(os.path.join(user_dir, document_id, MANIFEST_FILE), document_id)
+            if entry is not None:
+                documents.append(entry)
+        documents.sort(key=lambda d: d["createdAt"])
+        return documents
+
+    def _listing_entry(self, manifest_path: str, document_id: str):
+        try:
+            stat = os.stat(manifest_path)
+        except FileNotFoundError:
+            self._listing.pop(manifest_path, None)
+            return None
+        stamp = (stat.st_mtime_ns, stat.st_ino)
+        cached = self._listing.get(manifest_path)
+        if cached is not None and cached[0] == stamp:
+            return dict(cached[1])
+        try:
+            with open(manifest_path, "r") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        entry = {
+            "documentId": document_id,
+            "filename": manifest.get("source"),
+            "chunks": manifest["count"],
+            "version": manifest["version"],
+            "createdAt": manifest["createdAt"],
+        }
+        self._listing[manifest_path] = (stamp, entry)
+        return dict(entry)
+
+    def search(self, user_id: str, document_ids, query_vectors, k: int):
+        # Per-collection top-k, then one merge by cosine score across documents
+        return self._merge(user_id, document_ids, len(query_vectors), k,
+                           lambda collection: collection.search_batch(query_vectors, k))
+
+    def keyword_search(self, user_id: str, document_ids, queries, k: int):
+        # BM25 scores use each document's own IDF and length statistics, so
+        # raw scores from different documents are not comparable: one small
+        # document would crowd out the rest. Per-document rankings are fused
+        # by rank instead; the scores returned are the fused RRF scores.
+        rankings = [[] for _ in queries]
+        for document_id in document_ids:
+            collection = self.get(user_id, document_id)
+            if collection is None:
+                continue
+            for j, hits in enumerate(collection.index.keyword_search_batch(queries, k)):
+                rankings[j].append([(document_id, i) for i, _ in hits])
+        return [[(score, document_id, i) for (document_id, i), score in reciprocal_rank_fusion(per_query, k)]
+                for per_query in rankings]
+
+    def _merge(self, user_id: str, document_ids, n_queries: int, k: int, search):
+        merged = [[] for _ in range(n_queries)]
+        for document_id in document_ids:
+            collection = self.get(user_id, document_id)
+            if collection is None:
+                continue
+            for j, hits in enumerate(search(collection)):
+                merged[j].extend((score, document_id, i) for i, score in hits)
+        results = []
+        for hits in merged:
+            if not hits:
+                results.append([])
+                continue
+            scores = [score for score, _, _ in hits]
+            results.append([hits[i] for i, _ in top_k(np.asarray(scores, dtype=np.float32), k)])
+        return results
+
+    def delete(self, user_id: str, document_id: str):
+        path = self.path(user_id, document_id)
+        with self._lock:
+            self._loaded.pop((user_id, document_id), None)
+        self._listing.pop(os.path.join(path, MANIFEST_FILE), None)
+        if not os.path.isdir(path):
+            return False
+        shutil.rmtree(path, ignore_errors=True)
+        return True
+
+    def memory_stats(self):
+        with self._lock:
+            lists = [c.ann.list_stats() for c in self._loaded.values() if c.ann is not None and c.ann.is_trained()]
+            return {
+                "loadedCollections": len(self._loaded),
+                "residentBytes": sum(c.resident_bytes() for c in self._loaded.values()),
+                "ivfMaxSkew": max((l["skew"] for l in lists), default=0.0),
+                "budgetBytes": self.ram_budget_bytes,
+                **self.stats,
+            }
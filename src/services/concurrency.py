@@ -0,0 +1,97 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+class PoolSaturatedError(Exception):
+    pass
+
+class BoundedExecutor:
+    # Caps how many model / vector calls run at once, for both native async
+    # calls and blocking calls (which get a dedicated thread pool of the same
+    # size). Callers beyond the cap wait in line; `max_queue` turns a long line
+    # into an immediate PoolSaturatedError instead.
+    def __init__(self, name: str, max_concurrency: int, timeout: float = None, max_queue: int = None):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.max_queue = max_queue
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._executor = None
+        self.waiting = 0
+        self.active = 0
+        self.stats = {"completed": 0, "failed": 0, "timeouts": 0, "rejected": 0,
+                      "maxWaiting": 0, "busySeconds": 0.0}
+
+    async def _enter(self):
+        queued = self._semaphore.locked()
+        if queued:
+            if self.max_queue is not None and self.waiting >= self.max_queue:
+                self.stats["rejected"] += 1
+                raise PoolSaturatedError(f"{self.name} pool is saturated")
+            self.waiting += 1
+            self.stats["maxWaiting"] = max(self.stats["maxWaiting"], self.waiting)
+        try:
+            await self._semaphore.acquire()
+        finally:
+            if queued:
+                self.waiting -= 1
+        self.active += 1
+        return time.perf_counter()
+
+    def _exit(self, started: float, failed: bool = False):
+        self.active -= 1
+        self._semaphore.release()
+        self.stats["busySeconds"] += time.perf_counter() - started
+        self.stats["failed" if failed else "completed"] += 1
+
+    @asynccontextmanager
+    async def slot(self):
+        started = await self._enter()
+        failed = False
+        try:
+            yield
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            self._exit(started, failed)
+
+    async def run(self, fn, *args, timeout: float = None, **kwargs):
+        async def call():
+            async with self.slot():
+                return await fn(*args, **kwargs)
+        return await self._with_timeout(call(), timeout)
+
+    async def run_sync(self, fn, *args, timeout: float = None, **kwargs):
+        loop = asyncio.get_running_loop()
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency,
+                                                thread_name_prefix=f"{self.name}-pool")
+
+        async def call():
+            started = await self._enter()
+            future = self._executor.submit(fn, *args, **kwargs)
+            # The slot is only freed when the thread is really done, even if
+            # the caller gave up on it after a timeout
+            future.add_done_callback(
+                lambda f: loop.call_soon_threadsafe(self._exit, started, f.cancelled() or f.exception() is not None)
+            )
+            return await asyncio.shield(asyncio.wrap_future(future))
+        return await self._with_timeout(call(), timeout)
+
+    async def _with_timeout(self, coro, timeout: float = None):
+        timeout = timeout or self.timeout
+        try:
+            return await asyncio.wait_for(coro, timeout)
+        except asyncio.TimeoutError:
+            self.stats["timeouts"] += 1
+            raise TimeoutError(f"{self.name} call timed out after {timeout}s")
+
+    def metrics(self):
+        return {
+            "maxConcurrency": self.max_concurrency,
+            "active": self.active,
+            "waiting": self.waiting,
+            **self.stats,
+        }
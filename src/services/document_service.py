@@ -1,52 +1,375 @@
-from langchain_community.document_loaders import PyPDFLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import MemoryVectorStore
+from src.services.embedding_service import embedding_service
+from src.services.metrics import timed
+from src.services.vector_index import VectorIndexWriter
+from src.services.collection_manager import CollectionManager
+from src.services.keyword_index import reciprocal_rank_fusion
+from src.services.passages import (
+    CONTEXT_MERGE, PARENT_WINDOW_CHARS, query_variants, make_passage, merge_passages, expand_passage
+)
+from src.services.concurrency import BoundedExecutor
+import asyncio
+import hashlib
+import logging
 import os
-import shutil
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Root of the per-user collections: <dir>/<user_id>/<document_id>/
+VECTOR_INDEX_DIR = os.getenv("VECTOR_INDEX_DIR", os.path.join("data", "collections"))
+# Parsed pages allowed to wait for the splitter/embedder before parsing pauses
+INGEST_PAGE_QUEUE_SIZE = int(os.getenv("INGEST_PAGE_QUEUE_SIZE", 8))
+# Pages handed to a parser process per task when a process pool is used
+INGEST_PAGES_PER_TASK = int(os.getenv("INGEST_PAGES_PER_TASK", 8))
+RETRIEVAL_POOL_SIZE = int(os.getenv("RETRIEVAL_POOL_SIZE", 4))
+RETRIEVAL_TIMEOUT = float(os.getenv("RETRIEVAL_TIMEOUT", 30))
+# "hybrid" fuses BM25 and vector rankings; "keyword" never calls the embedding API
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")
+RETRIEVAL_MODES = ("hybrid", "vector", "keyword")
+# Candidates taken from each ranking before reciprocal rank fusion
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", 20))
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+
+def _make_splitter():
+    # langchain and pypdf are imported on first use (or by warm_up), not at startup
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+    return RecursiveCharacterTextSplitter(
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP,
+        # Offset of each chunk within its page; retrieval joins overlapping hits by it
+        add_start_index=True
+    )
+
+def _count_pages(file_path: str):
+    from pypdf import PdfReader
+    return len(PdfReader(file_path).pages)
+
+def _split_page_range(file_path: str, first: int, count: int):
+    # Runs in a parser process; returns [(text, metadata), ...] per page
+    from pypdf import PdfReader
+    from langchain_core.documents import Document
+    reader = PdfReader(file_path)
+    text_splitter = _make_splitter()
+    pages = []
+    for number in range(first, first + count):
+        page = Document(
+            page_content=reader.pages[number].extract_text() or "",
+            metadata={"source": file_path, "page": number}
+        )
+        splits = text_splitter.split_documents([page])
+        pages.append([(split.page_content, split.metadata) for split in splits])
+    return pages
+
+class IngestionProgress:
+    def __init__(self, filename: str = None):
+        self.filename = filename
+        self.pages_parsed = 0
+        self.chunks_split = 0
+        self.chunks_embedded = 0
+        self.parsing_done = False
+        self.error = None
+        self.started_at = time.time()
+        self.finished_at = None
+
+    def finish(self, error: str = None):
+        self.error = error
+        self.finished_at = time.time()
+
+    @property
+    def state(self):
+        if self.finished_at is None:
+            return "processing"
+        return "failed" if self.error else "completed"
+
+    def to_dict(self):
+        return {
+            "filename": self.filename,
+            "state": self.state,
+            "pagesParsed": self.pages_parsed,
+            "chunksSplit": self.chunks_split,
+            "chunksEmbedded": self.chunks_embedded,
+            "parsingDone": self.parsing_done,
+            "error": self.error,
+            "elapsedSeconds": round((self.finished_at or time.time()) - self.started_at, 3),
+        }
 
 class DocumentService:
-    def __init__(self):
-        self.vector_store = None
+    def __init__(self, index_dir: str = VECTOR_INDEX_DIR):
+        self.collections = CollectionManager(index_dir)
+        self.embeddings = None
+        # Query embedding and matrix search run here, never on the event loop
+        self.pool = BoundedExecutor("retrieval", RETRIEVAL_POOL_SIZE, timeout=RETRIEVAL_TIMEOUT)
 
-    async def process_pdf(self, file_path: str, embeddings):
+    @staticmethod
+    def document_id_for(content_hash: str = None):
+        # Content-addressed ids make re-uploads of the same bytes a no-op
+        return content_hash[:24] if content_hash else uuid.uuid4().hex[:24]
+
+    async def process_pdf(self, file_path: str, embeddings, user_id: str, document_id: str = None,
+                          progress: IngestionProgress = None, parse_executor=None,
+                          content_hash: str = None, filename: str = None):
+        # Pages are parsed lazily, split one at a time and embedded in batches
+        # while later pages are still being parsed. Bounded queues between the
+        # stages keep memory flat regardless of PDF size.
+        progress = progress or IngestionProgress(os.path.basename(file_path))
+        document_id = document_id or self.document_id_for(content_hash)
+        existing = self.collections.get(user_id, document_id)
+        if content_hash and existing and existing.index.manifest.get("sourceHash") == content_hash:
+            # Same bytes as an indexed document; nothing to parse or embed
+            logger.info("Document already indexed, skipping re-processing")
+            progress.parsing_done = True
+            progress.finish()
+            return document_id, len(existing.index)
+
+        scheduler = embedding_service.get_scheduler(embeddings)
+        writer = VectorIndexWriter(self.collections.path(user_id, document_id))
+        pending = {}
         try:
-            # Load PDF
-            loader = PyPDFLoader(file_path)
-            docs = loader.load()
-            
-            if not docs:
+            batches = self._chunk_batches(file_path, scheduler.batch_size, pending, progress, parse_executor)
+            async for start, vectors in scheduler.stream_batches(batches):
+                texts, metadatas = pending.pop(start)
+                writer.add(start, vectors, texts, metadatas)
+                progress.chunks_embedded += len(vectors)
+
+            if writer.count == 0:
                 raise Exception("PDF appears to be empty or unreadable")
-            
-            print(f"Extracted {len(docs)} pages from PDF")
-
-            # Split text
-            text_splitter = RecursiveCharacterTextSplitter(
-                chunk_size=1000,
-                chunk_overlap=200
-            )
-            splits = text_splitter.split_documents(docs)
-            print(f"Split into {len(splits)} chunks")
-
-            # Create vector store
-            self.vector_store = MemoryVectorStore.from_documents(splits, embeddings)
-            print("✓ Vector store created")
-
-            return len(splits)
+            logger.info(f"Extracted {progress.pages_parsed} pages, split into {writer.count} chunks")
+
+            # fsyncs every file and may train a PQ codebook (k-means, seconds on
+            # a large document): neither belongs on the event loop
+            await asyncio.to_thread(writer.commit, source=filename or os.path.basename(file_path),
+                                    sourceHash=content_hash)
+            collection = self.collections.get(user_id, document_id)
+            # May train IVF centroids on a large document; keep it off the loop
+            await asyncio.to_thread(collection.sync_ann)
+            self.embeddings = embeddings
+            logger.info("✓ Vector index written")
+
+            cache_stats = embedding_service.cache_stats()
+            if cache_stats:
+                logger.info(f"Embedding cache: hit rate {cache_stats['hitRate']:.0%}, {cache_stats['misses']} misses")
+
+            progress.finish()
+            return document_id, writer.count
         except Exception as e:
-            print(f"Error processing PDF: {str(e)}")
+            writer.abort()
+            progress.finish(str(e))
+            logger.error(f"Error processing PDF: {str(e)}")
             raise e
 
-    async def search_similar_documents(self, query: str, k: int = 4):
-        if not self.vector_store:
+    async def _chunk_batches(self, file_path: str, batch_size: int, pending: dict, progress,
+                             parse_executor=None):
+        page_queue = asyncio.Queue(maxsize=INGEST_PAGE_QUEUE_SIZE)
+        end_of_pages = object()
+
+        async def parse_in_thread():
+            # pypdf is synchronous; pull one page at a time off the event loop
+            from langchain_community.document_loaders import PyPDFLoader
+            pages = PyPDFLoader(file_path).lazy_load()
+            text_splitter = _make_splitter()
+            while True:
+                page = await asyncio.to_thread(next, pages, None)
+                if page is None:
+                    break
+                splits = text_splitter.split_documents([page])
+                progress.pages_parsed += 1
+                await page_queue.put([(split.page_content, split.metadata) for split in splits])
+
+        async def parse_in_processes():
+            # CPU-bound text extraction runs in worker processes, a window of
+            # pages per task, so it never competes with the event loop's GIL
+            loop = asyncio.get_running_loop()
+            page_count = await loop.run_in_executor(parse_executor, _count_pages, file_path)
+            for first in range(0, page_count, INGEST_PAGES_PER_TASK):
+                count = min(INGEST_PAGES_PER_TASK, page_count - first)
+                pages = await loop.run_in_executor(parse_executor, _split_page_range, file_path, first, count)
+                for splits in pages:
+                    progress.pages_parsed += 1
+                    await page_queue.put(splits)
+
+        async def parse():
+            try:
+                await (parse_in_processes() if parse_executor else parse_in_thread())
+                await page_queue.put(end_of_pages)
+            except Exception as e:
+                await page_queue.put(e)
+
+        parser = asyncio.create_task(parse())
+        try:
+            start, texts, metadatas = 0, [], []
+            while True:
+                page = await page_queue.get()
+                if page is end_of_pages:
+                    break
+                if isinstance(page, Exception):
+                    raise page
+                for text, metadata in page:
+                    texts.append(text)
+                    metadatas.append(metadata)
+                    progress.chunks_split += 1
+                    if len(texts) == batch_size:
+                        pending[start] = (texts, metadatas)
+                        yield start, texts
+                        start, texts, metadatas = start + len(texts), [], []
+            if texts:
+                pending[start] = (texts, metadatas)
+                yield start, texts
+            progress.parsing_done = True
+        finally:
+            parser.cancel()
+
+    def warm_up(self):
+        # Imports the PDF parsing stack ahead of the first upload
+        from langchain_community.document_loaders import PyPDFLoader  # noqa: F401
+        _make_splitter()
+
+    async def embed_query(self, query: str):
+        return await embedding_service.embed_query(query, self.pool, self.embeddings)
+
+    def _resolve_documents(self, user_id: str, document_ids=None, documents=None):
+        # documents: a listing the caller already made for this request
+        if documents is None:
+            documents = self.collections.list_documents(user_id)
+        available = [d["documentId"] for d in documents]
+        if document_ids:
+            available = [d for d in available if d in set(document_ids)]
+        if not available:
+            if document_ids:
+                raise ValueError(f"Unknown document ids: {', '.join(sorted(set(document_ids)))}")
             raise Exception("No document uploaded. Please upload a PDF first.")
-        
-        relevant_docs = self.vector_store.similarity_search(query, k=k)
-        return [doc.page_content for doc in relevant_docs]
+        return available
+
+    @staticmethod
+    def resolve_mode(mode: str = None):
+        mode = (mode or RETRIEVAL_MODE).lower()
+        if mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode '{mode}', expected one of {', '.join(RETRIEVAL_MODES)}")
+        return mode
+
+    async def search_similar_documents(self, query: str, k: int = 4, query_vector=None,
+                                       user_id: str = None, document_ids=None, mode: str = None,
+                                       documents=None):
+        mode = self.resolve_mode(mode)
+        document_ids = self._resolve_documents(user_id, document_ids, documents)
+        if query_vector is None and mode != "keyword":
+            query_vector = await self.embed_query(query)
+        query_vectors = [query_vector] if mode != "keyword" else None
+        with timed("retrieval"):
+            hits = (await self.pool.run_sync(self._search, user_id, document_ids, [query], query_vectors, k, mode))[0]
+        return [text for text, _ in hits]
+
+    async def search_similar_documents_batch(self, queries, k: int = 4, user_id: str = None,
+                                             document_ids=None, mode: str = None):
+        mode = self.resolve_mode(mode)
+        document_ids = self._resolve_documents(user_id, document_ids)
+
+        # One embedding call and one matrix product per document for every query
+        query_vectors = None
+        if mode != "keyword":
+            query_vectors = await embedding_service.embed_queries(queries, self.pool, self.embeddings)
+        with timed("retrieval"):
+            results = await self.pool.run_sync(self._search, user_id, document_ids, list(queries),
+                                               query_vectors, k, mode)
+        return [[text for text, _ in hits] for hits in results]
+
+    async def retrieve_context(self, query: str, k: int = 4, query_vector=None, user_id: str = None,
+                               document_ids=None, mode: str = None, history=None, documents=None):
+        # Multi-query retrieval: every variant of the question is searched, the
+        # rankings are fused, and the top k hits become merged passages.
+        # Returns the passage texts, best first.
+        mode = self.resolve_mode(mode)
+        document_ids = self._resolve_documents(user_id, document_ids, documents)
+        variants = query_variants(query, history)
+
+        # The variants still missing a vector are embedded in one batched call
+        query_vectors = None
+        if mode != "keyword":
+            query_vectors = [query_vector] if query_vector is not None else []
+            missing = variants[len(query_vectors):]
+            if missing:
+                query_vectors += list(await embedding_service.embed_queries(missing, self.pool, self.embeddings))
+        with timed("retrieval"):
+            passages = await self.pool.run_sync(self._retrieve_context, user_id, document_ids, variants,
+                                                query_vectors, k, mode)
+        return [passage["text"] for passage in passages]
+
+    def _retrieve_context(self, user_id: str, document_ids, queries, query_vectors, k: int, mode: str,
+                          merge: bool = CONTEXT_MERGE, window: int = PARENT_WINDOW_CHARS):
+        # All rankings of all variants go into one fusion; fusing each variant
+        # down to k first would drop hits that only one variant ranks low
+        rankings = [ranking for per_query in self._rankings(user_id, document_ids, queries, query_vectors, k, mode)
+                    for ranking in per_query]
+        fused = reciprocal_rank_fusion(rankings, k)
+        passages = [self._passage(user_id, document_id, i) for (document_id, i), _ in fused]
+        passages = [p for p in passages if p is not None]
+        if not merge:
+            return passages
+        passages = merge_passages(passages)
+        if window > 0:
+            passages = merge_passages([expand_passage(p, lambda d, i: self._passage(user_id, d, i), window)
+                                       for p in passages])
+        return passages
+
+    def _passage(self, user_id: str, document_id: str, i: int):
+        collection = self.collections.get(user_id, document_id)
+        if collection is None or not 0 <= i < len(collection.index):
+            return None
+        index = collection.index
+        metadata = index.metadata[i] if i < len(index.metadata) else {}
+        return make_passage(document_id, i, index.get_text(i), metadata)
+
+    def _rankings(self, user_id: str, document_ids, queries, query_vectors, k: int, mode: str):
+        # Per query, the (document_id, row) rankings to fuse: vector and/or BM25
+        candidates = max(k, HYBRID_CANDIDATES) if mode == "hybrid" else k
+        vector_hits = (self.collections.search(user_id, document_ids, query_vectors, candidates)
+                       if mode != "keyword" else None)
+        keyword_hits = (self.collections.keyword_search(user_id, document_ids, queries, candidates)
+                        if mode != "vector" else None)
+        return [
+            [[(document_id, i) for _, document_id, i in hits[j]] for hits in (vector_hits, keyword_hits) if hits]
+            for j in range(len(queries))
+        ]
+
+    def _rank(self, user_id: str, document_ids, queries, query_vectors, k: int, mode: str):
+        # [[((document_id, row), score), ...] per query], best first
+        if mode == "hybrid":
+            return [reciprocal_rank_fusion(rankings, k)
+                    for rankings in self._rankings(user_id, document_ids, queries, query_vectors, k, mode)]
+        hits = (self.collections.search(user_id, document_ids, query_vectors, k) if mode == "vector"
+                else self.collections.keyword_search(user_id, document_ids, queries, k))
+        return [[((document_id, i), score) for score, document_id, i in per_query[:k]] for per_query in hits]
+
+    def _search(self, user_id: str, document_ids, queries, query_vectors, k: int, mode: str):
+        results = []
+        for ranked in self._rank(user_id, document_ids, queries, query_vectors, k, mode):
+            hits = []
+            for (document_id, i), score in ranked:
+                # None when another worker deleted or replaced the document
+                # between ranking and this fetch; the hit is skipped
+                passage = self._passage(user_id, document_id, i)
+                if passage is not None:
+                    hits.append((passage["text"], score))
+            results.append(hits)
+        return results
+
+    def has_document(self, user_id: str):
+        return bool(self.collections.list_documents(user_id))
+
+    def list_documents(self, user_id: str):
+        return self.collections.list_documents(user_id)
 
-    def has_document(self):
-        return self.vector_store is not None
+    def document_version(self, user_id: str, document_ids=None, documents=None):
+        # Changes whenever any searched document is added, replaced or removed
+        if documents is None:
+            documents = self.collections.list_documents(user_id)
+        if document_ids:
+            documents = [d for d in documents if d["documentId"] in set(document_ids)]
+        versions = ",".join(sorted(f"{d['documentId']}@{d['version']}" for d in documents))
+        return hashlib.sha256(versions.encode("utf-8")).hexdigest()[:16]
 
-    def clear_document(self):
-        self.vector_store = None
+    def delete_document(self, user_id: str, document_id: str):
+        return self.collections.delete(user_id, document_id)
 
 document_service = DocumentService()
@@ -0,0 +1,190 @@
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+# Content-addressed cache in front of any langchain Embeddings model.
+# Tier 1 is an in-process LRU, tier 2 a SQLite file shared by every worker.
+# Keys hash (model, kind, text): Google embeds queries and documents with
+# different task types, so the same text gets a different vector per kind.
+class CachedEmbeddings(Embeddings):
+    def __init__(self, embeddings, model_name: str, disk_path: str = None,
+                 memory_items: int = 20000, disk_max_bytes: int = 512 * 1024 * 1024):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.memory_items = memory_items
+        self.disk_max_bytes = disk_max_bytes
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk = _DiskTier(disk_path, disk_max_bytes) if disk_path else None
+        self.stats = {"memoryHits": 0, "diskHits": 0, "misses": 0, "evictions": 0}
+
+    def embed_documents(self, texts):
+        keys, found, missing = self._plan(list(texts), "document")
+        if missing:
+            self._finish(found, missing, self.embeddings.embed_documents(list(missing.values())))
+        return [found[key].tolist() for key in keys]
+
+    def embed_query(self, text):
+        keys, found, missing = self._plan([text], "query")
+        if missing:
+            self._finish(found, missing, [self.embeddings.embed_query(text)])
+        return found[keys[0]].tolist()
+
+    async def aembed_documents(self, texts):
+        # Cache I/O runs in a thread; the provider call uses its native async API
+        keys, found, missing = await asyncio.to_thread(self._plan, list(texts), "document")
+        if missing:
+            vectors = await self.embeddings.aembed_documents(list(missing.values()))
+            await asyncio.to_thread(self._finish, found, missing, vectors)
+        return [found[key].tolist() for key in keys]
+
+    async def aembed_query(self, text):
+        keys, found, missing = await asyncio.to_thread(self._plan, [text], "query")
+        if missing:
+            vector = await self.embeddings.aembed_query(text)
+            await asyncio.to_thread(self._finish, found, missing, [vector])
+        return found[keys[0]].tolist()
+
+    def _plan(self, texts, kind):
+        keys = [self._key(kind, text) for text in texts]
+        found = self._lookup(keys)
+
+        # Embed each distinct missing text once, in a single provider call
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+        with self._lock:
+            self.stats["misses"] += len(missing)
+        return keys, found, missing
+
+    def _finish(self, found, missing, vectors):
+        computed = {key: np.asarray(vector, dtype=np.float32)
+                    for key, vector in zip(missing.keys(), vectors)}
+        self._store(computed)
+        found.update(computed)
+
+    def _key(self, kind: str, text: str):
+        return hashlib.sha256(f"{self.model_name}\0{kind}\0{text}".encode("utf-8")).hexdigest()
+
+    def _lookup(self, keys):
+        found = {}
+        with self._lock:
+            for key in keys:
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    found[key] = vector
+            self.stats["memoryHits"] += len(found)
+
+        remaining = [key for key in set(keys) if key not in found]
+        if remaining and self._disk:
+            from_disk = self._disk.get_many(remaining)
+            with self._lock:
+                self.stats["diskHits"] += len(from_disk)
+                for key, vector in from_disk.items():
+                    self._remember(key, vector)
+            found.update(from_disk)
+        return found
+
+    def _store(self, vectors):
+        with self._lock:
+            for key, vector in vectors.items():
+                self._remember(key, vector)
+        if self._disk:
+            evicted = self._disk.put_many(vectors)
+            with self._lock:
+                self.stats["evictions"] += evicted
+
+    def _remember(self, key, vector):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def cache_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats["memoryItems"] = len(self._memory)
+        lookups = stats["memoryHits"] + stats["diskHits"] + stats["misses"]
+        stats["hitRate"] = round((lookups - stats["misses"]) / lookups, 4) if lookups else 0.0
+        if self._disk:
+            stats["diskBytes"] = self._disk.total_bytes()
+        return stats
+
+
+class _DiskTier:
+    def __init__(self, path: str, max_bytes: int):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, vector BLOB NOT NULL, size INTEGER NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_accessed ON embeddings (accessed)")
+        self._conn.commit()
+
+    def get_many(self, keys):
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})",
+                    batch,
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32)
+            if found:
+                now = time.time()
+                self._conn.executemany("UPDATE embeddings SET accessed = ? WHERE key = ?",
+                                       [(now, key) for key in found])
+                self._conn.commit()
+        return found
+
+    def put_many(self, vectors):
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, size, accessed) VALUES (?, ?, ?, ?)",
+                [(key, v.tobytes(), v.nbytes, now) for key, v in vectors.items()],
+            )
+            evicted = self._evict()
+            self._conn.commit()
+        return evicted
+
+    def _evict(self):
+        # Least recently used rows go first, down to 90% of the budget
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM embeddings").fetchone()[0]
+        if total <= self.max_bytes:
+            return 0
+        target = int(self.max_bytes * 0.9)
+        evicted = 0
+        while total > target:
+            rows = self._conn.execute(
+                "SELECT key, size FROM embeddings ORDER BY accessed LIMIT 1000").fetchall()
+            if not rows:
+                break
+            doomed = []
+            for key, size in rows:
+                if total <= target:
+                    break
+                doomed.append((key,))
+                total -= size
+            self._conn.executemany("DELETE FROM embeddings WHERE key = ?", doomed)
+            evicted += len(doomed)
+        return evicted
+
+    def total_bytes(self):
+        with self._lock:
+            return self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM embeddings").fetchone()[0]
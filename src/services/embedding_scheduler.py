@@ -0,0 +1,136 @@
+import asyncio
+import logging
+import random
+import time
+from src.services.metrics import record_stage
+
+logger = logging.getLogger(__name__)
+
+class TokenBucket:
+    # Requests-per-second limiter shared by every embedding call in the process
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, tokens: float = 1.0):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self.tokens) / self.rate)
+
+
+class EmbeddingScheduler:
+    def __init__(self, embeddings, batch_size: int = 100, max_concurrency: int = 4,
+                 rate_limiter: TokenBucket = None, max_retries: int = 5,
+                 base_delay: float = 0.5, max_delay: float = 20.0):
+        self.embeddings = embeddings
+        self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+        self.rate_limiter = rate_limiter
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.stats = {"batches": 0, "retries": 0}
+
+    async def stream(self, texts):
+        # Yields (start, vectors) per batch in completion order, so callers can
+        # persist results while later batches are still in flight.
+        texts = list(texts)
+
+        async def batches():
+            for start in range(0, len(texts), self.batch_size):
+                yield start, texts[start:start + self.batch_size]
+
+        async for item in self.stream_batches(batches()):
+            yield item
+
+    async def stream_batches(self, batches):
+        # `batches` is an async iterator of (start, texts), e.g. a parser that
+        # is still running. Workers pull from it on demand and at most
+        # max_concurrency batches are in flight or waiting for the consumer,
+        # so a slow consumer applies backpressure all the way up.
+        source = batches.__aiter__()
+        source_lock = asyncio.Lock()
+        # A worker takes a slot before pulling a batch and the consumer frees
+        # it once the result is handed on. The result queue itself is
+        # unbounded, so a put never blocks and cancelled workers always exit.
+        slots = asyncio.Semaphore(self.max_concurrency)
+        finished = asyncio.Queue()
+        done = object()
+
+        async def worker():
+            try:
+                while True:
+                    await slots.acquire()
+                    async with source_lock:
+                        try:
+                            start, batch = await source.__anext__()
+                        except StopAsyncIteration:
+                            slots.release()
+                            return
+                    vectors = await self._embed_batch(batch)
+                    finished.put_nowait((start, vectors))
+            except Exception as e:
+                finished.put_nowait(e)
+            finally:
+                finished.put_nowait(done)
+
+        workers = [asyncio.create_task(worker()) for _ in range(self.max_concurrency)]
+        try:
+            running = len(workers)
+            while running:
+                item = await finished.get()
+                if item is done:
+                    running -= 1
+                elif isinstance(item, Exception):
+                    raise item
+                else:
+                    yield item
+                    slots.release()
+        finally:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            # Stops the parser behind the batches too when embedding failed
+            aclose = getattr(source, "aclose", None)
+            if aclose is not None:
+                await aclose()
+
+    async def embed(self, texts):
+        texts = list(texts)
+        vectors = [None] * len(texts)
+        async for start, batch in self.stream(texts):
+            vectors[start:start + len(batch)] = batch
+        return vectors
+
+    async def _embed_batch(self, batch):
+        attempt = 0
+        while True:
+            if self.rate_limiter:
+                await self.rate_limiter.acquire()
+            try:
+                # langchain's default aembed_documents runs the sync call in a
+                # thread, so the event loop is never blocked either way
+                started = time.perf_counter()
+                vectors = await self.embeddings.aembed_documents(batch)
+                record_stage("embedding_batch", time.perf_counter() - started)
+                self.stats["batches"] += 1
+                return vectors
+            except Exception as e:
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise
+                self.stats["retries"] += 1
+                # Exponential backoff with full jitter
+                delay = min(self.max_delay, self.base_delay * (2 ** (attempt - 1)))
+                delay = random.uniform(0, delay)
+                logger.warning(f"Embedding batch failed ({e}); retry {attempt}/{self.max_retries} in {delay:.2f}s")
+                await asyncio.sleep(delay)
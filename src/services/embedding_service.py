@@ -1,31 +1,107 @@
+import asyncio
+import logging
 import os
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
+import threading
+from src.services.embedding_scheduler import EmbeddingScheduler, TokenBucket
+from src.services.metrics import timed
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_MODEL = "models/text-embedding-004"
+# "google", or "fake" for the local stand-in in fake_backends
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "google").lower()
+EMBEDDING_CACHE = os.getenv("EMBEDDING_CACHE", "on").lower() not in ("0", "off", "false")
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", os.path.join("data", "embedding_cache.sqlite3"))
+EMBEDDING_CACHE_MEMORY_ITEMS = int(os.getenv("EMBEDDING_CACHE_MEMORY_ITEMS", 20000))
+EMBEDDING_CACHE_DISK_MB = int(os.getenv("EMBEDDING_CACHE_DISK_MB", 512))
+# batchEmbedContents accepts at most 100 texts per request
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", 100))
+EMBEDDING_CONCURRENCY = int(os.getenv("EMBEDDING_CONCURRENCY", 4))
+EMBEDDING_REQUESTS_PER_MINUTE = float(os.getenv("EMBEDDING_REQUESTS_PER_MINUTE", 1500))
+EMBEDDING_MAX_RETRIES = int(os.getenv("EMBEDDING_MAX_RETRIES", 5))
 
 class EmbeddingService:
     def __init__(self):
         self.embeddings = None
+        self._init_lock = threading.Lock()
+        # One bucket per process so concurrent uploads share the provider quota
+        self.rate_limiter = TokenBucket(EMBEDDING_REQUESTS_PER_MINUTE / 60.0)
 
     def initialize(self, api_key: str):
-        if not api_key or api_key == "your_google_api_key_here":
-            raise Exception("Valid GOOGLE_API_KEY is required")
-        
-        print("Initializing Google Embeddings...")
-        self.embeddings = GoogleGenerativeAIEmbeddings(
-            model="models/text-embedding-004",
-            google_api_key=api_key
-        )
-        # Test
-        self.embeddings.embed_query("test")
-        print("✓ Google Embeddings initialized successfully")
+        model = EMBEDDING_MODEL
+        if EMBEDDING_BACKEND == "fake":
+            from src.services.fake_backends import fake_embeddings_from_env
+            embeddings = fake_embeddings_from_env()
+            model = f"fake-{embeddings.dim}"
+        else:
+            if not api_key or api_key == "your_google_api_key_here":
+                raise Exception("Valid GOOGLE_API_KEY is required")
+
+            logger.info("Initializing Google Embeddings...")
+            # Imported on first use; langchain_google_genai is slow to import
+            from langchain_google_genai import GoogleGenerativeAIEmbeddings
+            embeddings = GoogleGenerativeAIEmbeddings(
+                model=EMBEDDING_MODEL,
+                google_api_key=api_key
+            )
+        if EMBEDDING_CACHE:
+            from src.services.embedding_cache import CachedEmbeddings
+            embeddings = CachedEmbeddings(
+                embeddings,
+                model,
+                disk_path=EMBEDDING_CACHE_PATH,
+                memory_items=EMBEDDING_CACHE_MEMORY_ITEMS,
+                disk_max_bytes=EMBEDDING_CACHE_DISK_MB * 1024 * 1024
+            )
+        # No test call here: a bad key surfaces on the first real request
+        # instead of costing a network round trip on every worker start
+        self.embeddings = embeddings
+        logger.info(f"✓ Embeddings initialized ({model})")
 
     def get_embeddings(self):
-        if not self.embeddings:
-            # Try to initialize from env if not already done
-            api_key = os.getenv("GOOGLE_API_KEY")
-            if api_key:
-                self.initialize(api_key)
-            else:
-                raise Exception("Embeddings not initialized and GOOGLE_API_KEY not found")
+        with self._init_lock:
+            if not self.embeddings:
+                # Try to initialize from env if not already done
+                api_key = os.getenv("GOOGLE_API_KEY")
+                if api_key or EMBEDDING_BACKEND == "fake":
+                    self.initialize(api_key)
+                else:
+                    raise Exception("Embeddings not initialized and GOOGLE_API_KEY not found")
         return self.embeddings
 
+    async def get_embeddings_async(self):
+        # First use imports and builds the client; keep that off the event loop
+        if self.embeddings:
+            return self.embeddings
+        return await asyncio.to_thread(self.get_embeddings)
+
+    async def embed_query(self, query: str, executor=None, embeddings=None):
+        # Query-time embedding; `executor` bounds concurrent calls (retrieval pool)
+        embeddings = embeddings or await self.get_embeddings_async()
+        with timed("embedding"):
+            if executor:
+                return await executor.run(embeddings.aembed_query, query)
+            return await embeddings.aembed_query(query)
+
+    async def embed_queries(self, queries, executor=None, embeddings=None):
+        embeddings = embeddings or await self.get_embeddings_async()
+        with timed("embedding"):
+            if executor:
+                return await executor.run(embeddings.aembed_documents, list(queries))
+            return await embeddings.aembed_documents(list(queries))
+
+    def get_scheduler(self, embeddings=None):
+        return EmbeddingScheduler(
+            embeddings or self.get_embeddings(),
+            batch_size=EMBEDDING_BATCH_SIZE,
+            max_concurrency=EMBEDDING_CONCURRENCY,
+            rate_limiter=self.rate_limiter,
+            max_retries=EMBEDDING_MAX_RETRIES
+        )
+
+    def cache_stats(self):
+        if hasattr(self.embeddings, "cache_stats"):
+            return self.embeddings.cache_stats()
+        return None
+
 embedding_service = EmbeddingService()
@@ -0,0 +1,288 @@
+import asyncio
+import copy
+import hashlib
+import os
+import random
+import time
+import numpy as np
+from bson import ObjectId
+from langchain_core.embeddings import Embeddings
+from langchain_core.messages import AIMessage, AIMessageChunk
+from pymongo.results import InsertOneResult
+
+# The app itself runs on these stand-ins with CHAT_BACKEND=fake,
+# EMBEDDING_BACKEND=fake and MONGODB_URI=memory://, tuned by:
+FAKE_LLM_FIRST_TOKEN_LATENCY = float(os.getenv("FAKE_LLM_FIRST_TOKEN_LATENCY", 0.3))
+FAKE_LLM_TOKENS_PER_SECOND = float(os.getenv("FAKE_LLM_TOKENS_PER_SECOND", 50))
+FAKE_LLM_ANSWER_TOKENS = int(os.getenv("FAKE_LLM_ANSWER_TOKENS", 60))
+FAKE_LLM_PREFILL_TOKENS_PER_SECOND = float(os.getenv("FAKE_LLM_PREFILL_TOKENS_PER_SECOND", 0))
+FAKE_EMBEDDING_DIM = int(os.getenv("FAKE_EMBEDDING_DIM", 768))
+FAKE_EMBEDDING_LATENCY = float(os.getenv("FAKE_EMBEDDING_LATENCY", 0.05))
+FAKE_EMBEDDING_PER_TEXT_LATENCY = float(os.getenv("FAKE_EMBEDDING_PER_TEXT_LATENCY", 0.0))
+FAKE_DB_LATENCY = float(os.getenv("FAKE_DB_LATENCY", 0.0))
+
+# Local stand-ins for the Google model clients, used by benchmarks and for
+# exercising the pipeline without network access or an API key.
+class FakeEmbeddings(Embeddings):
+    def __init__(self, dim: int = 768, latency: float = 0.0, per_text_latency: float = 0.0,
+                 failure_rate: float = 0.0, seed: int = 0):
+        self.dim = dim
+        self.latency = latency
+        self.per_text_latency = per_text_latency
+        self.failure_rate = failure_rate
+        self.seed = seed
+        self.calls = 0
+        self.texts_embedded = 0
+        self._random = random.Random(seed)
+
+    def _vector(self, text: str):
+        # Deterministic per text, so cache and retrieval behaviour is repeatable
+        digest = hashlib.sha256(f"{self.seed}\0{text}".encode("utf-8")).digest()
+        rng = np.random.default_rng(int.from_bytes(digest[:8], "little"))
+        return rng.standard_normal(self.dim).astype(np.float32).tolist()
+
+    def _account(self, texts):
+        self.calls += 1
+        if self.failure_rate and self._random.random() < self.failure_rate:
+            raise Exception("429 Resource has been exhausted (fake)")
+        self.texts_embedded += len(texts)
+        return self.latency + self.per_text_latency * len(texts)
+
+    def embed_documents(self, texts):
+        time.sleep(self._account(texts))
+        return [self._vector(t) for t in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts):
+        await asyncio.sleep(self._account(texts))
+        return [self._vector(t) for t in texts]
+
+    async def aembed_query(self, text):
+        return (await self.aembed_documents([text]))[0]
+
+
+class FakeChatModel:
+    # Mimics the ChatGoogleGenerativeAI surface used by ChatService: a fixed
+    # time to first token, then `tokens_per_second` word-sized deltas.
+    # `prefill_tokens_per_second` adds prompt-length dependent latency.
+    def __init__(self, first_token_latency: float = 0.3, tokens_per_second: float = 50.0,
+                 answer_tokens: int = 60, prefill_tokens_per_second: float = None):
+        self.first_token_latency = first_token_latency
+        self.tokens_per_second = tokens_per_second
+        self.answer_tokens = answer_tokens
+        self.prefill_tokens_per_second = prefill_tokens_per_second
+        self.calls = 0
+        self.prompt_chars = 0
+
+    def _tokens(self, prompt):
+        words = str(prompt).split()[-20:] or ["ok"]
+        return [words[i % len(words)] + " " for i in range(self.answer_tokens)]
+
+    def _first_token_latency(self, prompt):
+        self.calls += 1
+        self.prompt_chars += len(str(prompt))
+        if not self.prefill_tokens_per_second:
+            return self.first_token_latency
+        return self.first_token_latency + len(str(prompt)) / 4 / self.prefill_tokens_per_second
+
+    def _total_latency(self, prompt):
+        return self._first_token_latency(prompt) + self.answer_tokens / self.tokens_per_second
+
+    def invoke(self, prompt):
+        time.sleep(self._total_latency(prompt))
+        return AIMessage(content="".join(self._tokens(prompt)))
+
+    async def ainvoke(self, prompt):
+        await asyncio.sleep(self._total_latency(prompt))
+        return AIMessage(content="".join(self._tokens(prompt)))
+
+    async def astream(self, prompt):
+        await asyncio.sleep(self._first_token_latency(prompt))
+        for token in self._tokens(prompt):
+            yield AIMessageChunk(content=token)
+            await asyncio.sleep(1.0 / self.tokens_per_second)
+
+
+class FakeCollection:
+    # In-memory subset of a Motor collection: equality, $gt/$gte/$lt/$lte/$in/$ne
+    # and top-level $or filters, $set/$inc/$push ($each, $slice) updates,
+    # sort/skip/limit cursors and inclusion projections. Every call waits `latency` seconds, like a network round trip.
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.docs = []
+        self.calls = {}
+
+    async def _round_trip(self, name: str):
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def insert_one(self, doc):
+        await self._round_trip("insert_one")
+        doc.setdefault("_id", ObjectId())
+        self.docs.append(copy.deepcopy(doc))
+        return InsertOneResult(doc["_id"], True)
+
+    async def insert_many(self, docs, ordered: bool = True):
+        await self._round_trip("insert_many")
+        for doc in docs:
+            doc.setdefault("_id", ObjectId())
+            self.docs.append(copy.deepcopy(doc))
+
+    async def find_one(self, query, projection=None):
+        await self._round_trip("find_one")
+        for doc in self.docs:
+            if _matches(doc, query):
+                return _project(doc, projection)
+        return None
+
+    def find(self, query=None, projection=None):
+        self.calls["find"] = self.calls.get("find", 0) + 1
+        return _FakeCursor(self, [d for d in self.docs if _matches(d, query or {})], projection)
+
+    async def update_one(self, query, update, upsert: bool = False):
+        await self._round_trip("update_one")
+        self._apply(query, update, upsert)
+
+    async def replace_one(self, query, doc, upsert: bool = False):
+        await self._round_trip("replace_one")
+        for i, existing in enumerate(self.docs):
+            if _matches(existing, query):
+                self.docs[i] = {"_id": existing["_id"], **copy.deepcopy(doc)}
+                return
+        if upsert:
+            self.docs.append({**query, **copy.deepcopy(doc)})
+
+    async def bulk_write(self, requests, ordered: bool = True):
+        # Accepts pymongo UpdateOne operations
+        await self._round_trip("bulk_write")
+        for op in requests:
+            self._apply(op._filter, op._doc, op._upsert)
+
+    async def count_documents(self, query):
+        await self._round_trip("count_documents")
+        return sum(1 for d in self.docs if _matches(d, query))
+
+    async def create_index(self, keys, **kwargs):
+        await self._round_trip("create_index")
+        return "_".join(f"{k}_{d}" for k, d in keys) if isinstance(keys, list) else f"{keys}_1"
+
+    def _apply(self, query, update, upsert):
+        doc = next((d for d in self.docs if _matches(d, query)), None)
+        if doc is None:
+            if not upsert:
+                return
+            doc = {k: v for k, v in query.items() if not isinstance(v, dict)}
+            doc.setdefault("_id", ObjectId())
+            self.docs.append(doc)
+        doc.update(copy.deepcopy(update.get("$set", {})))
+        for key, amount in update.get("$inc", {}).items():
+            doc[key] = doc.get(key, 0) + amount
+        for key, value in update.get("$push", {}).items():
+            items = doc.get(key, []) + copy.deepcopy(value["$each"] if isinstance(value, dict) else [value])
+            if isinstance(value, dict) and "$slice" in value:
+                items = items[value["$slice"]:] if value["$slice"] < 0 else items[:value["$slice"]]
+            doc[key] = items
+
+
+class _FakeCursor:
+    def __init__(self, collection, docs, projection):
+        self.collection = collection
+        self.docs = docs
+        self.projection = projection
+        self._skip = 0
+        self._limit = 0
+
+    def sort(self, key, direction: int = 1):
+        keys = key if isinstance(key, list) else [(key, direction)]
+        for name, order in reversed(keys):
+            self.docs.sort(key=lambda d: d.get(name), reverse=order < 0)
+        return self
+
+    def skip(self, count: int):
+        self._skip = count
+        return self
+
+    def limit(self, count: int):
+        self._limit = count
+        return self
+
+    async def to_list(self, length=None):
+        await self.collection._round_trip("to_list")
+        docs = self.docs[self._skip:]
+        if self._limit:
+            docs = docs[:self._limit]
+        if length:
+            docs = docs[:length]
+        return [_project(d, self.projection) for d in docs]
+
+
+class FakeDatabase:
+    # Collections are created on first attribute access, like Motor's
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self._collections = {}
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def __getitem__(self, name):
+        if name not in self._collections:
+            self._collections[name] = FakeCollection(self.latency)
+        return self._collections[name]
+
+    async def command(self, name, *args, **kwargs):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return {"ok": 1.0}
+
+
+def fake_chat_model_from_env():
+    return FakeChatModel(FAKE_LLM_FIRST_TOKEN_LATENCY, FAKE_LLM_TOKENS_PER_SECOND, FAKE_LLM_ANSWER_TOKENS,
+                         prefill_tokens_per_second=FAKE_LLM_PREFILL_TOKENS_PER_SECOND or None)
+
+
+def fake_embeddings_from_env():
+    return FakeEmbeddings(FAKE_EMBEDDING_DIM, latency=FAKE_EMBEDDING_LATENCY,
+                          per_text_latency=FAKE_EMBEDDING_PER_TEXT_LATENCY)
+
+
+def fake_database_from_env():
+    return FakeDatabase(latency=FAKE_DB_LATENCY)
+
+
+def _matches(doc, query):
+    for key, condition in query.items():
+        if key == "$or":
+            if not any(_matches(doc, branch) for branch in condition):
+                return False
+            continue
+        value = doc.get(key)
+        if isinstance(condition, dict) and any(k.startswith("$") for k in condition):
+            for op, operand in condition.items():
+                if op == "$in" and value not in operand:
+                    return False
+                if op == "$ne" and (value == operand or (isinstance(value, list) and operand in value)):
+                    return False
+                if value is None and op in ("$gt", "$gte", "$lt", "$lte"):
+                    return False
+                if (op == "$gt" and not value > operand) or (op == "$gte" and not value >= operand) \
+                        or (op == "$lt" and not value < operand) or (op == "$lte" and not value <= operand):
+                    return False
+        elif value != condition:
+            return False
+    return True
+
+
+def _project(doc, projection):
+    if not projection:
+        return copy.deepcopy(doc)
+    fields = {k for k, v in projection.items() if v}
+    projected = {k: copy.deepcopy(v) for k, v in doc.items() if k in fields}
+    if projection.get("_id", 1):
+        projected["_id"] = doc.get("_id")
+    return projected
@@ -0,0 +1,181 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from src.database import get_db
+from src.services.document_service import document_service, IngestionProgress
+from src.services.embedding_service import embedding_service
+
+logger = logging.getLogger(__name__)
+
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", 2))
+INGEST_MAX_QUEUE = int(os.getenv("INGEST_MAX_QUEUE", 16))
+# 0 parses in a thread of the web worker instead of a process pool
+INGEST_PARSE_PROCESSES = int(os.getenv("INGEST_PARSE_PROCESSES", 2))
+INGEST_KEEP_FINISHED = int(os.getenv("INGEST_KEEP_FINISHED", 500))
+# Minimum seconds between progress snapshots written to MongoDB
+INGEST_PROGRESS_INTERVAL = float(os.getenv("INGEST_PROGRESS_INTERVAL", 1.0))
+
+class QueueFullError(Exception):
+    pass
+
+class IngestionJob:
+    def __init__(self, user_id: str, filename: str, file_path: str, content_hash: str = None):
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.filename = filename
+        self.file_path = file_path
+        self.content_hash = content_hash
+        self.document_id = document_service.document_id_for(content_hash)
+        self.state = "queued"
+        self.progress = IngestionProgress(filename)
+        self.chunks = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    def to_dict(self):
+        now = time.time()
+        return {
+            "id": self.id,
+            "userId": self.user_id,
+            "filename": self.filename,
+            "documentId": self.document_id,
+            "contentHash": self.content_hash,
+            "state": self.state,
+            "chunks": self.chunks,
+            "error": self.error,
+            "progress": self.progress.to_dict(),
+            "timings": {
+                "createdAt": self.created_at,
+                "queuedSeconds": round((self.started_at or now) - self.created_at, 3),
+                "runSeconds": round((self.finished_at or now) - self.started_at, 3) if self.started_at else None,
+            },
+        }
+
+class IngestionJobManager:
+    # Uploads are queued here and processed by a fixed number of workers, so a
+    # burst of large PDFs cannot starve the chat path of CPU or embedding quota.
+    def __init__(self, workers: int = INGEST_WORKERS, max_queue: int = INGEST_MAX_QUEUE,
+                 parse_processes: int = INGEST_PARSE_PROCESSES):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.parse_processes = parse_processes
+        self.jobs = OrderedDict()
+        self._queue = None
+        self._tasks = []
+        # Fire-and-forget snapshot writes; referenced until done so they are not collected
+        self._background = set()
+        self._executor = None
+
+    async def start(self):
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        if self.parse_processes > 0:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.parse_processes,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        logger.info(f"✓ Ingestion workers started ({self.workers} workers, queue {self.max_queue})")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        # Let accepted jobs reach MongoDB before the process exits
+        await asyncio.gather(*self._background, return_exceptions=True)
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def submit(self, user_id: str, filename: str, file_path: str, content_hash: str = None):
+        if self._queue is None:
+            raise Exception("Ingestion workers are not running")
+        job = IngestionJob(user_id, filename, file_path, content_hash)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise QueueFullError("Too many uploads in progress, please retry shortly")
+        self.jobs[job.id] = job
+        self._prune()
+        task = asyncio.create_task(self._persist(job))
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+        return job
+
+    async def get(self, job_id: str):
+        # Jobs live in the worker that accepted them; other workers fall back
+        # to the snapshot in MongoDB
+        job = self.jobs.get(job_id)
+        if job:
+            return job.to_dict()
+        db = get_db()
+        if db is None:
+            return None
+        snapshot = await db.ingestion_jobs.find_one({"_id": job_id})
+        if snapshot:
+            snapshot.pop("_id", None)
+        return snapshot
+
+    def queue_depth(self):
+        return self._queue.qsize() if self._queue else 0
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._run(job)
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job: IngestionJob):
+        job.state = "running"
+        job.started_at = time.time()
+        await self._persist(job)
+        reporter = asyncio.create_task(self._report_progress(job))
+        try:
+            embeddings = await embedding_service.get_embeddings_async()
+            job.document_id, job.chunks = await document_service.process_pdf(
+                job.file_path, embeddings, job.user_id, job.document_id, job.progress,
+                parse_executor=self._executor, content_hash=job.content_hash,
+                filename=job.filename
+            )
+            job.state = "completed"
+        except Exception as e:
+            job.state = "failed"
+            job.error = str(e)
+        finally:
+            job.finished_at = time.time()
+            reporter.cancel()
+            if os.path.exists(job.file_path):
+                os.remove(job.file_path)
+        await self._persist(job)
+
+    async def _report_progress(self, job: IngestionJob):
+        while True:
+            await asyncio.sleep(INGEST_PROGRESS_INTERVAL)
+            await self._persist(job)
+
+    async def _persist(self, job: IngestionJob):
+        db = get_db()
+        if db is None:
+            return
+        try:
+            await db.ingestion_jobs.replace_one({"_id": job.id}, job.to_dict(), upsert=True)
+        except Exception as e:
+            logger.warning(f"Could not persist ingestion job {job.id}: {str(e)}")
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.finished_at]
+        for job_id in finished[:max(0, len(self.jobs) - INGEST_KEEP_FINISHED)]:
+            del self.jobs[job_id]
+
+ingestion_jobs = IngestionJobManager()
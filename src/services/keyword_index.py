@@ -0,0 +1,134 @@
+import json
+import math
+import os
+import re
+from collections import Counter
+import numpy as np
+from src.services.vector_index import top_k, _write_file
+
+# BM25 inverted index over the chunk texts of one VectorIndex generation.
+# Stored next to the vector files and memory-mapped the same way:
+#   terms-<v>.json      - sorted vocabulary; term id = position
+#   postings-<v>.i32    - chunk ids, grouped by term id, ascending within a term
+#   tfs-<v>.u16         - term frequency for each posting
+#   termoffs-<v>.i64    - n_terms + 1 offsets into postings/tfs
+#   doclens-<v>.i32     - token count per chunk
+BM25_K1 = 1.2
+BM25_B = 0.75
+RRF_K = 60
+
+# Identifiers such as "PX-14187", "4.2.1" or "ISO/IEC" stay one token; their
+# parts are indexed too so "14187" alone still matches.
+_TOKEN = re.compile(r"[a-z0-9]+(?:[-._/][a-z0-9]+)*")
+_SPLIT = re.compile(r"[-._/]")
+
+def tokenize(text: str):
+    tokens = []
+    for match in _TOKEN.findall(text.lower()):
+        tokens.append(match)
+        if len(match) > 1 and _SPLIT.search(match):
+            tokens.extend(part for part in _SPLIT.split(match) if part)
+    return tokens
+
+def write_keyword_index(path: str, version: str, texts):
+    # Builds the postings in memory from the committed chunk texts and returns
+    # the file names to record in the manifest
+    postings = {}
+    lengths = np.zeros(len(texts), dtype=np.int32)
+    for chunk_id, text in enumerate(texts):
+        counts = Counter(tokenize(text))
+        lengths[chunk_id] = sum(counts.values())
+        for term, tf in counts.items():
+            postings.setdefault(term, []).append((chunk_id, tf))
+
+    terms = sorted(postings)
+    offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(postings[t]) for t in terms])
+    ids = np.empty(int(offsets[-1]), dtype=np.int32)
+    tfs = np.empty(int(offsets[-1]), dtype=np.uint16)
+    for term_id, term in enumerate(terms):
+        entries = postings[term]
+        start = int(offsets[term_id])
+        ids[start:start + len(entries)] = [chunk_id for chunk_id, _ in entries]
+        tfs[start:start + len(entries)] = [min(tf, 65535) for _, tf in entries]
+
+    files = {
+        "terms": f"terms-{version}.json",
+        "postings": f"postings-{version}.i32",
+        "tfs": f"tfs-{version}.u16",
+        "termOffsets": f"termoffs-{version}.i64",
+        "docLengths": f"doclens-{version}.i32",
+    }
+    _write_file(os.path.join(path, files["terms"]), json.dumps(terms).encode("utf-8"))
+    _write_file(os.path.join(path, files["postings"]), ids.tobytes())
+    _write_file(os.path.join(path, files["tfs"]), tfs.tobytes())
+    _write_file(os.path.join(path, files["termOffsets"]), offsets.tobytes())
+    _write_file(os.path.join(path, files["docLengths"]), lengths.tobytes())
+    return files
+
+
+class KeywordIndex:
+    def __init__(self, term_ids: dict, postings, tfs, offsets, lengths):
+        self.term_ids = term_ids
+        self.postings = postings
+        self.tfs = tfs
+        self.offsets = offsets
+        self.lengths = lengths
+        avg_length = float(lengths.mean()) if len(lengths) else 0.0
+        # BM25 length normalisation depends only on the chunk, not the query
+        self._norm = (BM25_K1 * (1 - BM25_B + BM25_B * lengths / (avg_length or 1.0))).astype(np.float32)
+
+    @classmethod
+    def load(cls, path: str, files: dict, count: int):
+        if "terms" not in files:
+            # Generation written before keyword indexing existed
+            return None
+        with open(os.path.join(path, files["terms"]), "r") as f:
+            terms = json.load(f)
+
+        def mapped(name, dtype, shape):
+            if shape[0] == 0:
+                return np.empty(shape, dtype=dtype)
+            return np.memmap(os.path.join(path, files[name]), dtype=dtype, mode="r", shape=shape)
+
+        offsets = mapped("termOffsets", np.int64, (len(terms) + 1,))
+        size = int(offsets[-1]) if len(offsets) else 0
+        return cls(
+            {term: i for i, term in enumerate(terms)},
+            mapped("postings", np.int32, (size,)),
+            mapped("tfs", np.uint16, (size,)),
+            offsets,
+            mapped("docLengths", np.int32, (count,)),
+        )
+
+    def nbytes(self):
+        return (self.postings.nbytes + self.tfs.nbytes + self.offsets.nbytes
+                + self.lengths.nbytes + self._norm.nbytes)
+
+    def search(self, query: str, k: int = 4):
+        count = len(self.lengths)
+        term_ids = {self.term_ids[t] for t in tokenize(query) if t in self.term_ids}
+        if not term_ids or count == 0:
+            return []
+        scores = np.zeros(count, dtype=np.float32)
+        for term_id in term_ids:
+            start, end = int(self.offsets[term_id]), int(self.offsets[term_id + 1])
+            ids = self.postings[start:end]
+            tf = self.tfs[start:end].astype(np.float32)
+            idf = math.log(1 + (count - len(ids) + 0.5) / (len(ids) + 0.5))
+            # A chunk id appears once per term, so plain fancy-index += is safe
+            scores[ids] += idf * tf * (BM25_K1 + 1) / (tf + self._norm[ids])
+        matched = np.flatnonzero(scores)
+        return [(int(matched[i]), score) for i, score in top_k(scores[matched], k)]
+
+    def search_batch(self, queries, k: int = 4):
+        return [self.search(query, k) for query in queries]
+
+
+def reciprocal_rank_fusion(rankings, k: int, rrf_k: int = RRF_K):
+    # rankings: lists of hashable ids, best first. Score = sum of 1 / (rrf_k + rank)
+    fused = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking):
+            fused[item] = fused.get(item, 0.0) + 1.0 / (rrf_k + rank + 1)
+    return sorted(fused.items(), key=lambda pair: -pair[1])[:k]
@@ -0,0 +1,170 @@
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Adds a Server-Timing header (per-stage durations) to every response
+SERVER_TIMING = os.getenv("SERVER_TIMING", "on").lower() not in ("0", "off", "false")
+
+# Seconds; from sub-millisecond cache lookups up to slow LLM calls
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Stage timings of the request being handled; set by the HTTP middleware.
+# Tasks copy the context, so the list itself is shared and appended to.
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labelvalues):
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["counts"][i] += 1
+                    break
+            series["sum"] += value
+            series["count"] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labelvalues, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, series["counts"]):
+                    cumulative += count
+                    labels = _format_labels(self.labelnames, labelvalues, ("le", _format_value(bound)))
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = _format_labels(self.labelnames, labelvalues, ("le", "+Inf"))
+                lines.append(f"{self.name}_bucket{labels} {series['count']}")
+                labels = _format_labels(self.labelnames, labelvalues)
+                lines.append(f"{self.name}_sum{labels} {_format_value(series['sum'])}")
+                lines.append(f"{self.name}_count{labels} {series['count']}")
+        return lines
+
+    def snapshot(self):
+        with self._lock:
+            return {labelvalues: {"count": s["count"], "sum": s["sum"]} for labelvalues, s in self._series.items()}
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, *labelvalues):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labelvalues, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(value)}")
+        return lines
+
+class Gauge:
+    # Read when /metrics is scraped; `read` returns a number, or a dict of
+    # label-value tuples to numbers
+    def __init__(self, name: str, help: str, read, labelnames=()):
+        self.name = name
+        self.help = help
+        self.read = read
+        self.labelnames = tuple(labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        try:
+            values = self.read()
+        except Exception:
+            return []
+        if not isinstance(values, dict):
+            values = {(): values}
+        for labelvalues, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(value)}")
+        return lines
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+
+    def _register(self, metric):
+        return self._metrics.setdefault(metric.name, metric)
+
+    def histogram(self, name: str, help: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def counter(self, name: str, help: str, labelnames=()):
+        return self._register(Counter(name, help, labelnames))
+
+    def gauge(self, name: str, help: str, read, labelnames=()):
+        return self._register(Gauge(name, help, read, labelnames))
+
+    def render(self):
+        # Prometheus text exposition format 0.0.4
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+metrics = MetricsRegistry()
+
+REQUEST_SECONDS = metrics.histogram(
+    "http_request_duration_seconds", "HTTP request latency by route template.", ("method", "route", "status")
+)
+STAGE_SECONDS = metrics.histogram(
+    "rag_stage_duration_seconds", "Time spent in one stage of serving a request.", ("stage",)
+)
+
+def record_stage(stage: str, seconds: float):
+    STAGE_SECONDS.observe(seconds, stage)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.append((stage, seconds))
+
+@contextmanager
+def timed(stage: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - started)
+
+def start_request():
+    timings = []
+    _request_timings.set(timings)
+    return timings
+
+def server_timing_header(timings, total: float):
+    # Repeated stages (e.g. two DB writes) are summed into one entry
+    merged = {}
+    for stage, seconds in timings:
+        merged[stage] = merged.get(stage, 0.0) + seconds
+    entries = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in merged.items()]
+    entries.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(entries)
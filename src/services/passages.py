@@ -0,0 +1,112 @@
+import os
+import re
+
+# Turns ranked chunk hits into the passages placed in the prompt. Chunks are
+# split with a 200-char overlap, so neighbouring hits repeat text; with the
+# start_index the splitter records per chunk, hits that overlap on the same
+# page are joined into one passage and the repeated text is sent once.
+
+# Searches per question, the question itself included; 1 disables the extra
+# query variants. The default adds the follow-up variant only; the content
+# words variant (3) helps dense retrieval but repeats the BM25 ranking.
+MULTI_QUERY_VARIANTS = max(1, int(os.getenv("MULTI_QUERY_VARIANTS", 2)))
+# Join overlapping hits and drop duplicate texts
+CONTEXT_MERGE = os.getenv("CONTEXT_MERGE", "on").lower() not in ("0", "off", "false")
+# Grow every passage with the neighbouring chunks of its page until it spans
+# this many characters; 0 sends the hits as retrieved
+PARENT_WINDOW_CHARS = int(os.getenv("PARENT_WINDOW_CHARS", 0))
+
+STOPWORDS = frozenset((
+    "a about an and any are as at be by can could did do does for from had has have how i in is it its "
+    "me my of on or our please say says should so tell than that the their them there these they this "
+    "those to us was we were what when where which who whom why will with would you your"
+).split())
+
+_WORD = re.compile(r"\w+(?:[-./]\w+)*")
+
+def query_variants(query: str, history=None, count: int = MULTI_QUERY_VARIANTS):
+    # Rewrites that cost no model call: the question; with count >= 2, for a
+    # follow-up such as "and clause 4?" the previous question joined with it,
+    # which restores the subject; with count >= 3, the content words only
+    variants = [query]
+    previous = next((m.get("content") for m in reversed(history or []) if m.get("role") == "user"), None)
+    if count >= 2 and previous and previous != query:
+        variants.append(f"{previous} {query}")
+    keywords = " ".join(w for w in _WORD.findall(query) if w.lower() not in STOPWORDS)
+    if count >= 3 and keywords and keywords.lower() != query.lower():
+        variants.append(keywords)
+    return variants
+
+def make_passage(document_id: str, row: int, text: str, metadata: dict):
+    # Chunks indexed before start_index was recorded have no offsets; they
+    # are only deduplicated by text
+    start = metadata.get("start_index")
+    return {
+        "documentId": document_id,
+        "page": metadata.get("page"),
+        "start": start,
+        "end": start + len(text) if start is not None else None,
+        "rows": [row],
+        "text": text,
+    }
+
+def _overlaps(a: dict, b: dict):
+    return (a["start"] is not None and b["start"] is not None
+            and a["documentId"] == b["documentId"] and a["page"] == b["page"]
+            and a["start"] < b["end"] and b["start"] < a["end"])
+
+def _absorb(passage: dict, other: dict):
+    # The text of whichever starts first, then the part of the other past its end
+    first, second = (passage, other) if passage["start"] <= other["start"] else (other, passage)
+    text = first["text"]
+    if second["start"] >= first["end"]:
+        # Adjacent chunks: the splitter stripped the whitespace between them
+        text += " " + second["text"]
+    elif second["end"] > first["end"]:
+        text += second["text"][first["end"] - second["start"]:]
+    passage["text"] = text
+    passage["start"] = first["start"]
+    passage["end"] = max(first["end"], second["end"])
+    passage["rows"] = sorted(set(passage["rows"]) | set(other["rows"]))
+
+def merge_passages(passages):
+    # passages: best first; a merged passage keeps the rank of its best hit
+    merged, seen = [], set()
+    for passage in passages:
+        if passage["text"] in seen:
+            continue
+        seen.add(passage["text"])
+        target = next((p for p in merged if _overlaps(p, passage)), None)
+        if target is None:
+            merged.append(dict(passage))
+            continue
+        _absorb(target, passage)
+        # The grown passage may now reach one ranked below it
+        while True:
+            other = next((p for p in merged if p is not target and _overlaps(p, target)), None)
+            if other is None:
+                break
+            _absorb(target, other)
+            merged.remove(other)
+    return merged
+
+def expand_passage(passage: dict, fetch, window: int):
+    # fetch(document_id, row) -> neighbouring chunk as a passage, or None.
+    # Alternates the next and the previous chunk of the same page.
+    if passage["start"] is None:
+        return passage
+    while passage["end"] - passage["start"] < window:
+        grew = False
+        for row in (passage["rows"][-1] + 1, passage["rows"][0] - 1):
+            neighbour = fetch(passage["documentId"], row) if row >= 0 else None
+            if neighbour is None or neighbour["page"] != passage["page"] or neighbour["start"] is None:
+                continue
+            if neighbour["start"] > passage["end"] + 2 or neighbour["end"] < passage["start"] - 2:
+                continue
+            _absorb(passage, neighbour)
+            grew = True
+            if passage["end"] - passage["start"] >= window:
+                break
+        if not grew:
+            break
+    return passage
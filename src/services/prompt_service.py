@@ -1,4 +1,55 @@
+import logging
 import os
+import re
+
+logger = logging.getLogger(__name__)
+
+# Whole prompt budget, and the share of it recent history and the rolling
+# summary may take before the document context gets the rest
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", 2000))
+PROMPT_HISTORY_TOKENS = int(os.getenv("PROMPT_HISTORY_TOKENS", 400))
+PROMPT_SUMMARY_TOKENS = int(os.getenv("PROMPT_SUMMARY_TOKENS", 250))
+# A chunk trimmed below this many tokens is dropped instead
+PROMPT_MIN_CHUNK_TOKENS = int(os.getenv("PROMPT_MIN_CHUNK_TOKENS", 60))
+
+_PIECES = re.compile(r"\w+|[^\w\s]")
+_LONG_WORDS = re.compile(r"\w{7,}")
+
+def estimate_tokens(text: str):
+    # Close to SentencePiece/BPE counts for English prose: one token per word
+    # or symbol, plus one per extra 6 characters of a long word. Two regex
+    # passes; no tokenizer download and no API call.
+    if not text:
+        return 0
+    return len(_PIECES.findall(text)) + sum((len(word) - 1) // 6 for word in _LONG_WORDS.findall(text))
+
+def trim_to_tokens(text: str, max_tokens: int):
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    if max_tokens <= 0:
+        return ""
+    cut = int(len(text) * max_tokens / estimate_tokens(text))
+    while cut > 0:
+        trimmed = text[:cut].rsplit(None, 1)[0] if " " in text[:cut] else text[:cut]
+        if estimate_tokens(trimmed) + 1 <= max_tokens:
+            return trimmed + "…"
+        cut = int(cut * 0.9)
+    return ""
+
+def history_line(message: dict):
+    return f"{'User' if message.get('role') == 'user' else 'Assistant'}: {message.get('content')}"
+
+def recent_that_fit(messages, max_tokens: int):
+    # How many of the newest messages fit in max_tokens as history lines;
+    # messages: oldest first
+    count = 0
+    for m in reversed(messages):
+        cost = estimate_tokens(history_line(m)) + 1
+        if cost > max_tokens:
+            break
+        count += 1
+        max_tokens -= cost
+    return count
 
 SYSTEM_PROMPTS = {
   "default": "You are a helpful AI assistant. Answer questions based on the provided documents accurately and concisely. If you don't know the answer or if it's not in the documents, say so clearly.",
@@ -71,13 +122,13 @@ class PromptService:
         if preset_name not in SYSTEM_PROMPTS:
             raise Exception(f"Invalid preset: {preset_name}")
         self.current_prompt = SYSTEM_PROMPTS[preset_name]
-        print(f"System prompt updated to preset: {preset_name}")
+        logger.info(f"System prompt updated to preset: {preset_name}")
 
     def set_custom_prompt(self, custom_prompt: str):
         if not custom_prompt or not custom_prompt.strip():
             raise Exception("Custom prompt cannot be empty")
         self.current_prompt = custom_prompt
-        print("System prompt updated to custom")
+        logger.info("System prompt updated to custom")
 
     def get_available_presets(self):
         return list(SYSTEM_PROMPTS.keys())
@@ -103,4 +154,76 @@ class PromptService:
 
         return f"{self.current_prompt}\n{history_text}\nContext from the document:\n{context}\n\nUser question: {user_question}\n\nAnswer:"
 
+    def build_budgeted_prompt(self, chunks, user_question, history=[], summary=None,
+                              budget: int = PROMPT_TOKEN_BUDGET):
+        # chunks: retrieval results, best first. Fixed parts are always kept;
+        # then the newest history messages within PROMPT_HISTORY_TOKENS, the
+        # rolling summary, and the chunks in rank order until the budget runs
+        # out. The first chunk that does not fit is trimmed, the rest dropped.
+        remaining = budget - estimate_tokens(self.build_prompt("", user_question))
+
+        history_lines = []
+        history_budget = history_left = min(PROMPT_HISTORY_TOKENS, max(0, remaining // 3))
+        for m in reversed(history):
+            line = history_line(m)
+            cost = estimate_tokens(line) + 1
+            if cost > history_left:
+                # Keep the tail of the conversation even if its newest message is long
+                if not history_lines and history_left - 1 >= PROMPT_MIN_CHUNK_TOKENS:
+                    history_lines.append(trim_to_tokens(line, history_left - 1))
+                break
+            history_lines.insert(0, line)
+            history_left -= cost
+        history_text = ""
+        if history_lines:
+            history_text = "\nChat History:\n" + "\n".join(history_lines) + "\n"
+
+        summary_text = ""
+        if summary:
+            summary = trim_to_tokens(summary, min(PROMPT_SUMMARY_TOKENS, max(0, remaining // 4)))
+            if summary:
+                summary_text = f"\nSummary of earlier conversation:\n{summary}\n"
+        remaining -= estimate_tokens(history_text) + estimate_tokens(summary_text)
+
+        context_chunks, trimmed = [], 0
+        for chunk in chunks:
+            cost = estimate_tokens(chunk) + 2
+            if cost <= remaining:
+                context_chunks.append(chunk)
+                remaining -= cost
+                continue
+            if remaining - 2 >= PROMPT_MIN_CHUNK_TOKENS:
+                context_chunks.append(trim_to_tokens(chunk, remaining - 2))
+                trimmed += 1
+            break
+        context = "\n\n".join(context_chunks)
+
+        prompt = (f"{self.current_prompt}\n{summary_text}{history_text}\nContext from the document:\n{context}"
+                  f"\n\nUser question: {user_question}\n\nAnswer:")
+        stats = {
+            "promptTokens": estimate_tokens(prompt),
+            "chunks": len(context_chunks),
+            "chunksDropped": len(chunks) - len(context_chunks),
+            "chunksTrimmed": trimmed,
+            "historyMessages": len(history_lines),
+            # Older messages left out for lack of room
+            "historyDropped": len(history) - len(history_lines),
+            "historyBudget": history_budget,
+            "summaryUsed": bool(summary_text),
+        }
+        return prompt, stats
+
+    def build_summary_prompt(self, summary, messages, max_tokens: int = PROMPT_SUMMARY_TOKENS):
+        lines = [
+            f"{'User' if m.get('role') == 'user' else 'Assistant'}: {m.get('content')}"
+            for m in messages
+        ]
+        previous = summary or "(none yet)"
+        return (
+            "You maintain a running summary of a conversation between a user and an assistant "
+            "about their documents. Update the summary with the new messages. Keep facts, names, "
+            f"numbers and open questions; drop pleasantries. Stay under {int(max_tokens * 0.75)} words.\n\n"
+            f"Current summary:\n{previous}\n\nNew messages:\n" + "\n".join(lines) + "\n\nUpdated summary:"
+        )
+
 prompt_service = PromptService()
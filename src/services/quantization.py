@@ -0,0 +1,183 @@
+import json
+import os
+import numpy as np
+from src.services.vector_index import top_k, _write_file
+
+# Compact copies of a VectorIndex matrix, written next to the float32 file:
+#   codes-<v>.f16 / .i8 / .pq - one row per chunk (float16, int8 or PQ codes)
+#   codebook-<v>.npy          - int8 per-dimension scales, or PQ centroids
+#   codec-<v>.json            - storage mode and parameters
+# Queries scan the codes only; the float32 rows of the best RERANK_CANDIDATES
+# are then read from the memmap for exact scores. The float32 file stays on
+# disk, but only those few rows are ever paged in.
+#   float16  2 bytes/dim, recall practically unchanged
+#   int8     1 byte/dim, symmetric per-dimension scales
+#   pq       PQ_SUBVECTORS bytes/row: each slice of the vector is replaced by
+#            the id of its nearest of 256 k-means centroids
+VECTOR_STORAGE = os.getenv("VECTOR_STORAGE", "float32")
+VECTOR_STORAGES = ("float32", "float16", "int8", "pq")
+# 0 picks dim // 8 (96 bytes per 768-dim vector)
+PQ_SUBVECTORS = int(os.getenv("PQ_SUBVECTORS", 0))
+PQ_CENTROIDS = 256
+# Smaller documents keep float32 only; PQ needs rows to train on and exact
+# search over a few thousand rows is cheap anyway
+PQ_MIN_ROWS = int(os.getenv("PQ_MIN_ROWS", 4096))
+# Exact re-rank depth per query; 0 returns the approximate scores as they are
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", 100))
+# Rows decoded per step, bounds the float32 scratch space while scanning
+SCAN_ROWS = 8192
+
+_EXTENSIONS = {"float16": "f16", "int8": "i8", "pq": "pq"}
+
+def write_compact_vectors(path: str, version: str, vectors, storage: str = VECTOR_STORAGE):
+    # vectors: the committed unit-length float32 matrix (a memmap is fine).
+    # Returns the file names to record in the manifest; none for float32.
+    if storage not in VECTOR_STORAGES:
+        raise Exception(f"Unknown vector storage '{storage}', expected one of {', '.join(VECTOR_STORAGES)}")
+    count, dim = vectors.shape
+    if storage == "float32" or count == 0 or (storage == "pq" and count < PQ_MIN_ROWS):
+        return {}
+
+    files = {"codes": f"codes-{version}.{_EXTENSIONS[storage]}", "codec": f"codec-{version}.json"}
+    codec = {"storage": storage}
+    codebook = None
+    if storage == "float16":
+        encode = lambda rows: rows.astype(np.float16)
+    elif storage == "int8":
+        codebook = _int8_scales(vectors)
+        encode = lambda rows: np.clip(np.rint(rows / codebook), -127, 127).astype(np.int8)
+    else:
+        codec["subvectors"] = _subvectors(dim)
+        codebook = train_pq(vectors, codec["subvectors"])
+        encode = lambda rows: pq_encode(rows, codebook)
+    if codebook is not None:
+        files["codebook"] = f"codebook-{version}.npy"
+        # Through a file object: np.save given a name ending in ".tmp" would
+        # append ".npy", and stale-file cleanup only spares names ending in ".tmp"
+        codebook_path = os.path.join(path, files["codebook"])
+        with open(f"{codebook_path}.tmp", "wb") as f:
+            np.save(f, codebook)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(f"{codebook_path}.tmp", codebook_path)
+
+    # Encoded slice by slice so the whole matrix is never held in memory
+    codes_path = os.path.join(path, files["codes"])
+    with open(f"{codes_path}.tmp", "wb") as f:
+        for s in range(0, count, SCAN_ROWS):
+            f.write(np.ascontiguousarray(encode(np.asarray(vectors[s:s + SCAN_ROWS]))).tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(f"{codes_path}.tmp", codes_path)
+    _write_file(os.path.join(path, files["codec"]), json.dumps(codec).encode("utf-8"))
+    return files
+
+def _int8_scales(vectors):
+    peak = np.zeros(vectors.shape[1], dtype=np.float32)
+    for s in range(0, len(vectors), SCAN_ROWS):
+        peak = np.maximum(peak, np.abs(vectors[s:s + SCAN_ROWS]).max(axis=0))
+    peak[peak == 0] = 1.0
+    return (peak / 127.0).astype(np.float32)
+
+def _subvectors(dim: int):
+    m = PQ_SUBVECTORS or max(1, dim // 8)
+    # Subvectors must tile the vector exactly
+    while dim % m:
+        m -= 1
+    return m
+
+def train_pq(vectors, m: int, iters: int = 10, sample_size: int = PQ_CENTROIDS * 32, seed: int = 0):
+    # Plain k-means per subspace on a row sample; returns (m, 256, dim // m)
+    rng = np.random.default_rng(seed)
+    count, dim = vectors.shape
+    picks = np.sort(rng.choice(count, min(count, sample_size), replace=False))
+    sample = np.asarray(vectors[picks], dtype=np.float32).reshape(len(picks), m, dim // m)
+    codebook = np.empty((m, PQ_CENTROIDS, dim // m), dtype=np.float32)
+    for sub in range(m):
+        points = sample[:, sub, :]
+        centroids = points[rng.choice(len(points), PQ_CENTROIDS, replace=len(points) < PQ_CENTROIDS)].copy()
+        for _ in range(iters):
+            labels = _nearest(points, centroids)
+            # bincount per coordinate; much faster than np.add.at for narrow subvectors
+            sums = np.stack([np.bincount(labels, weights=points[:, d], minlength=PQ_CENTROIDS)
+                             for d in range(points.shape[1])], axis=1)
+            counts = np.bincount(labels, minlength=PQ_CENTROIDS)
+            empty = counts == 0
+            # Re-seed empty centroids from random points instead of leaving them dead
+            sums[empty] = points[rng.choice(len(points), int(empty.sum()))]
+            counts[empty] = 1
+            centroids = (sums / counts[:, None]).astype(np.float32)
+        codebook[sub] = centroids
+    return codebook
+
+def _nearest(points, centroids):
+    # argmin ||p - c||^2 == argmax (p.c - ||c||^2 / 2)
+    return np.argmax(points @ centroids.T - 0.5 * (centroids * centroids).sum(axis=1), axis=1)
+
+def pq_encode(vectors, codebook):
+    m, _, sub_dim = codebook.shape
+    parts = np.asarray(vectors, dtype=np.float32).reshape(len(vectors), m, sub_dim)
+    return np.stack([_nearest(parts[:, sub, :], codebook[sub]) for sub in range(m)], axis=1).astype(np.uint8)
+
+
+class CompactVectors:
+    def __init__(self, storage: str, codes, codebook=None, rerank: int = RERANK_CANDIDATES):
+        self.storage = storage
+        self.codes = codes
+        self.codebook = codebook
+        self.rerank = rerank
+
+    @classmethod
+    def load(cls, path: str, files: dict, count: int, dim: int):
+        if "codes" not in files:
+            # float32 storage, or a generation written before compact storage existed
+            return None
+        with open(os.path.join(path, files["codec"]), "r") as f:
+            codec = json.load(f)
+        storage = codec["storage"]
+        codebook = np.load(os.path.join(path, files["codebook"])) if "codebook" in files else None
+        if storage == "pq":
+            dtype, shape = np.uint8, (count, codec["subvectors"])
+        else:
+            dtype, shape = (np.float16 if storage == "float16" else np.int8), (count, dim)
+        codes = np.memmap(os.path.join(path, files["codes"]), dtype=dtype, mode="r", shape=shape)
+        return cls(storage, codes, codebook)
+
+    def nbytes(self):
+        return self.codes.nbytes + (self.codebook.nbytes if self.codebook is not None else 0)
+
+    def scores(self, queries):
+        # Approximate (count x n_queries) dot products, decoded SCAN_ROWS at a time
+        count = len(self.codes)
+        out = np.empty((count, len(queries)), dtype=np.float32)
+        if self.storage == "pq":
+            m, n_centroids, sub_dim = self.codebook.shape
+            # Asymmetric distance: per query, one (m x 256) table of partial dot
+            # products; a row's score is the sum of m table lookups
+            tables = np.einsum("qms,mcs->qmc", queries.reshape(len(queries), m, sub_dim), self.codebook)
+            tables = tables.reshape(len(queries), m * n_centroids)
+            shift = (np.arange(m) * n_centroids).astype(np.int32)
+            for s in range(0, count, SCAN_ROWS):
+                ids = self.codes[s:s + SCAN_ROWS].astype(np.int32) + shift
+                for j in range(len(queries)):
+                    out[s:s + len(ids), j] = tables[j][ids].sum(axis=1)
+            return out
+        weights = queries.T if self.storage == "float16" else (queries * self.codebook).T
+        for s in range(0, count, SCAN_ROWS):
+            out[s:s + SCAN_ROWS] = self.codes[s:s + SCAN_ROWS].astype(np.float32) @ weights
+        return out
+
+    def search_batch(self, vectors, queries, k: int = 4):
+        # vectors: the float32 matrix, read only for the re-rank candidates
+        scores = self.scores(queries)
+        if self.rerank <= 0:
+            return [top_k(scores[:, j], k) for j in range(len(queries))]
+        results = []
+        for j, query in enumerate(queries):
+            candidates = np.array(sorted(i for i, _ in top_k(scores[:, j], max(k, self.rerank))), dtype=np.int64)
+            if len(candidates) == 0:
+                results.append([])
+                continue
+            exact = vectors[candidates] @ query
+            results.append([(int(candidates[i]), s) for i, s in top_k(exact, k)])
+        return results
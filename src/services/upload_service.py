@@ -0,0 +1,35 @@
+import hashlib
+import os
+import aiofiles
+from fastapi import UploadFile
+
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", 1024 * 1024))
+MAX_UPLOAD_MB = int(os.getenv("MAX_UPLOAD_MB", 100))
+
+class UploadTooLargeError(Exception):
+    pass
+
+async def save_upload_file(file: UploadFile, file_path: str, max_bytes: int,
+                           chunk_size: int = UPLOAD_CHUNK_SIZE):
+    # Copy in fixed-size chunks so memory per upload stays at one chunk, hashing
+    # as we go. The .part name keeps half-written files out of the workers' way.
+    digest = hashlib.sha256()
+    size = 0
+    part_path = f"{file_path}.part"
+    try:
+        async with aiofiles.open(part_path, 'wb') as out_file:
+            while True:
+                chunk = await file.read(chunk_size)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLargeError(f"File exceeds the {max_bytes // (1024 * 1024)} MB upload limit")
+                digest.update(chunk)
+                await out_file.write(chunk)
+        os.replace(part_path, file_path)
+    except BaseException:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        raise
+    return size, digest.hexdigest()
@@ -0,0 +1,343 @@
+import json
+import os
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+import numpy as np
+try:
+    import fcntl
+except ImportError:
+    # Windows: commits to the same directory are not serialized
+    fcntl = None
+
+# On-disk layout (one directory per index):
+#   manifest.json          - points at the current generation of data files
+#   vectors-<v>.f32        - contiguous row-major float32 matrix (count x dim)
+#   texts-<v>.bin          - chunk texts, utf-8, concatenated
+#   offsets-<v>.i64        - count + 1 byte offsets into texts-<v>.bin
+#   metadata-<v>.json      - per-chunk metadata list
+#   terms-/postings-/...   - BM25 keyword index over the same chunks (keyword_index.py)
+#   codes-/codebook-/...   - optional float16/int8/PQ copy of the vectors (quantization.py)
+# Data files are immutable; a new upload writes a new generation and swaps
+# manifest.json atomically, so readers in other workers never see a torn index.
+MANIFEST_FILE = "manifest.json"
+# Held while a generation is committed or the index cleared (see _directory_lock)
+LOCK_FILE = ".lock"
+
+
+class VectorIndex:
+    def __init__(self, path: str):
+        self.path = path
+        self.manifest = None
+        self.vectors = None
+        self.texts = None
+        self.offsets = None
+        self.metadata = []
+        self.keywords = None
+        self.compact = None
+        self._manifest_stamp = None
+
+    @staticmethod
+    def write(path: str, vectors, texts, metadatas=None, storage: str = None, **extra):
+        writer = VectorIndexWriter(path, storage)
+        try:
+            writer.add(0, vectors, texts, metadatas)
+            return writer.commit(**extra)
+        except Exception:
+            writer.abort()
+            raise
+
+    def load(self):
+        # A concurrent writer may swap the manifest and unlink the generation
+        # we just read; retry against the new manifest in that case.
+        for _ in range(3):
+            try:
+                return self._load_current()
+            except FileNotFoundError:
+                continue
+        self._reset()
+        return False
+
+    def _load_current(self):
+        manifest_path = os.path.join(self.path, MANIFEST_FILE)
+        if not os.path.exists(manifest_path):
+            self._reset()
+            return False
+        stat = os.stat(manifest_path)
+        with open(manifest_path, "r") as f:
+            manifest = json.load(f)
+
+        files = manifest["files"]
+        count, dim = manifest["count"], manifest["dim"]
+        if count:
+            vectors = np.memmap(os.path.join(self.path, files["vectors"]),
+                                dtype=np.float32, mode="r", shape=(count, dim))
+        else:
+            vectors = np.empty((0, dim), dtype=np.float32)
+        texts_path = os.path.join(self.path, files["texts"])
+        texts = (np.memmap(texts_path, dtype=np.uint8, mode="r")
+                 if os.path.getsize(texts_path) else np.empty(0, dtype=np.uint8))
+        offsets = np.memmap(os.path.join(self.path, files["offsets"]),
+                            dtype=np.int64, mode="r", shape=(count + 1,))
+        with open(os.path.join(self.path, files["metadata"]), "r") as f:
+            metadata = json.load(f)
+        from src.services.quantization import CompactVectors
+        compact = CompactVectors.load(self.path, files, count, dim)
+
+        self.manifest = manifest
+        self.vectors = vectors
+        self.texts = texts
+        self.offsets = offsets
+        self.metadata = metadata
+        # Loaded by the first keyword search (keyword_index()); listing,
+        # vector-only search and text fetches never need it
+        self.keywords = None
+        self.compact = compact
+        self._manifest_stamp = (stat.st_mtime_ns, stat.st_ino)
+        return True
+
+    def refresh(self):
+        # Cheap stat() per call so every worker picks up uploads made elsewhere
+        try:
+            stat = os.stat(os.path.join(self.path, MANIFEST_FILE))
+        except FileNotFoundError:
+            if self.manifest is not None:
+                self._reset()
+            return False
+        if (stat.st_mtime_ns, stat.st_ino) != self._manifest_stamp:
+            return self.load()
+        return True
+
+    def is_loaded(self):
+        return self.manifest is not None
+
+    def vector_bytes(self):
+        # What a full scan keeps resident: the compact codes when present
+        # (re-ranking pages in only a few float32 rows), else the float32 matrix
+        if self.compact is not None:
+            return self.compact.nbytes()
+        return self.vectors.nbytes
+
+    def get_text(self, i: int):
+        start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+        return self.texts[start:end].tobytes().decode("utf-8")
+
+    def search(self, query_vector, k: int = 4):
+        return self.search_batch([query_vector], k)[0]
+
+    def search_batch(self, query_vectors, k: int = 4):
+        queries = normalize_rows(np.atleast_2d(np.asarray(query_vectors, dtype=np.float32)))
+        if not self.is_loaded() or len(self) == 0:
+            return [[] for _ in range(len(queries))]
+        if self.compact is not None:
+            return self.compact.search_batch(self.vectors, queries, k)
+        # One (count x dim) @ (dim x n) product for the whole batch; the matmul
+        # streams the memmap pages in place without copying the matrix.
+        scores = self.vectors @ queries.T
+        return [top_k(scores[:, j], k) for j in range(scores.shape[1])]
+
+    def keyword_index(self):
+        manifest = self.manifest
+        if self.keywords is None and manifest is not None:
+            # Imported here: keyword_index builds on this module's helpers
+            from src.services.keyword_index import KeywordIndex
+            try:
+                self.keywords = KeywordIndex.load(self.path, manifest["files"], manifest["count"])
+            except FileNotFoundError:
+                # A newer generation replaced this one since it was mapped; the
+                # next refresh() maps it, until then there are no keyword hits
+                return None
+        return self.keywords
+
+    def keyword_search_batch(self, queries, k: int = 4):
+        keywords = self.keyword_index() if self.is_loaded() else None
+        if keywords is None:
+            return [[] for _ in queries]
+        return keywords.search_batch(queries, k)
+
+    def clear(self):
+        manifest_path = os.path.join(self.path, MANIFEST_FILE)
+        if os.path.exists(manifest_path):
+            with _directory_lock(self.path):
+                os.remove(manifest_path)
+                _remove_stale_files(self.path, set())
+        self._reset()
+
+    def _reset(self):
+        self.manifest = None
+        self.vectors = None
+        self.texts = None
+        self.offsets = None
+        self.metadata = []
+        self.keywords = None
+        self.compact = None
+        self._manifest_stamp = None
+
+    def __len__(self):
+        return self.manifest["count"] if self.manifest else 0
+
+
+class VectorIndexWriter:
+    # Builds a new index generation from batches that may arrive in any order
+    # (e.g. from concurrent embedding calls). Vectors go straight to disk at
+    # their row offset; nothing is visible to readers until commit().
+    def __init__(self, path: str, storage: str = None):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        # float32, float16, int8 or pq (see quantization.py); None uses VECTOR_STORAGE
+        self.storage = storage
+        self.version = datetime.utcnow().strftime("%Y%m%d%H%M%S") + "-" + uuid.uuid4().hex[:8]
+        self.files = {
+            "vectors": f"vectors-{self.version}.f32",
+            "texts": f"texts-{self.version}.bin",
+            "offsets": f"offsets-{self.version}.i64",
+            "metadata": f"metadata-{self.version}.json",
+        }
+        self.dim = None
+        self.count = 0
+        self._texts = {}
+        self._metadata = {}
+        self._vectors_tmp = os.path.join(path, self.files["vectors"] + ".tmp")
+        self._vectors_file = open(self._vectors_tmp, "wb")
+
+    def add(self, start: int, vectors, texts, metadatas=None):
+        matrix = np.ascontiguousarray(vectors, dtype=np.float32)
+        if matrix.ndim != 2 or matrix.shape[0] != len(texts):
+            raise Exception("Embedding matrix does not match number of chunks")
+        if len(texts) == 0:
+            return
+        if self.dim is None:
+            self.dim = int(matrix.shape[1])
+        elif matrix.shape[1] != self.dim:
+            raise Exception(f"Embedding dimension changed from {self.dim} to {matrix.shape[1]}")
+
+        # Store unit-length rows so cosine similarity is a plain dot product
+        self._vectors_file.seek(start * self.dim * 4)
+        self._vectors_file.write(normalize_rows(matrix).tobytes())
+        metadatas = metadatas or [{} for _ in texts]
+        for i, (text, metadata) in enumerate(zip(texts, metadatas)):
+            self._texts[start + i] = text
+            self._metadata[start + i] = metadata
+        self.count = max(self.count, start + len(texts))
+
+    def commit(self, **extra):
+        # Another writer on the same directory may have renamed its finished
+        # files into place without having written its manifest yet; the
+        # stale-file cleanup at the end would delete them. Commits therefore
+        # run one at a time per directory, across threads and processes.
+        with _directory_lock(self.path):
+            return self._commit(**extra)
+
+    def _commit(self, **extra):
+        if self.dim is None:
+            raise Exception("Cannot write an index without vectors")
+        if len(self._texts) != self.count:
+            raise Exception(f"Index is missing {self.count - len(self._texts)} of {self.count} chunks")
+
+        self._vectors_file.flush()
+        os.fsync(self._vectors_file.fileno())
+        self._vectors_file.close()
+        os.replace(self._vectors_tmp, os.path.join(self.path, self.files["vectors"]))
+
+        encoded = [self._texts[i].encode("utf-8") for i in range(self.count)]
+        offsets = np.zeros(self.count + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(b) for b in encoded])
+        _write_file(os.path.join(self.path, self.files["texts"]), b"".join(encoded))
+        _write_file(os.path.join(self.path, self.files["offsets"]), offsets.tobytes())
+        _write_file(
+            os.path.join(self.path, self.files["metadata"]),
+            json.dumps([self._metadata[i] for i in range(self.count)]).encode("utf-8"),
+        )
+        from src.services.keyword_index import write_keyword_index
+        self.files.update(write_keyword_index(self.path, self.version,
+                                              [self._texts[i] for i in range(self.count)]))
+        from src.services.quantization import VECTOR_STORAGE, write_compact_vectors
+        vectors = np.memmap(os.path.join(self.path, self.files["vectors"]), dtype=np.float32, mode="r",
+                            shape=(self.count, self.dim))
+        storage = self.storage or VECTOR_STORAGE
+        compact_files = write_compact_vectors(self.path, self.version, vectors, storage)
+        self.files.update(compact_files)
+        del vectors
+
+        manifest = {
+            "version": self.version,
+            "count": self.count,
+            "dim": self.dim,
+            "dtype": "float32",
+            "storage": storage if compact_files else "float32",
+            "normalized": True,
+            "files": self.files,
+            "createdAt": datetime.utcnow().isoformat(),
+            **extra,
+        }
+        tmp_manifest = os.path.join(self.path, f".{MANIFEST_FILE}.{self.version}.tmp")
+        _write_file(tmp_manifest, json.dumps(manifest).encode("utf-8"))
+        os.replace(tmp_manifest, os.path.join(self.path, MANIFEST_FILE))
+
+        _remove_stale_files(self.path, set(self.files.values()))
+        return manifest
+
+    def abort(self):
+        if not self._vectors_file.closed:
+            self._vectors_file.close()
+        if os.path.exists(self._vectors_tmp):
+            os.remove(self._vectors_tmp)
+
+
+def normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (matrix / norms).astype(np.float32, copy=False)
+
+
+def top_k(scores, k: int):
+    # argpartition is O(n); only the k winners get fully sorted
+    k = min(k, len(scores))
+    if k <= 0:
+        return []
+    if k < len(scores):
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(len(scores))
+    order = candidates[np.argsort(-scores[candidates], kind="stable")]
+    return [(int(i), float(scores[i])) for i in order]
+
+
+def _write_file(path: str, data: bytes):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+@contextmanager
+def _directory_lock(path: str):
+    if fcntl is None:
+        yield
+        return
+    # flock conflicts between separate open() calls, so threads of one
+    # process exclude each other as well as other workers
+    with open(os.path.join(path, LOCK_FILE), "a") as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def _remove_stale_files(path: str, keep: set):
+    # Unlinking is safe while other workers still map the old generation;
+    # the kernel keeps the pages alive until their mappings are dropped.
+    # Callers hold the directory lock, so no other writer is between renaming
+    # its files into place and publishing its manifest. In-progress .tmp
+    # files belong to concurrent writers and are left alone.
+    prefixes = ("vectors-", "texts-", "offsets-", "metadata-",
+                "terms-", "postings-", "tfs-", "termoffs-", "doclens-", "codes-", "codebook-", "codec-")
+    for name in os.listdir(path):
+        if name.startswith(prefixes) and not name.endswith(".tmp") and name not in keep:
+            try:
+                os.remove(os.path.join(path, name))
+            except OSError:
+                pass
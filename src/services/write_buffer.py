@@ -0,0 +1,206 @@
+import asyncio
+import logging
+import os
+import time
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from src.database import get_db
+from src.services.metrics import record_stage
+
+logger = logging.getLogger(__name__)
+
+WRITE_BUFFER_MAX_BATCH = int(os.getenv("WRITE_BUFFER_MAX_BATCH", 200))
+# Seconds a write may wait in the buffer before it is flushed
+WRITE_BUFFER_INTERVAL = float(os.getenv("WRITE_BUFFER_INTERVAL", 0.2))
+# Writes held while MongoDB is failing; beyond this the oldest messages are dropped
+WRITE_BUFFER_MAX_PENDING = int(os.getenv("WRITE_BUFFER_MAX_PENDING", 10000))
+# Usage increments are sent with a per-flush token that each user document
+# records in this field (the last USAGE_FLUSH_IDS only). A retry of a flush
+# whose outcome is unknown skips the users that already have its token.
+USAGE_FLUSH_FIELD = "usageFlushes"
+USAGE_FLUSH_IDS = 8
+# Flush attempts on stop() while MongoDB is failing, `interval` seconds apart
+WRITE_BUFFER_STOP_RETRIES = int(os.getenv("WRITE_BUFFER_STOP_RETRIES", 3))
+
+class WriteBehindBuffer:
+    # Chat turns enqueue their writes here and return. A background task
+    # flushes every `interval` seconds, or as soon as `max_batch` writes are
+    # waiting: all messages in one insert_many, and one bulk_write with a
+    # single $inc per user, however many turns that user had in the window.
+    def __init__(self, max_batch: int = WRITE_BUFFER_MAX_BATCH, interval: float = WRITE_BUFFER_INTERVAL,
+                 max_pending: int = WRITE_BUFFER_MAX_PENDING, on_usage_flushed=None):
+        self.max_batch = max_batch
+        self.interval = interval
+        self.max_pending = max_pending
+        self.on_usage_flushed = on_usage_flushed
+        self._messages = []
+        self._usage = {}
+        # (flush token, {user_id: increments}) sent but not confirmed yet
+        self._usage_batch = None
+        self._wakeup = None
+        self._task = None
+        self._flush_lock = None
+        self._closing = False
+        self.stats = {"flushes": 0, "messagesWritten": 0, "usageUpdates": 0,
+                      "coalescedIncrements": 0, "failures": 0, "dropped": 0}
+
+    def start(self):
+        if self._task:
+            return
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._closing = False
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        # Drain whatever is still buffered before the process exits. The
+        # flusher is asked to finish rather than cancelled, so a batch that
+        # is already in flight is never lost.
+        if self._task:
+            self._closing = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        for attempt in range(WRITE_BUFFER_STOP_RETRIES):
+            if await self.flush():
+                return True
+            if attempt + 1 < WRITE_BUFFER_STOP_RETRIES:
+                await asyncio.sleep(self.interval)
+        logger.error(f"Write buffer stopped with {self.pending_count()} writes not flushed")
+        return False
+
+    def running(self):
+        return self._task is not None
+
+    def add_message(self, message: dict):
+        # Client-side ids make a retried insert idempotent
+        message.setdefault("_id", ObjectId())
+        self._messages.append(message)
+        if len(self._messages) > self.max_pending:
+            overflow = len(self._messages) - self.max_pending
+            del self._messages[:overflow]
+            self.stats["dropped"] += overflow
+        self._maybe_wake()
+
+    def add_usage(self, user_id, increments: dict):
+        pending = self._usage.setdefault(user_id, {})
+        if pending:
+            self.stats["coalescedIncrements"] += 1
+        for key, amount in increments.items():
+            pending[key] = pending.get(key, 0) + amount
+        self._maybe_wake()
+
+    def pending_messages(self, query: dict):
+        return [m for m in self._messages if all(m.get(k) == v for k, v in query.items())]
+
+    def pending_usage(self, user_id):
+        # Increments MongoDB has not confirmed yet: buffered, and in flight
+        totals = dict(self._usage.get(user_id, {}))
+        if self._usage_batch:
+            for key, amount in self._usage_batch[1].get(user_id, {}).items():
+                totals[key] = totals.get(key, 0) + amount
+        return totals
+
+    def pending_count(self):
+        in_flight = len(self._usage_batch[1]) if self._usage_batch else 0
+        return len(self._messages) + len(self._usage) + in_flight
+
+    def _maybe_wake(self):
+        if self._wakeup and self.pending_count() >= self.max_batch:
+            self._wakeup.set()
+
+    async def _run(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self):
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            while self.pending_count():
+                if not await self._flush_batch():
+                    return False
+            return True
+
+    async def _flush_batch(self):
+        messages = self._messages[:self.max_batch]
+        # Removed up front so writes enqueued during the round trip go to the next batch
+        del self._messages[:len(messages)]
+        db = get_db()
+        started = time.perf_counter()
+        if messages:
+            try:
+                await db.messages.insert_many(messages, ordered=False)
+            except BulkWriteError as e:
+                # Duplicate ids are messages a failed flush already wrote
+                if any(err.get("code") != 11000 for err in e.details.get("writeErrors", [])):
+                    return self._failed(e, messages)
+            except Exception as e:
+                return self._failed(e, messages)
+            self.stats["messagesWritten"] += len(messages)
+
+        if self._usage_batch is None and self._usage:
+            usage = dict(list(self._usage.items())[:self.max_batch])
+            for user_id in usage:
+                del self._usage[user_id]
+            self._usage_batch = (ObjectId(), usage)
+        if self._usage_batch is not None:
+            flush_id, usage = self._usage_batch
+            users = list(usage)
+            try:
+                await db.users.bulk_write([
+                    UpdateOne({"_id": user_id, USAGE_FLUSH_FIELD: {"$ne": flush_id}},
+                              {"$inc": inc, "$push": {USAGE_FLUSH_FIELD: {"$each": [flush_id],
+                                                                          "$slice": -USAGE_FLUSH_IDS}}})
+                    for user_id, inc in usage.items()
+                ], ordered=False)
+            except BulkWriteError as e:
+                # A definite answer: the updates listed in writeErrors were not
+                # applied and all others were. Only the failed increments go
+                # back, merged with newer ones and written under a new token.
+                failed = {users[err["index"]] for err in e.details.get("writeErrors", [])}
+                self._usage_batch = None
+                for user_id in failed:
+                    self._requeue_usage(user_id, usage[user_id])
+                self._usage_flushed([user_id for user_id in users if user_id not in failed])
+                return self._failed(e)
+            except Exception as e:
+                # Timeout or lost connection: any of the updates may have been
+                # applied. The batch is kept as it is, token included, and sent
+                # again before any newer usage; users that already carry the
+                # token no longer match the filter, so nothing is counted twice.
+                return self._failed(e)
+            self._usage_batch = None
+            self._usage_flushed(users)
+
+        record_stage("db_flush", time.perf_counter() - started)
+        self.stats["flushes"] += 1
+        return True
+
+    def _requeue_usage(self, user_id, increments: dict):
+        pending = self._usage.setdefault(user_id, {})
+        for key, amount in increments.items():
+            pending[key] = pending.get(key, 0) + amount
+
+    def _usage_flushed(self, users):
+        self.stats["usageUpdates"] += len(users)
+        if users and self.on_usage_flushed:
+            self.on_usage_flushed(users)
+
+    def _failed(self, error, messages=()):
+        # Messages carry client-side ids, so writing them again is harmless;
+        # they go back in front and are retried on the next tick
+        self._messages[:0] = messages
+        self.stats["failures"] += 1
+        logger.warning(f"Write buffer flush failed, will retry: {str(error)}")
+        return False
+
+    def metrics(self):
+        in_flight = len(self._usage_batch[1]) if self._usage_batch else 0
+        return {"pendingMessages": len(self._messages), "pendingUsers": len(self._usage) + in_flight, **self.stats}
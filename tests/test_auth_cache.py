@@ -0,0 +1,75 @@
+import asyncio
+
+from bson import ObjectId
+
+from src import auth
+from src.database import db_config
+from src.services.auth_cache import AuthCache
+from src.services.fake_backends import FakeCollection, FakeDatabase
+
+
+class SlowCollection(FakeCollection):
+    # find_one reads the document, then waits until the test lets it return
+    def __init__(self):
+        super().__init__()
+        self.read = asyncio.Event()
+        self.release = asyncio.Event()
+
+    async def find_one(self, query, projection=None):
+        doc = await super().find_one(query, projection)
+        self.read.set()
+        await self.release.wait()
+        return doc
+
+
+def test_fill_started_before_an_invalidation_is_dropped():
+    cache = AuthCache(enabled=True)
+    generation = cache.user_generation()
+    cache.invalidate_user("u1")
+    cache.put_user("u1", {"chatCount": 1}, generation)
+    assert cache.get_user("u1") is None
+
+    # Invalidating another user does not affect this fill
+    generation = cache.user_generation()
+    cache.invalidate_user("u2")
+    cache.put_user("u1", {"chatCount": 1}, generation)
+    assert cache.get_user("u1") == {"chatCount": 1}
+
+
+def test_forgotten_invalidations_drop_older_fills():
+    cache = AuthCache(max_entries=2, enabled=True)
+    generation = cache.user_generation()
+    for user_id in ("u1", "u2", "u3"):
+        cache.invalidate_user(user_id)
+    # u1's invalidation is no longer tracked; the fill is dropped to be safe
+    cache.put_user("u1", {"chatCount": 1}, generation)
+    assert cache.get_user("u1") is None
+    cache.put_user("u1", {"chatCount": 1}, cache.user_generation())
+    assert cache.get_user("u1") == {"chatCount": 1}
+
+
+def test_usage_flush_during_user_lookup_is_not_overwritten(monkeypatch):
+    previous = db_config.db
+    db_config.db = FakeDatabase()
+    cache = AuthCache(enabled=True)
+    monkeypatch.setattr(auth, "auth_cache", cache)
+    user_id = ObjectId()
+    token = auth.create_access_token({"_id": str(user_id)})
+
+    async def scenario():
+        users = db_config.db._collections["users"] = SlowCollection()
+        users.docs.append({"_id": user_id, "username": "tester", "chatCount": 1})
+        lookup = asyncio.create_task(auth.get_current_user(token))
+        await users.read.wait()
+        # A usage flush lands after the read and drops the cached document
+        users.docs[0]["chatCount"] = 2
+        cache.invalidate_user(str(user_id))
+        users.release.set()
+        assert (await lookup)["chatCount"] == 1
+        return await auth.get_current_user(token)
+
+    try:
+        user = asyncio.run(asyncio.wait_for(scenario(), 5))
+    finally:
+        db_config.db = previous
+    assert user["chatCount"] == 2
@@ -0,0 +1,125 @@
+import asyncio
+
+import pytest
+from bson import ObjectId
+from fastapi import HTTPException
+
+from src.database import db_config
+from src.routes import chat_routes
+from src.services.answer_cache import AnswerCache
+from src.services.chat_service import chat_service
+from src.services.document_service import document_service
+from src.services.fake_backends import FakeDatabase
+
+
+def run(coro, timeout=5):
+    return asyncio.run(asyncio.wait_for(coro, timeout))
+
+
+def chat(user=None, **body):
+    user = user or {"_id": ObjectId(), "username": "tester", "chatCount": 0, "totalTokens": 0}
+    body = {"message": "What does clause 3 cover?", "stream": False, "documentIds": None, "searchMode": None, **body}
+    return chat_routes.chat(**body, user=user, cache_control=None, x_answer_cache=None)
+
+
+@pytest.fixture
+def documents(monkeypatch):
+    listing = [{"documentId": "doc-a", "version": "1"}, {"documentId": "doc-b", "version": "1"}]
+    embedded = []
+
+    async def embed_query(query):
+        embedded.append(query)
+        return [0.0]
+
+    monkeypatch.setattr(document_service, "list_documents", lambda user_id: listing)
+    monkeypatch.setattr(document_service, "embed_query", embed_query)
+    return embedded
+
+
+def test_unknown_document_ids_are_rejected_before_embedding(documents):
+    with pytest.raises(HTTPException) as raised:
+        run(chat(documentIds=["doc-a", "doc-x", "doc-y"]))
+    assert raised.value.status_code == 404
+    assert "doc-x, doc-y" in raised.value.detail
+    assert documents == []
+
+
+def test_unknown_search_mode_is_a_bad_request(documents):
+    with pytest.raises(HTTPException) as raised:
+        run(chat(searchMode="fuzzy"))
+    assert raised.value.status_code == 400
+    assert documents == []
+
+
+def test_cached_answers_are_scoped_to_the_conversation(documents, monkeypatch):
+    previous = db_config.db
+    db_config.db = FakeDatabase()
+    conversation = {"history": []}
+    prompts = []
+
+    async def get_prompt_history(user_id):
+        return conversation["history"], None, True
+
+    async def generate_response(prompt):
+        prompts.append(prompt)
+        return f"answer {len(prompts)}"
+
+    async def retrieve_context(*args, **kwargs):
+        return ["Clause 3 covers invoices. Clause 4 covers refunds."]
+
+    monkeypatch.setattr(chat_routes, "answer_cache", AnswerCache(enabled=True))
+    monkeypatch.setattr(chat_service, "get_prompt_history", get_prompt_history)
+    monkeypatch.setattr(chat_service, "generate_response", generate_response)
+    monkeypatch.setattr(chat_service, "schedule_summary_update", lambda user_id: None)
+    monkeypatch.setattr(document_service, "retrieve_context", retrieve_context)
+    invoices = [{"role": "user", "content": "Which clause covers invoices?"},
+                {"role": "assistant", "content": "Clause 3."}]
+    refunds = [{"role": "user", "content": "Which clause covers refunds?"},
+               {"role": "assistant", "content": "Clause 4."}]
+    try:
+        answers = []
+        for history in (invoices, refunds, invoices):
+            conversation["history"] = history
+            answers.append(run(chat(message="And the one after it?")))
+    finally:
+        db_config.db = previous
+
+    assert [a["answer"] for a in answers] == ["answer 1", "answer 2", "answer 1"]
+    assert [a["cached"] for a in answers] == [None, None, "exact"]
+    assert len(prompts) == 2
+
+
+def test_usage_totals_include_buffered_increments(documents, monkeypatch):
+    previous = db_config.db
+    db_config.db = FakeDatabase()
+    user = {"_id": ObjectId(), "username": "tester", "chatCount": 2, "totalTokens": 100}
+
+    async def generate_response(prompt):
+        return "12345678"
+
+    async def retrieve_context(*args, **kwargs):
+        return []
+
+    monkeypatch.setattr(chat_routes, "answer_cache", AnswerCache(enabled=False))
+    monkeypatch.setattr(chat_service, "generate_response", generate_response)
+    monkeypatch.setattr(chat_service, "schedule_summary_update", lambda user_id: None)
+    monkeypatch.setattr(document_service, "retrieve_context", retrieve_context)
+
+    async def scenario():
+        # A long interval: nothing is flushed while the chats run, and the
+        # user document the requests see keeps its stored counters
+        chat_service.writes.interval = 60
+        chat_service.writes.start()
+        try:
+            return [await chat(user=user, message="1234") for _ in range(5)]
+        finally:
+            await chat_service.writes.stop()
+            chat_service.writes.interval = write_interval
+
+    write_interval = chat_service.writes.interval
+    try:
+        responses = run(scenario())
+    finally:
+        db_config.db = previous
+    assert [r["usage"]["chatCount"] for r in responses] == [3, 4, 5, 6, 7]
+    assert responses[-1]["usage"]["totalTokens"] == 100 + 5 * 3
@@ -0,0 +1,61 @@
+import asyncio
+
+import pytest
+
+from src.services.embedding_scheduler import EmbeddingScheduler
+
+
+class FailingEmbeddings:
+    async def aembed_documents(self, texts):
+        await asyncio.sleep(0)
+        raise RuntimeError("embedding API down")
+
+
+class EchoEmbeddings:
+    async def aembed_documents(self, texts):
+        await asyncio.sleep(0.001)
+        return [[float(len(t))] for t in texts]
+
+
+def run(coro, timeout=5):
+    return asyncio.run(asyncio.wait_for(coro, timeout))
+
+
+def batch_source(count, closed):
+    async def batches():
+        try:
+            for start in range(count):
+                yield start, [f"chunk {start}"]
+        finally:
+            closed.append(True)
+    return batches()
+
+
+@pytest.mark.parametrize("concurrency", [2, 4, 8])
+def test_failed_batch_raises_instead_of_hanging(concurrency):
+    scheduler = EmbeddingScheduler(FailingEmbeddings(), batch_size=1, max_concurrency=concurrency,
+                                   max_retries=0)
+    closed = []
+
+    async def consume():
+        async for _ in scheduler.stream_batches(batch_source(100, closed)):
+            await asyncio.sleep(0.01)  # slower than the embedder
+
+    with pytest.raises(RuntimeError, match="embedding API down"):
+        run(consume())
+    assert closed == [True]
+
+
+def test_slow_consumer_gets_every_batch():
+    scheduler = EmbeddingScheduler(EchoEmbeddings(), batch_size=1, max_concurrency=4)
+    closed = []
+
+    async def consume():
+        starts = []
+        async for start, _ in scheduler.stream_batches(batch_source(20, closed)):
+            starts.append(start)
+            await asyncio.sleep(0.002)
+        return starts
+
+    assert sorted(run(consume())) == list(range(20))
+    assert closed == [True]
@@ -0,0 +1,105 @@
+import asyncio
+
+import pytest
+from bson import ObjectId
+
+from src.database import db_config
+from src.routes import chat_routes
+from src.services.chat_service import ChatService
+from src.services.document_service import document_service
+from src.services.fake_backends import FakeDatabase
+from src.services.prompt_service import history_line
+
+# Short, medium and long turns; the long ones alone take most of the history budget
+LENGTHS = [5, 40, 8, 150, 3, 12, 60, 4, 250, 20, 6, 90, 7, 30, 500, 9, 15, 45, 5, 70]
+
+
+def run(coro, timeout=10):
+    return asyncio.run(asyncio.wait_for(coro, timeout))
+
+
+@pytest.fixture
+def service(monkeypatch):
+    previous = db_config.db
+    db_config.db = FakeDatabase()
+    service = ChatService()
+    forced = []
+    update = service.update_history_summary
+
+    async def generate_response(prompt):
+        return f"summary {len(prompt)}"
+
+    async def update_history_summary(user_id, *args, **kwargs):
+        if kwargs.get("force"):
+            forced.append(user_id)
+        return await update(user_id, *args, **kwargs)
+
+    async def retrieve_context(*args, **kwargs):
+        return []
+
+    monkeypatch.setattr(service, "generate_response", generate_response)
+    monkeypatch.setattr(service, "update_history_summary", update_history_summary)
+    monkeypatch.setattr(chat_routes, "chat_service", service)
+    monkeypatch.setattr(document_service, "retrieve_context", retrieve_context)
+    service.forced = forced
+    yield service
+    db_config.db = previous
+
+
+def words(turn, role, count):
+    return f"{role}-{turn} " + " ".join(f"w{turn}x{i}" for i in range(count))
+
+
+def assert_every_message_is_somewhere(user_id, prompt, state, pending=()):
+    covered = state.get("coveredUntil")
+    for m in list(db_config.db.messages.docs) + list(pending):
+        if covered is not None and m["timestamp"] <= covered:
+            continue
+        # A single message longer than the budget is kept trimmed, so its start is enough
+        assert history_line(m)[:40] in prompt, f"{m['content'][:12]} is in neither the summary nor the prompt"
+
+
+async def conversation(service, user_id, buffered):
+    if buffered:
+        service.writes.start()
+    try:
+        for turn, length in enumerate(LENGTHS):
+            prompt, stats = await chat_routes._prepare_prompt(user_id, f"question {turn}?")
+            state = await service.get_summary_state(user_id)
+            pending = service.writes.pending_messages({"userId": ObjectId(user_id)})
+            assert_every_message_is_somewhere(user_id, prompt, state, pending)
+            assert stats["historyDropped"] == 0
+            await service.save_message(user_id, "user", words(turn, "user", length // 3))
+            await service.save_message(user_id, "assistant", words(turn, "assistant", length))
+            # What schedule_summary_update runs once the answer is sent
+            await service.update_history_summary(user_id)
+    finally:
+        await service.writes.stop()
+
+
+@pytest.mark.parametrize("buffered", [False, True])
+def test_no_message_is_in_neither_the_prompt_nor_the_summary(service, buffered):
+    user_id = str(ObjectId())
+    run(conversation(service, user_id, buffered))
+    state = run(service.get_summary_state(user_id))
+    assert state["messagesSummarized"] > 0
+    # The update after each turn keeps the uncovered messages within the
+    # budget; the request never has to fold them itself
+    assert service.forced == []
+
+
+def test_request_folds_history_the_budget_drops(service):
+    user_id = str(ObjectId())
+
+    async def scenario():
+        # Stored without the per-turn update, as if it had failed
+        for turn in range(4):
+            await service.save_message(user_id, "user", words(turn, "user", 10))
+            await service.save_message(user_id, "assistant", words(turn, "assistant", 120))
+        prompt, stats = await chat_routes._prepare_prompt(user_id, "and the next one?")
+        state = await service.get_summary_state(user_id)
+        assert_every_message_is_somewhere(user_id, prompt, state)
+        assert stats["historyDropped"] == 0
+
+    run(scenario())
+    assert service.forced == [user_id]
@@ -0,0 +1,21 @@
+from fastapi.testclient import TestClient
+
+import main
+from src.services.metrics import REQUEST_SECONDS
+
+
+def recorded_routes(method):
+    return {labels[1] for labels in REQUEST_SECONDS._series if labels[0] == method}
+
+
+def test_prefixed_routes_get_their_full_template():
+    client = TestClient(main.app)
+    # Unauthenticated: both are rejected after routing, which is all the label needs
+    client.post("/api/chat/", json={"message": "hi"})
+    client.post("/api/upload/")
+    client.get("/api/upload/jobs/1234")
+
+    routes = recorded_routes("POST")
+    assert {"/api/chat/", "/api/upload/"} <= routes
+    assert "/" not in routes
+    assert "/api/upload/jobs/{job_id}" in recorded_routes("GET")
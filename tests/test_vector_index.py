@@ -0,0 +1,60 @@
+import os
+import threading
+
+import numpy as np
+
+from src.services import keyword_index
+from src.services.vector_index import MANIFEST_FILE, VectorIndex, VectorIndexWriter
+
+
+def rows(count, dim=8, seed=0):
+    return np.random.default_rng(seed).standard_normal((count, dim)).astype(np.float32)
+
+
+def test_concurrent_commits_keep_the_winning_generation_intact(tmp_path, monkeypatch):
+    path = str(tmp_path / "doc")
+    first = VectorIndexWriter(path)
+    first.add(0, rows(20, seed=1), [f"first {i}" for i in range(20)])
+    second = VectorIndexWriter(path)
+    second.add(0, rows(30, seed=2), [f"second {i}" for i in range(30)])
+
+    # The first writer stops after renaming its vectors into place, before
+    # its manifest is written
+    paused, resume = threading.Event(), threading.Event()
+    write_keyword_index = keyword_index.write_keyword_index
+
+    def slow_keyword_index(index_path, version, texts):
+        if version == first.version:
+            paused.set()
+            resume.wait(5)
+        return write_keyword_index(index_path, version, texts)
+
+    monkeypatch.setattr(keyword_index, "write_keyword_index", slow_keyword_index)
+    errors = []
+
+    def commit(writer):
+        try:
+            writer.commit()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=commit, args=(first,))]
+    threads[0].start()
+    assert paused.wait(5)
+    threads.append(threading.Thread(target=commit, args=(second,)))
+    threads[1].start()
+    # The second commit must wait for the first instead of cleaning up its files
+    threads[1].join(0.3)
+    assert threads[1].is_alive()
+    resume.set()
+    for thread in threads:
+        thread.join(10)
+
+    assert errors == []
+    index = VectorIndex(path)
+    index.load()
+    assert len(index) == 30
+    assert all(os.path.exists(os.path.join(path, name)) for name in index.manifest["files"].values())
+    stale = [name for name in os.listdir(path) if first.version in name]
+    assert stale == []
+    assert os.path.exists(os.path.join(path, MANIFEST_FILE))
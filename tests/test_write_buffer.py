@@ -0,0 +1,199 @@
+import asyncio
+
+import pytest
+from bson import ObjectId
+from pymongo.errors import AutoReconnect, BulkWriteError
+
+from src.database import db_config
+from src.services import write_buffer
+from src.services.fake_backends import FakeCollection, FakeDatabase
+from src.services.write_buffer import WriteBehindBuffer
+
+
+class LostAckCollection(FakeCollection):
+    # Applies the first bulk_write, then fails as if the acknowledgement was lost
+    def __init__(self):
+        super().__init__()
+        self.lost = 1
+
+    async def bulk_write(self, requests, ordered: bool = True):
+        await super().bulk_write(requests, ordered)
+        if self.lost:
+            self.lost -= 1
+            raise AutoReconnect("connection closed")
+
+
+class PartialCollection(FakeCollection):
+    # The first bulk_write rejects the update at index 1 and applies the rest
+    def __init__(self):
+        super().__init__()
+        self.rejected = 1
+
+    async def bulk_write(self, requests, ordered: bool = True):
+        if not self.rejected:
+            return await super().bulk_write(requests, ordered)
+        self.rejected -= 1
+        await super().bulk_write([op for i, op in enumerate(requests) if i != 1], ordered)
+        raise BulkWriteError({"writeErrors": [{"index": 1, "code": 121, "errmsg": "validation failed"}]})
+
+
+class DownCollection(FakeCollection):
+    async def insert_many(self, docs, ordered: bool = True):
+        raise AutoReconnect("connection refused")
+
+    async def bulk_write(self, requests, ordered: bool = True):
+        raise AutoReconnect("connection refused")
+
+
+@pytest.fixture
+def db():
+    previous = db_config.db
+    db_config.db = FakeDatabase()
+    yield db_config.db
+    db_config.db = previous
+
+
+def run(coro, timeout=5):
+    return asyncio.run(asyncio.wait_for(coro, timeout))
+
+
+async def wait_until(condition, timeout=2):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline, "buffer was not flushed in time"
+        await asyncio.sleep(0.01)
+
+
+def add_users(db, count):
+    users = [ObjectId() for _ in range(count)]
+    db.users.docs.extend({"_id": user_id, "chatCount": 0, "totalTokens": 0} for user_id in users)
+    return users
+
+
+def usage_of(db, user_id):
+    doc = next(d for d in db.users.docs if d["_id"] == user_id)
+    return doc["chatCount"], doc["totalTokens"]
+
+
+def test_flushes_when_max_batch_is_reached(db):
+    buffer = WriteBehindBuffer(max_batch=3, interval=60)
+
+    async def scenario():
+        buffer.start()
+        for i in range(3):
+            buffer.add_message({"content": f"message {i}"})
+        await wait_until(lambda: len(db.messages.docs) == 3)
+        await buffer.stop()
+
+    run(scenario())
+    assert buffer.stats["flushes"] == 1
+    assert db.messages.calls["insert_many"] == 1
+
+
+def test_flushes_after_interval(db):
+    user_id, = add_users(db, 1)
+    flushed = []
+    buffer = WriteBehindBuffer(max_batch=1000, interval=0.05, on_usage_flushed=flushed.extend)
+
+    async def scenario():
+        buffer.start()
+        buffer.add_message({"content": "hello"})
+        buffer.add_usage(user_id, {"chatCount": 1, "totalTokens": 10})
+        buffer.add_usage(user_id, {"chatCount": 1, "totalTokens": 5})
+        await wait_until(lambda: buffer.pending_count() == 0)
+        await buffer.stop()
+
+    run(scenario())
+    assert len(db.messages.docs) == 1
+    assert usage_of(db, user_id) == (2, 15)
+    assert db.users.calls["bulk_write"] == 1
+    assert flushed == [user_id]
+
+
+def test_stop_drains_pending_writes(db):
+    users = add_users(db, 3)
+    buffer = WriteBehindBuffer(max_batch=1000, interval=60)
+
+    async def scenario():
+        buffer.start()
+        for i in range(5):
+            buffer.add_message({"content": f"message {i}"})
+        for user_id in users:
+            buffer.add_usage(user_id, {"chatCount": 1, "totalTokens": 7})
+        return await buffer.stop()
+
+    assert run(scenario())
+    assert len(db.messages.docs) == 5
+    assert [usage_of(db, user_id) for user_id in users] == [(1, 7)] * 3
+    assert buffer.pending_count() == 0
+
+
+def test_lost_ack_is_not_counted_twice(db, monkeypatch):
+    monkeypatch.setattr(write_buffer, "WRITE_BUFFER_STOP_RETRIES", 2)
+    db._collections["users"] = LostAckCollection()
+    users = add_users(db, 2)
+    buffer = WriteBehindBuffer(max_batch=1000, interval=0.01)
+
+    async def scenario():
+        for user_id in users:
+            buffer.add_usage(user_id, {"chatCount": 1, "totalTokens": 7})
+        return await buffer.stop()
+
+    assert run(scenario())
+    assert db.users.calls["bulk_write"] == 2
+    assert [usage_of(db, user_id) for user_id in users] == [(1, 7)] * 2
+    assert buffer.stats["failures"] == 1
+
+
+def test_bulk_write_error_requeues_only_failed_updates(db, monkeypatch):
+    monkeypatch.setattr(write_buffer, "WRITE_BUFFER_STOP_RETRIES", 2)
+    db._collections["users"] = PartialCollection()
+    users = add_users(db, 3)
+    flushed = []
+    buffer = WriteBehindBuffer(max_batch=1000, interval=0.01, on_usage_flushed=flushed.extend)
+
+    async def scenario():
+        for user_id in users:
+            buffer.add_usage(user_id, {"chatCount": 1, "totalTokens": 7})
+        return await buffer.stop()
+
+    assert run(scenario())
+    assert [usage_of(db, user_id) for user_id in users] == [(1, 7)] * 3
+    assert buffer.stats["usageUpdates"] == 3
+    assert sorted(flushed) == sorted(users)
+
+
+def test_stop_gives_up_when_database_stays_down(db, monkeypatch):
+    monkeypatch.setattr(write_buffer, "WRITE_BUFFER_STOP_RETRIES", 3)
+    db._collections["messages"] = DownCollection()
+    db._collections["users"] = DownCollection()
+    user_id, = add_users(db, 1)
+    buffer = WriteBehindBuffer(max_batch=1000, interval=0.01)
+
+    async def scenario():
+        buffer.start()
+        buffer.add_message({"content": "hello"})
+        buffer.add_usage(user_id, {"chatCount": 1, "totalTokens": 7})
+        return await buffer.stop()
+
+    assert not run(scenario())
+    assert buffer.pending_count() == 2
+    assert buffer.stats["failures"] >= 3
+
+
+def test_pending_usage_counts_buffered_and_in_flight_increments(db):
+    db._collections["users"] = LostAckCollection()
+    user_id, = add_users(db, 1)
+    buffer = WriteBehindBuffer(max_batch=1000, interval=60)
+
+    async def scenario():
+        buffer.add_usage(user_id, {"chatCount": 1, "totalTokens": 10})
+        # The ack is lost: the batch stays in flight under its token
+        assert not await buffer.flush()
+        buffer.add_usage(user_id, {"chatCount": 1, "totalTokens": 5})
+        assert buffer.pending_usage(user_id) == {"chatCount": 2, "totalTokens": 15}
+        assert await buffer.flush()
+        assert buffer.pending_usage(user_id) == {}
+
+    run(scenario())
+    assert usage_of(db, user_id) == (2, 15)